@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Benchmark de memória da exportação de notas fiscais para Excel
+
+Cria um banco temporário com N notas fiscais e mede, em um processo separado
+para cada modo, o pico de memória (RSS máximo) e o tempo da exportação:
+
+- pandas: caminho anterior (pd.read_sql_query + DataFrame.to_excel/openpyxl)
+- streaming: exportacao.exportar_notas_xlsx (fetchmany + xlsxwriter constant_memory)
+
+Uso:
+    python benchmarks/benchmark_exportacao.py --linhas 1000000
+    python benchmarks/benchmark_exportacao.py --linhas 200000 --modos streaming
+"""
+
+import argparse
+import os
+import random
+import resource
+import sqlite3
+import subprocess
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+
+def criar_banco(caminho, linhas):
+    """Cria o banco de teste com as tabelas e os índices usados na exportação"""
+    from database import DatabaseManager
+
+    DatabaseManager(caminho)
+    conn = sqlite3.connect(caminho)
+    conn.executemany(
+        "INSERT INTO tb_fornecedores (descricao_fornecedor) VALUES (?)",
+        ((f"FORNECEDOR {i} LTDA",) for i in range(1000))
+    )
+    conn.executemany(
+        """
+        INSERT INTO tb_notas_fiscais
+        (referencia, cnpj, fornecedor_id, tipo_servico, numero_nf,
+         dt_emissao, aliquota, valor_nf, cadastrado_goiania, fora_pais)
+        VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+        """,
+        (
+            (
+                '01/2024', f"{random.randint(10**13, 10**14 - 1)}", random.randint(1, 1000),
+                'Serviço', str(i), f"2024-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}",
+                2.0, round(random.uniform(10, 10000), 2), i % 2, 0
+            )
+            for i in range(linhas)
+        )
+    )
+    conn.commit()
+    conn.close()
+
+
+def exportar(modo, banco, destino):
+    """Executa a exportação no processo atual e imprime o resultado"""
+    inicio = time.perf_counter()
+    conn = sqlite3.connect(banco)
+
+    if modo == 'pandas':
+        import pandas as pd
+        from exportacao import consulta_notas
+
+        df = pd.read_sql_query(consulta_notas(), conn)
+        df.to_excel(destino, index=False, engine='openpyxl')
+        total = len(df)
+    else:
+        from exportacao import exportar_notas_xlsx
+
+        total = exportar_notas_xlsx(conn, destino)
+
+    conn.close()
+    duracao = time.perf_counter() - inicio
+    rss_max_mb = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(f"{modo:<10} {total:>10} linhas  {duracao:8.2f}s  RSS máximo {rss_max_mb:8.1f} MB")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--linhas', type=int, default=1000000, help='Quantidade de notas fiscais')
+    parser.add_argument('--modos', nargs='+', default=['streaming', 'pandas'],
+                        choices=['streaming', 'pandas'], help='Modos de exportação medidos')
+    parser.add_argument('--executar', nargs=3, metavar=('MODO', 'BANCO', 'DESTINO'),
+                        help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.executar:
+        exportar(*args.executar)
+        return 0
+
+    with tempfile.TemporaryDirectory() as pasta:
+        banco = os.path.join(pasta, 'benchmark.db')
+        print(f"Criando banco com {args.linhas} notas fiscais...")
+        criar_banco(banco, args.linhas)
+
+        for modo in args.modos:
+            destino = os.path.join(pasta, f'{modo}.xlsx')
+            # Um processo por modo, para que o RSS máximo de um não afete o outro
+            subprocess.run(
+                [sys.executable, os.path.abspath(__file__), '--executar', modo, banco, destino],
+                check=True, cwd=RAIZ
+            )
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,115 @@
+#!/usr/bin/env python3
+"""
+Benchmark dos parsers de arquivos de municípios
+
+Gera um arquivo CODIGO;NOME;UF com N linhas (layout fixo, como o
+municipios.txt do IBGE, ou com largura variável) e uma fração opcional de
+linhas inválidas, e mede para cada parser do MunicipioImportEngine:
+
+- leitura: apenas a conversão das linhas em registros (iterar_lotes)
+- importação: leitura e gravação em tb_municipios de um banco temporário
+
+Parsers:
+- linhas: conversão linha a linha (extrair_municipio), um aviso por linha inválida
+- colunar: pandas.read_csv em blocos, colunas normalizadas e validadas de uma vez
+- paralelo xN: blocos de bytes convertidos linha a linha em N processos, com a
+  gravação em uma única thread (--processos)
+
+Uso:
+    python benchmarks/benchmark_importacao.py --linhas 1000000
+    python benchmarks/benchmark_importacao.py --linhas 300000 --invalidas 0.05 --layout variavel
+    python benchmarks/benchmark_importacao.py --linhas 5000000 --parsers linhas --processos 2 4 8
+"""
+
+import argparse
+import logging
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+from import_engine import PARSERS, MunicipioImportEngine, abrir_arquivo_municipios  # noqa: E402
+
+UFS = ['AC', 'AL', 'AM', 'BA', 'CE', 'DF', 'GO', 'MG', 'PR', 'RJ', 'RS', 'SC', 'SP', 'TO']
+
+
+def gerar_arquivo(caminho, linhas, invalidas, layout):
+    """Grava o arquivo de teste e devolve a quantidade de linhas inválidas"""
+    total_invalidas = 0
+    with open(caminho, 'w', encoding='utf-8') as arquivo:
+        for i in range(linhas):
+            if invalidas and random.random() < invalidas:
+                arquivo.write(random.choice([f"{i};SEM UF\n", f"{i};;GO\n", f"{i};CIDADE;G0\n"]))
+                total_invalidas += 1
+                continue
+            nome = f"SÃO JOSÉ DO MUNICÍPIO {i}"
+            if layout == 'fixo':
+                arquivo.write(f"{i:07d};{nome:<45};{random.choice(UFS)}\n")
+            else:
+                arquivo.write(f"{i};{nome};{random.choice(UFS)}\n")
+    return total_invalidas
+
+
+def medir(caminho, parser, gravar, processos=1):
+    """Executa a leitura (e a gravação, se pedida) e devolve (segundos, resultado)"""
+    engine = MunicipioImportEngine(parser=parser, processos=processos)
+    conn = None
+    inicio = time.perf_counter()
+    with abrir_arquivo_municipios(caminho) as (formato, linhas):
+        if gravar:
+            conn = sqlite3.connect(os.path.join(os.path.dirname(caminho), f"{parser}_{processos}.db"))
+            resultado = engine.importar(conn, linhas, formato)
+        else:
+            resultado = {'total_linhas': 0, 'importados': 0, 'erros': 0}
+            for lote in engine.iterar_lotes(linhas, formato, resultado):
+                resultado['importados'] += len(lote)
+    duracao = time.perf_counter() - inicio
+    if conn is not None:
+        conn.close()
+    return duracao, resultado
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--linhas', type=int, default=300000, help='linhas do arquivo de teste')
+    parser.add_argument('--invalidas', type=float, default=0.0, help='fração de linhas inválidas (0 a 1)')
+    parser.add_argument('--layout', choices=['fixo', 'variavel'], default='fixo')
+    parser.add_argument('--parsers', nargs='+', choices=PARSERS, default=list(PARSERS))
+    parser.add_argument('--processos', type=int, nargs='*', default=[],
+                        help='quantidades de processos da leitura paralela (além de 1)')
+    parser.add_argument('--repeticoes', type=int, default=3, help='melhor de N execuções')
+    args = parser.parse_args()
+
+    # Os avisos de linhas inválidas fazem parte do custo medido, mas não da saída
+    logging.basicConfig(level=logging.WARNING, handlers=[logging.NullHandler()])
+    random.seed(42)
+
+    with tempfile.TemporaryDirectory() as pasta:
+        caminho = os.path.join(pasta, 'municipios.txt')
+        total_invalidas = gerar_arquivo(caminho, args.linhas, args.invalidas, args.layout)
+        tamanho_mb = os.path.getsize(caminho) / 1024 / 1024
+        print(f"Arquivo: {args.linhas} linhas ({args.layout}, {total_invalidas} inválidas), {tamanho_mb:.1f} MB")
+        print(f"CPUs: {os.cpu_count()}")
+
+        # A leitura paralela converte linha a linha, qualquer que seja o parser
+        configuracoes = [(nome, 1, nome) for nome in args.parsers]
+        configuracoes += [('linhas', n, f"paralelo x{n}") for n in args.processos if n > 1]
+
+        for etapa, gravar in (('leitura', False), ('importação', True)):
+            for nome, processos, rotulo in configuracoes:
+                duracao, resultado = min(
+                    (medir(caminho, nome, gravar, processos) for _ in range(args.repeticoes)), key=lambda r: r[0]
+                )
+                print(
+                    f"{etapa:<11} {rotulo:<12} {duracao:8.3f}s  {args.linhas / duracao:>12,.0f} linhas/s  "
+                    f"{resultado['importados']} registros, {resultado['erros']} erros"
+                )
+
+
+if __name__ == '__main__':
+    main()
@@ -1,5 +1,8 @@
+import base64
 import dbm
+import hashlib
 import io
+import json
 import sqlite3
 from sqlite3 import Error
 import os
@@ -8,13 +11,69 @@ import tempfile
 from flask import make_response
 import pandas as pd
 import logging
-import chardet
 import re
+import threading
+import time
+from db_pool import obter_pool
+from exportacao import exportar_notas_arquivo, gerar_exportacao
+from import_engine import DEFAULT_BATCH_SIZE, PARSER_PADRAO, MunicipioImportEngine, abrir_arquivo_municipios
+from municipios_consulta import PlanoConsultaMunicipios
+from municipios_index import MunicipioIndex
 
 class DatabaseManager:
+    # Migrações de schema (versão, método), registradas em PRAGMA user_version
+    MIGRACOES = [
+        (1, '_migracao_indices_municipios'),
+        (2, '_migracao_cnpj_fornecedores'),
+        (3, '_migracao_indice_notas_emissao'),
+        (4, '_migracao_contador_notas'),
+        (5, '_migracao_busca_notas'),
+    ]
+
+    # Máximo de notas contadas em uma busca; acima disso o total é aproximado
+    CONTAGEM_MAXIMA_BUSCA = 1000
+
+    # Consultas frequentes conferidas com EXPLAIN QUERY PLAN: (SQL, nº de parâmetros)
+    CONSULTAS_VERIFICADAS = {
+        'municipio_por_codigo': ("""
+            SELECT nome_municipio, uf, cod_municipio
+            FROM tb_municipios
+            WHERE cod_municipio = ?
+        """, 1),
+        'municipios_por_uf': ("""
+            SELECT nome_municipio, cod_municipio
+            FROM tb_municipios
+            WHERE uf = ?
+            ORDER BY nome_municipio
+        """, 1),
+        'ufs': ("SELECT DISTINCT uf FROM tb_municipios ORDER BY uf", 0),
+        'fornecedor_por_cnpj': ("""
+            SELECT descricao_fornecedor, uf, municipio, cod_municipio
+            FROM tb_fornecedores
+            WHERE cnpj_digitos = ?
+        """, 1),
+        'notas_apos_cursor': ("""
+            SELECT id
+            FROM tb_notas_fiscais
+            WHERE COALESCE(dt_emissao, '') <= ?
+              AND (COALESCE(dt_emissao, '') < ? OR id < ?)
+            ORDER BY COALESCE(dt_emissao, '') DESC, id DESC
+            LIMIT 11
+        """, 3),
+    }
+
+    # Intervalo mínimo (segundos) entre verificações da versão dos municípios,
+    # usado para detectar importações feitas por outros processos
+    INTERVALO_VERIFICACAO_INDICE = 5.0
+
     def __init__(self, db_file="app_rest_gyn.db"):
         app_path = self.get_application_path()
         self.db_file = os.path.join(app_path, db_file)
+        self._indice_municipios = None
+        self._indice_verificado_em = 0.0
+        self._indice_lock = threading.Lock()
+        self._plano_municipios = PlanoConsultaMunicipios()
+        self._busca_fts = False
         self.create_tables()
         self.populate_default_data()
         self.logger = logging.getLogger(__name__)
@@ -105,6 +164,13 @@ class DatabaseManager:
         
         uf = uf.upper()  # Normalizar para maiúsculas
         
+        # Consultar primeiro o índice em memória (sem acesso ao banco)
+        indice = self._obter_indice_municipios()
+        if indice is not None:
+            municipios = indice.municipios_por_uf(uf)
+            if municipios:
+                return list(municipios)
+        
         conn = self.create_connection()
         if conn is None:
             print("Não foi possível conectar ao banco de dados")
@@ -113,74 +179,17 @@ class DatabaseManager:
         try:
             cursor = conn.cursor()
             
-            # Verificar tabelas disponíveis
-            cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
-            tabelas = [row[0] for row in cursor.fetchall()]
-            
-            # Estratégia 1: Tentar tabela tb_municipios (padrão mais recente)
-            if 'tb_municipios' in tabelas:
+            # Consultas resolvidas uma única vez por versão do schema
+            for tabela, query in self._plano_municipios.consultas(cursor):
                 try:
-                    cursor.execute("""
-                        SELECT nome_municipio, cod_municipio 
-                        FROM tb_municipios 
-                        WHERE uf = ? 
-                        ORDER BY nome_municipio
-                    """, (uf,))
+                    cursor.execute(query, (uf,))
                     
                     municipios = cursor.fetchall()
                     if municipios:
-                        print(f"Encontrados {len(municipios)} municípios para UF {uf} em tb_municipios")
+                        print(f"Encontrados {len(municipios)} municípios para UF {uf} em {tabela}")
                         return municipios
                 except Exception as e:
-                    print(f"Erro ao consultar tb_municipios: {e}")
-            
-            # Estratégia 2: Tentar tabela tb_cod_municipio (estrutura alternativa)
-            if 'tb_cod_municipio' in tabelas:
-                try:
-                    cursor.execute("""
-                        SELECT municipio, cod_municipio 
-                        FROM tb_cod_municipio 
-                        WHERE UF = ? 
-                        ORDER BY municipio
-                    """, (uf,))
-                    
-                    municipios = cursor.fetchall()
-                    if municipios:
-                        print(f"Encontrados {len(municipios)} municípios para UF {uf} em tb_cod_municipio")
-                        return municipios
-                except Exception as e:
-                    print(f"Erro ao consultar tb_cod_municipio: {e}")
-            
-            # Estratégia 3: Busca automática em qualquer tabela com 'munic' no nome
-            for tabela in tabelas:
-                if 'munic' in tabela.lower() and tabela not in ['tb_municipios', 'tb_cod_municipio']:
-                    try:
-                        # Detectar estrutura da tabela
-                        cursor.execute(f"PRAGMA table_info({tabela})")
-                        colunas = [(row[1], row[2]) for row in cursor.fetchall()]
-                        
-                        # Tentar identificar as colunas relevantes
-                        col_uf = next((col[0] for col in colunas if col[0].lower() in ['uf']), None)
-                        col_nome = next((col[0] for col in colunas 
-                                        if 'nome' in col[0].lower() or 'munic' in col[0].lower()), None)
-                        col_codigo = next((col[0] for col in colunas 
-                                        if 'cod' in col[0].lower()), None)
-                        
-                        if col_uf and col_nome and col_codigo:
-                            query = f"""
-                                SELECT {col_nome}, {col_codigo} 
-                                FROM {tabela} 
-                                WHERE {col_uf} = ? 
-                                ORDER BY {col_nome}
-                            """
-                            cursor.execute(query, (uf,))
-                            
-                            municipios = cursor.fetchall()
-                            if municipios:
-                                print(f"Encontrados {len(municipios)} municípios para UF {uf} em {tabela} (detecção automática)")
-                                return municipios
-                    except Exception as e:
-                        print(f"Erro ao analisar tabela {tabela}: {e}")
+                    print(f"Erro ao consultar {tabela}: {e}")
             
             # Se chegou até aqui, não encontrou municípios
             print(f"Nenhum município encontrado para UF {uf}")
@@ -194,6 +203,120 @@ class DatabaseManager:
             if conn:
                 conn.close()
 
+    def get_municipio_by_codigo(self, codigo):
+        """
+        Obtém dados de um município pelo código
+        
+        :param codigo: Código do município
+        :return: Tupla (nome_municipio, uf, cod_municipio) ou None se não encontrado
+        """
+        # Limpar código (remover caracteres não numéricos)
+        codigo_numerico = ''.join(filter(str.isdigit, str(codigo)))
+        
+        if not codigo_numerico:
+            return None
+        
+        # Consultar o índice em memória; o banco só é usado se o índice não carregar
+        indice = self._obter_indice_municipios()
+        if indice is not None:
+            return indice.municipio_por_codigo(codigo_numerico)
+        
+        conn = self.create_connection()
+        if conn is None:
+            return None
+        
+        try:
+            cursor = conn.cursor()
+            
+            # Buscar município pelo código
+            cursor.execute("""
+                SELECT nome_municipio, uf, cod_municipio
+                FROM tb_municipios
+                WHERE cod_municipio = ?
+            """, (codigo_numerico,))
+            
+            municipio = cursor.fetchone()
+            return municipio
+        
+        except Exception as e:
+            print(f"Erro ao buscar município por código: {e}")
+            return None
+        
+        finally:
+            if conn:
+                conn.close()
+
+    def _obter_indice_municipios(self):
+        """
+        Obtém o índice de municípios em memória, recarregando-o se necessário
+
+        A versão dos dados (tb_metadados.municipios_versao, incrementada a cada
+        importação) é conferida no máximo a cada INTERVALO_VERIFICACAO_INDICE
+        segundos; entre uma conferência e outra nenhuma consulta é feita.
+
+        :return: MunicipioIndex ou None se não for possível carregá-lo
+        """
+        indice = self._indice_municipios
+        if indice is not None and time.monotonic() - self._indice_verificado_em < self.INTERVALO_VERIFICACAO_INDICE:
+            return indice
+
+        with self._indice_lock:
+            indice = self._indice_municipios
+            if indice is None or indice.versao != self.get_metadado('municipios_versao'):
+                indice = self.recarregar_indice_municipios()
+            self._indice_verificado_em = time.monotonic()
+            return indice
+
+    def get_versao_municipios(self):
+        """
+        Obtém a versão dos dados de municípios usados pelas consultas
+
+        É a versão do índice em memória que atende get_all_ufs() e
+        get_municipios_by_uf(); sem índice, a versão gravada em tb_metadados.
+
+        :return: Versão (texto) ou None se desconhecida
+        """
+        indice = self._obter_indice_municipios()
+        if indice is not None:
+            return indice.versao
+        return self.get_metadado('municipios_versao')
+
+    def recarregar_indice_municipios(self):
+        """
+        Carrega um novo índice de municípios e o coloca no lugar do atual
+
+        A substituição é uma única atribuição, então as requisições em
+        andamento continuam usando o índice anterior até terminarem.
+
+        :return: Novo MunicipioIndex ou None em caso de erro
+        """
+        conn = self.create_connection()
+        if conn is None:
+            return None
+
+        try:
+            cursor = conn.cursor()
+
+            # Versão e municípios lidos do mesmo snapshot
+            transacao_propria = not conn.in_transaction
+            if transacao_propria:
+                cursor.execute("BEGIN")
+            cursor.execute("SELECT valor FROM tb_metadados WHERE chave = 'municipios_versao'")
+            row = cursor.fetchone()
+            indice = MunicipioIndex.carregar(conn, row[0] if row else None)
+            if transacao_propria:
+                conn.commit()
+
+            self._indice_municipios = indice
+            logging.info(f"Índice de municípios carregado: {len(indice)} municípios")
+            return indice
+
+        except Error as e:
+            print(f"Erro ao carregar índice de municípios: {e}")
+            return None
+        finally:
+            conn.close()
+
     def get_application_path(self):
         """Obtém o caminho base da aplicação"""
         if getattr(sys, "frozen", False):
@@ -203,15 +326,30 @@ class DatabaseManager:
         return application_path
 
     def create_connection(self):
-        """Cria uma conexão com o banco de dados SQLite"""
+        """
+        Obtém a conexão da thread atual com o banco de dados SQLite
+
+        A conexão vem do pool compartilhado (db_pool); close() a devolve ao
+        pool em vez de fechá-la.
+        """
         conn = None
         try:
-            conn = sqlite3.connect(self.db_file)
+            conn = obter_pool(self.db_file).get()
             return conn
         except Error as e:
             print(f"Erro ao conectar ao banco de dados: {e}")
         return conn
 
+    def transacao_escrita(self):
+        """
+        Abre uma transação de escrita no modo um escritor / vários leitores
+
+        Uso: ``with db.transacao_escrita() as conn: ...``. O banco opera em
+        WAL, então as leituras das APIs continuam sendo atendidas enquanto a
+        transação está aberta (ver db_pool).
+        """
+        return obter_pool(self.db_file).escrita()
+
     def create_tables(self):
         """Cria as tabelas do banco de dados"""
         conn = self.create_connection()
@@ -272,12 +410,251 @@ class DatabaseManager:
                         usuario TEXT NOT NULL
                     )
                 ''')
+                # Criar tabela de metadados (controle de importações)
+                cursor.execute('''
+                    CREATE TABLE IF NOT EXISTS tb_metadados (
+                        chave TEXT PRIMARY KEY,
+                        valor TEXT
+                    )
+                ''')
                 conn.commit()
+
+                # Aplicar migrações pendentes e conferir o uso dos índices
+                self._aplicar_migracoes(conn)
+                cursor.execute("""
+                    SELECT 1 FROM sqlite_master
+                    WHERE type = 'table' AND name = 'tb_notas_busca'
+                """)
+                self._busca_fts = cursor.fetchone() is not None
+                self.verificar_planos_consulta()
             except Error as e:
                 print(f"Erro ao criar tabelas: {e}")
             finally:
                 conn.close()
 
+    def _aplicar_migracoes(self, conn):
+        """
+        Aplica, em ordem, as migrações ainda não aplicadas ao banco
+
+        A última migração aplicada fica em PRAGMA user_version; cada migração
+        roda em sua própria transação junto com a atualização da versão.
+
+        :param conn: Conexão com o banco de dados
+        """
+        cursor = conn.cursor()
+        cursor.execute("PRAGMA user_version")
+        versao_atual = cursor.fetchone()[0]
+
+        for versao, nome in self.MIGRACOES:
+            if versao <= versao_atual:
+                continue
+
+            try:
+                cursor.execute("BEGIN IMMEDIATE")
+                getattr(self, nome)(cursor)
+                cursor.execute(f"PRAGMA user_version = {versao}")
+                conn.commit()
+                logging.info(f"Migração {versao} aplicada: {nome}")
+            except Error:
+                conn.rollback()
+                raise
+
+    def _migracao_indices_municipios(self, cursor):
+        """Índices secundários de tb_municipios (busca por código e listagem por UF)"""
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_municipios_codigo
+            ON tb_municipios (cod_municipio)
+        """)
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_municipios_uf_nome
+            ON tb_municipios (uf, nome_municipio)
+        """)
+
+    def _migracao_cnpj_fornecedores(self, cursor):
+        """
+        Coluna cnpj_digitos (CNPJ só com números) com índice único em tb_fornecedores
+
+        Fornecedores antigos são preenchidos a partir da coluna cnpj; se houver
+        mais de um cadastro para o mesmo CNPJ, apenas o mais antigo recebe o
+        valor, para que o índice único possa ser criado.
+        """
+        cursor.execute("PRAGMA table_info(tb_fornecedores)")
+        colunas = [row[1] for row in cursor.fetchall()]
+        if 'cnpj' not in colunas:
+            cursor.execute("ALTER TABLE tb_fornecedores ADD COLUMN cnpj TEXT")
+        if 'cnpj_digitos' not in colunas:
+            cursor.execute("ALTER TABLE tb_fornecedores ADD COLUMN cnpj_digitos TEXT")
+
+        cursor.execute("""
+            SELECT id, cnpj FROM tb_fornecedores
+            WHERE cnpj IS NOT NULL
+            ORDER BY id
+        """)
+        atualizacoes = {}
+        for fornecedor_id, cnpj in cursor.fetchall():
+            cnpj_digitos = self.clean_cnpj(cnpj)
+            if cnpj_digitos and cnpj_digitos not in atualizacoes:
+                atualizacoes[cnpj_digitos] = fornecedor_id
+
+        cursor.executemany(
+            "UPDATE tb_fornecedores SET cnpj_digitos = ? WHERE id = ?",
+            atualizacoes.items()
+        )
+        cursor.execute("""
+            CREATE UNIQUE INDEX IF NOT EXISTS idx_fornecedores_cnpj_digitos
+            ON tb_fornecedores (cnpj_digitos)
+        """)
+
+    def _migracao_indice_notas_emissao(self, cursor):
+        """Índice da paginação por cursor das notas: (dt_emissao sem NULL, id)"""
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_notas_emissao_id
+            ON tb_notas_fiscais (COALESCE(dt_emissao, ''), id)
+        """)
+
+    def _migracao_contador_notas(self, cursor):
+        """
+        Tabela tb_contadores com o total de notas fiscais, mantido por triggers
+
+        Evita o COUNT(*) sobre toda a tabela a cada página da listagem. Uma
+        nota regravada com INSERT OR REPLACE só dispara o trigger de DELETE
+        com PRAGMA recursive_triggers ativo, como nas conexões do db_pool;
+        gravações feitas por outras conexões devem ativá-lo também.
+        """
+        cursor.execute("""
+            CREATE TABLE IF NOT EXISTS tb_contadores (
+                chave TEXT PRIMARY KEY,
+                valor INTEGER NOT NULL
+            )
+        """)
+        cursor.execute("""
+            INSERT OR REPLACE INTO tb_contadores (chave, valor)
+            SELECT 'notas_fiscais', COUNT(*) FROM tb_notas_fiscais
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_notas_fiscais_contador_insert
+            AFTER INSERT ON tb_notas_fiscais
+            BEGIN
+                UPDATE tb_contadores SET valor = valor + 1 WHERE chave = 'notas_fiscais';
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_notas_fiscais_contador_delete
+            AFTER DELETE ON tb_notas_fiscais
+            BEGIN
+                UPDATE tb_contadores SET valor = valor - 1 WHERE chave = 'notas_fiscais';
+            END
+        """)
+
+    def _migracao_busca_notas(self, cursor):
+        """
+        Índice FTS5 (trigram) tb_notas_busca para a busca da listagem de notas
+
+        Cada linha tem o mesmo rowid da nota e guarda numero_nf, cnpj e o nome
+        do fornecedor. Triggers em tb_notas_fiscais e tb_fornecedores mantêm o
+        índice atualizado. Sem suporte a FTS5 no SQLite a migração é ignorada
+        e a busca continua usando LIKE.
+        """
+        try:
+            cursor.execute("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS tb_notas_busca
+                USING fts5(numero_nf, cnpj, fornecedor, tokenize = 'trigram')
+            """)
+        except Error as e:
+            logging.warning(f"FTS5 indisponível, busca de notas continuará usando LIKE: {e}")
+            return
+
+        cursor.execute("""
+            CREATE INDEX IF NOT EXISTS idx_notas_fornecedor
+            ON tb_notas_fiscais (fornecedor_id)
+        """)
+        cursor.execute("DELETE FROM tb_notas_busca")
+        cursor.execute("""
+            INSERT INTO tb_notas_busca (rowid, numero_nf, cnpj, fornecedor)
+            SELECT nf.id, nf.numero_nf, nf.cnpj, f.descricao_fornecedor
+            FROM tb_notas_fiscais nf
+            LEFT JOIN tb_fornecedores f ON nf.fornecedor_id = f.id
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_notas_busca_insert
+            AFTER INSERT ON tb_notas_fiscais
+            BEGIN
+                INSERT INTO tb_notas_busca (rowid, numero_nf, cnpj, fornecedor)
+                VALUES (
+                    new.id, new.numero_nf, new.cnpj,
+                    (SELECT descricao_fornecedor FROM tb_fornecedores WHERE id = new.fornecedor_id)
+                );
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_notas_busca_delete
+            AFTER DELETE ON tb_notas_fiscais
+            BEGIN
+                DELETE FROM tb_notas_busca WHERE rowid = old.id;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_notas_busca_update
+            AFTER UPDATE OF numero_nf, cnpj, fornecedor_id ON tb_notas_fiscais
+            BEGIN
+                UPDATE tb_notas_busca
+                SET numero_nf = new.numero_nf,
+                    cnpj = new.cnpj,
+                    fornecedor = (SELECT descricao_fornecedor FROM tb_fornecedores
+                                  WHERE id = new.fornecedor_id)
+                WHERE rowid = new.id;
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_notas_busca_fornecedor_update
+            AFTER UPDATE OF descricao_fornecedor ON tb_fornecedores
+            BEGIN
+                UPDATE tb_notas_busca
+                SET fornecedor = new.descricao_fornecedor
+                WHERE rowid IN (SELECT id FROM tb_notas_fiscais WHERE fornecedor_id = new.id);
+            END
+        """)
+        cursor.execute("""
+            CREATE TRIGGER IF NOT EXISTS trg_notas_busca_fornecedor_delete
+            AFTER DELETE ON tb_fornecedores
+            BEGIN
+                UPDATE tb_notas_busca
+                SET fornecedor = NULL
+                WHERE rowid IN (SELECT id FROM tb_notas_fiscais WHERE fornecedor_id = old.id);
+            END
+        """)
+
+    def verificar_planos_consulta(self):
+        """
+        Confere com EXPLAIN QUERY PLAN se as consultas frequentes usam índices
+
+        Registra um aviso para cada consulta que faça varredura completa de
+        tabela ou precise de uma B-tree temporária para ordenar.
+
+        :return: Dicionário {consulta: lista de linhas do plano}
+        """
+        planos = {}
+        conn = self.create_connection()
+        if conn is None:
+            return planos
+
+        try:
+            cursor = conn.cursor()
+            for nome, (query, num_params) in self.CONSULTAS_VERIFICADAS.items():
+                cursor.execute(f"EXPLAIN QUERY PLAN {query}", (None,) * num_params)
+                planos[nome] = [row[3] for row in cursor.fetchall()]
+
+                for detalhe in planos[nome]:
+                    varredura = detalhe.startswith('SCAN') and ' USING ' not in detalhe
+                    if varredura or 'TEMP B-TREE' in detalhe:
+                        logging.warning(f"Consulta '{nome}' sem índice adequado: {detalhe}")
+        except Error as e:
+            print(f"Erro ao verificar planos de consulta: {e}")
+        finally:
+            conn.close()
+
+        return planos
+
     def populate_default_data(self):
         """Popula dados padrão se necessário"""
         conn = self.create_connection()
@@ -314,8 +691,108 @@ class DatabaseManager:
             finally:
                 conn.close()
 
+    @staticmethod
+    def clean_cnpj(cnpj):
+        """
+        Remove todos os caracteres não numéricos do CNPJ
+
+        :param cnpj: CNPJ a ser limpo
+        :return: CNPJ com apenas números
+        """
+        return ''.join(filter(str.isdigit, str(cnpj)))
+
+    def get_fornecedor_by_cnpj(self, cnpj):
+        """
+        Busca um fornecedor pelo CNPJ (usa o índice único de cnpj_digitos)
+
+        :param cnpj: CNPJ do fornecedor (formatado ou não)
+        :return: Dados do fornecedor ou None
+        """
+        cnpj_limpo = self.clean_cnpj(cnpj)
+
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    SELECT descricao_fornecedor, uf, municipio, cod_municipio,
+                           cadastrado_goiania, fora_pais
+                    FROM tb_fornecedores
+                    WHERE cnpj_digitos = ?
+                """, (cnpj_limpo,))
+
+                fornecedor = cursor.fetchone()
+                return fornecedor
+
+            except Exception as e:
+                print(f"Erro ao buscar fornecedor por CNPJ: {e}")
+                return None
+
+            finally:
+                if conn:
+                    conn.close()
+
+        return None
+
+    def insert_fornecedor(self, cnpj, descricao, uf, municipio, cod_municipio, fora_pais=False, cadastrado_goiania=False):
+        """
+        Insere ou atualiza um fornecedor em um único comando (UPSERT por cnpj_digitos)
+
+        :param cnpj: CNPJ do fornecedor
+        :param descricao: Nome/Descrição do fornecedor
+        :param uf: UF do fornecedor
+        :param municipio: Município do fornecedor
+        :param cod_municipio: Código do município
+        :param fora_pais: Se o fornecedor está fora do país
+        :param cadastrado_goiania: Se o fornecedor está cadastrado em Goiânia
+        :return: ID do fornecedor
+        """
+        # Validar CNPJ
+        if not self.validate_cnpj(cnpj):
+            print("CNPJ inválido")
+            return None
+
+        # Limpar CNPJ
+        cnpj_limpo = self.clean_cnpj(cnpj)
+
+        try:
+            with self.transacao_escrita() as conn:
+                cursor = conn.cursor()
+                cursor.execute("""
+                    INSERT INTO tb_fornecedores
+                    (descricao_fornecedor, uf, municipio, cod_municipio,
+                     cadastrado_goiania, fora_pais, cnpj, cnpj_digitos)
+                    VALUES (?, ?, ?, ?, ?, ?, ?, ?)
+                    ON CONFLICT(cnpj_digitos) DO UPDATE SET
+                        descricao_fornecedor = excluded.descricao_fornecedor,
+                        uf = excluded.uf,
+                        municipio = excluded.municipio,
+                        cod_municipio = excluded.cod_municipio,
+                        cadastrado_goiania = excluded.cadastrado_goiania,
+                        fora_pais = excluded.fora_pais
+                    RETURNING id
+                """, (
+                    descricao,
+                    uf,
+                    municipio,
+                    cod_municipio,
+                    cadastrado_goiania,
+                    fora_pais,
+                    cnpj_limpo,
+                    cnpj_limpo
+                ))
+                return cursor.fetchone()[0]
+
+        except Exception as e:
+            print(f"Erro ao inserir/atualizar fornecedor: {e}")
+            return None
+
     def get_all_ufs(self):
         """Obtém todas as UFs brasileiras"""
+        indice = self._obter_indice_municipios()
+        if indice is not None and indice.ufs():
+            return list(indice.ufs())
+
         conn = self.create_connection()
         if conn is not None:
             try:
@@ -365,8 +842,250 @@ class DatabaseManager:
                 conn.close()
         return []
 
-    def get_notas_fiscais_paginadas(self, page=1, per_page=10, search=None):
-        """Retorna notas fiscais paginadas com busca opcional"""
+    def update_tomador(self, dados):
+        """
+        Atualiza um tomador existente no banco de dados
+        
+        :param dados: Dicionário com os dados do tomador, incluindo o ID
+        :return: True se bem-sucedido, False caso contrário
+        """
+        try:
+            with self.transacao_escrita() as conn:
+                cursor = conn.cursor()
+                
+                cursor.execute("""
+                    UPDATE tb_tomadores 
+                    SET razao_social = ?, 
+                        cnpj = ?, 
+                        inscricao = ?, 
+                        usuario = ?
+                    WHERE id = ?
+                """, (
+                    dados['razao_social'],
+                    dados['cnpj'],
+                    dados['inscricao'],
+                    dados['usuario'],
+                    dados['id']
+                ))
+                
+                return cursor.rowcount > 0
+        except Exception as e:
+            logging.error(f"Erro ao atualizar tomador: {e}")
+            return False
+
+    def delete_tomador(self, tomador_id):
+        """
+        Exclui um tomador do banco de dados
+        
+        :param tomador_id: ID do tomador a ser excluído
+        :return: True se bem-sucedido, False caso contrário
+        """
+        try:
+            # A verificação das notas e a exclusão ficam na mesma transação de escrita
+            with self.transacao_escrita() as conn:
+                cursor = conn.cursor()
+                
+                # Verificar se há notas fiscais associadas (bancos sem a coluna
+                # tomador_id não têm notas vinculadas a tomadores)
+                cursor.execute("PRAGMA table_info(tb_notas_fiscais)")
+                if 'tomador_id' in [row[1] for row in cursor.fetchall()]:
+                    cursor.execute("SELECT COUNT(*) FROM tb_notas_fiscais WHERE tomador_id = ?", (tomador_id,))
+                    count = cursor.fetchone()[0]
+                    
+                    if count > 0:
+                        logging.warning(f"Não é possível excluir o tomador: existem {count} notas fiscais associadas")
+                        return False
+                    
+                # Excluir tomador
+                cursor.execute("DELETE FROM tb_tomadores WHERE id = ?", (tomador_id,))
+                
+                return cursor.rowcount > 0
+        except Exception as e:
+            logging.error(f"Erro ao excluir tomador: {e}")
+            return False
+
+    def insert_tomador(self, dados):
+        """
+        Insere um novo tomador no banco de dados
+        
+        :param dados: Dicionário com dados do tomador
+        :return: ID do tomador inserido ou None se falhar
+        """
+        # Remover caracteres não numéricos do CNPJ
+        cnpj = ''.join(filter(str.isdigit, dados['cnpj']))
+        
+        # Validar campos obrigatórios
+        if not dados.get('razao_social'):
+            logging.error("Erro: Razão social é obrigatória")
+            return None
+        
+        if not cnpj or len(cnpj) < 11:
+            logging.error("Erro: CNPJ/CPF inválido")
+            return None
+        
+        try:
+            # A busca pelo CNPJ e a gravação ficam na mesma transação de escrita
+            with self.transacao_escrita() as conn:
+                cursor = conn.cursor()
+                
+                # Verificar se o tomador já existe pelo CNPJ
+                cursor.execute("SELECT id FROM tb_tomadores WHERE cnpj = ?", (cnpj,))
+                existing_tomador = cursor.fetchone()
+                
+                if existing_tomador:
+                    # Atualizar tomador existente
+                    cursor.execute("""
+                        UPDATE tb_tomadores 
+                        SET razao_social = ?, 
+                            inscricao = ?, 
+                            usuario = ? 
+                        WHERE id = ?
+                    """, (
+                        dados['razao_social'], 
+                        dados.get('inscricao', ''), 
+                        dados.get('usuario', ''),
+                        existing_tomador[0]
+                    ))
+                    logging.info(f"Tomador atualizado: {dados['razao_social']}")
+                    return existing_tomador[0]
+                else:
+                    # Inserir novo tomador
+                    cursor.execute("""
+                        INSERT INTO tb_tomadores 
+                        (razao_social, cnpj, inscricao, usuario) 
+                        VALUES (?, ?, ?, ?)
+                    """, (
+                        dados['razao_social'], 
+                        cnpj, 
+                        dados.get('inscricao', ''), 
+                        dados.get('usuario', '')
+                    ))
+                    tomador_id = cursor.lastrowid
+                    logging.info(f"Novo tomador inserido: {dados['razao_social']}")
+                    return tomador_id
+        
+        except Exception as e:
+            logging.error(f"Erro ao inserir/atualizar tomador: {e}")
+            return None
+
+    @staticmethod
+    def _codificar_cursor_notas(dt_emissao, nota_id):
+        """
+        Gera o token opaco que aponta para a última nota de uma página
+
+        :param dt_emissao: Data de emissão da nota (ou None)
+        :param nota_id: ID da nota
+        :return: Token em base64 (seguro para URLs)
+        """
+        dados = json.dumps([dt_emissao or '', nota_id], separators=(',', ':'))
+        return base64.urlsafe_b64encode(dados.encode('utf-8')).decode('ascii').rstrip('=')
+
+    @staticmethod
+    def _decodificar_cursor_notas(token):
+        """
+        Lê um token gerado por _codificar_cursor_notas
+
+        :param token: Token recebido no parâmetro after=
+        :return: Tupla (dt_emissao, id)
+        :raises ValueError: Se o token for inválido
+        """
+        try:
+            dados = base64.urlsafe_b64decode(token + '=' * (-len(token) % 4))
+            dt_emissao, nota_id = json.loads(dados.decode('utf-8'))
+        except (ValueError, TypeError) as e:
+            raise ValueError(f"cursor de paginação inválido: {token}") from e
+
+        if not isinstance(dt_emissao, str) or not isinstance(nota_id, int):
+            raise ValueError(f"cursor de paginação inválido: {token}")
+        return dt_emissao, nota_id
+
+    def _condicao_busca_notas(self, search):
+        """
+        Monta a condição de busca textual da listagem de notas
+
+        Termos com 3 ou mais caracteres são buscados no índice FTS5 (trigram)
+        tb_notas_busca, que encontra substrings do número da nota, do CNPJ e
+        do nome do fornecedor sem percorrer as tabelas. Termos menores (ou um
+        banco sem FTS5) usam LIKE.
+
+        :param search: Texto buscado
+        :return: Tupla (condição SQL, parâmetros)
+        """
+        if self._busca_fts and len(search) >= 3:
+            termo = '"' + search.replace('"', '""') + '"'
+            return """nf.id IN (
+                SELECT rowid FROM tb_notas_busca WHERE tb_notas_busca MATCH ?
+            )""", [termo]
+
+        search_param = f"%{search}%"
+        return """(
+            nf.cnpj LIKE ? OR
+            f.descricao_fornecedor LIKE ? OR
+            nf.numero_nf LIKE ?
+        )""", [search_param, search_param, search_param]
+
+    def _contar_notas(self, cursor, condicoes, params):
+        """
+        Conta as notas da listagem sem percorrer a consulta completa
+
+        Sem filtros, o total vem de tb_contadores (mantido por triggers). Com
+        busca, a contagem para em CONTAGEM_MAXIMA_BUSCA notas; nesse caso o
+        total é um limite inferior e total_exato é False.
+
+        :param cursor: Cursor do banco de dados
+        :param condicoes: Condições do WHERE da busca
+        :param params: Parâmetros das condições
+        :return: Tupla (total, total_exato)
+        """
+        if not condicoes:
+            cursor.execute("SELECT valor FROM tb_contadores WHERE chave = 'notas_fiscais'")
+            row = cursor.fetchone()
+            if row is not None:
+                return row[0], True
+
+        limite = self.CONTAGEM_MAXIMA_BUSCA
+        cursor.execute(f"""
+            SELECT COUNT(*) FROM (
+                SELECT 1
+                FROM tb_notas_fiscais nf
+                LEFT JOIN tb_fornecedores f ON nf.fornecedor_id = f.id
+                {" WHERE " + " AND ".join(condicoes) if condicoes else ""}
+                LIMIT ?
+            )
+        """, [*params, limite])
+        total = cursor.fetchone()[0]
+        return total, total < limite
+
+    def get_notas_fiscais_paginadas(self, page=1, per_page=10, search=None, after=None):
+        """
+        Retorna notas fiscais paginadas com busca opcional
+
+        As notas são ordenadas por (dt_emissao, id) decrescentes, com as notas
+        sem data de emissão no final. Com after= (token devolvido em 'next'), a
+        página começa logo após a última nota da página anterior e é buscada
+        direto no índice idx_notas_emissao_id, com o mesmo custo em qualquer
+        profundidade; sem ele, page= continua funcionando com OFFSET.
+
+        :param page: Número da página (usado apenas sem after)
+        :param per_page: Quantidade de notas por página
+        :param search: Texto buscado no CNPJ, fornecedor ou número da nota
+        :param after: Token da última nota da página anterior
+        :return: Dicionário com rows, total, total_exato, page, per_page, pages e next
+        :raises ValueError: Se o token after for inválido
+        """
+        vazio = {
+            'rows': [],
+            'total': 0,
+            'page': page,
+            'per_page': per_page,
+            'total_exato': True,
+            'pages': 0,
+            'next': None
+        }
+
+        # Token inválido não cai para OFFSET: a página devolvida seria outra
+        cursor_notas = self._decodificar_cursor_notas(after) if after else None
+
         conn = self.create_connection()
         if conn is not None:
             try:
@@ -390,55 +1109,166 @@ class DatabaseManager:
                     LEFT JOIN tb_tipo_de_recolhimento tr ON nf.recolhimento = tr.id
                 """
 
+                condicoes = []
                 params = []
                 if search:
-                    query += """
-                    WHERE nf.cnpj LIKE ? OR
-                        f.descricao_fornecedor LIKE ? OR
-                        nf.numero_nf LIKE ?
-                    """
-                    search_param = f"%{search}%"
-                    params.extend([search_param, search_param, search_param])
-
-                query += " ORDER BY nf.dt_emissao DESC"
-
-                count_query = f"SELECT COUNT(*) FROM ({query}) as count_query"
-                cursor.execute(count_query, params)
-                total = cursor.fetchone()[0]
-
-                query += " LIMIT ? OFFSET ?"
-                offset = (page - 1) * per_page
-                params.extend([per_page, offset])
+                    condicao, params_busca = self._condicao_busca_notas(search)
+                    condicoes.append(condicao)
+                    params.extend(params_busca)
+
+                total, total_exato = self._contar_notas(cursor, condicoes, params)
+
+                if cursor_notas:
+                    # Seek: notas estritamente depois de (dt_emissao, id) na ordem decrescente
+                    dt_emissao, nota_id = cursor_notas
+                    condicoes.append("""
+                        COALESCE(nf.dt_emissao, '') <= ? AND
+                        (COALESCE(nf.dt_emissao, '') < ? OR nf.id < ?)
+                    """)
+                    params.extend([dt_emissao, dt_emissao, nota_id])
+
+                if condicoes:
+                    query += " WHERE " + " AND ".join(condicoes)
+                query += " ORDER BY COALESCE(nf.dt_emissao, '') DESC, nf.id DESC"
+
+                # Buscar uma nota a mais para saber se existe próxima página
+                query += " LIMIT ?"
+                params.append(per_page + 1)
+                if not cursor_notas and page > 1:
+                    query += " OFFSET ?"
+                    params.append((page - 1) * per_page)
 
                 cursor.execute(query, params)
                 rows = cursor.fetchall()
 
+                proximo = None
+                if len(rows) > per_page:
+                    rows = rows[:per_page]
+                    proximo = self._codificar_cursor_notas(rows[-1][7], rows[-1][0])
+
                 return {
                     'rows': rows,
                     'total': total,
+                    'total_exato': total_exato,
                     'page': page,
                     'per_page': per_page,
-                    'pages': (total + per_page - 1) // per_page
+                    'pages': (total + per_page - 1) // per_page,
+                    'next': proximo
                 }
 
             except Error as e:
-                print(f"Erro ao buscar notas fiscais: {e}")
-                return {
-                    'rows': [],
-                    'total': 0,
-                    'page': page,
-                    'per_page': per_page,
-                    'pages': 0
-                }
+                self.logger.error(f"Erro ao buscar notas fiscais: {e}")
+                return vazio
             finally:
                 conn.close()
-        return {
-            'rows': [],
-            'total': 0,
-            'page': page,
-            'per_page': per_page,
-            'pages': 0
-        }
+        return vazio
+
+    def export_to_excel(self, filepath=None, formato='xlsx'):
+        """
+        Exporta todas as notas fiscais para um arquivo Excel (ou CSV/Parquet)
+
+        :param filepath: Caminho para salvar o arquivo. Se None, usa um arquivo temporário
+        :param formato: 'xlsx', 'csv' ou 'parquet'
+        :return: Caminho do arquivo ou False se falhar
+        """
+        return self._exportar_notas_arquivo(filepath, formato=formato)
+
+    def export_to_excel_por_tomador(self, tomador_id, filepath=None, formato='xlsx'):
+        """
+        Exporta notas fiscais de um tomador específico para Excel (ou CSV/Parquet)
+
+        :param tomador_id: ID do tomador
+        :param filepath: Caminho para salvar o arquivo. Se None, usa um arquivo temporário
+        :param formato: 'xlsx', 'csv' ou 'parquet'
+        :return: Caminho do arquivo ou False se falhar
+        """
+        return self._exportar_notas_arquivo(filepath, tomador_id, formato)
+
+    def gerar_exportacao_notas(self, formato='xlsx', tomador_id=None, ao_concluir=None):
+        """
+        Produz a exportação de notas fiscais em pedaços para uma resposta HTTP
+
+        A consulta é executada antes do primeiro pedaço, de modo que erros no
+        banco aparecem antes de a resposta começar a ser enviada. A conexão
+        fica em uso até o último pedaço (ou até o cliente desistir).
+
+        :param formato: 'xlsx', 'csv' ou 'parquet'
+        :param tomador_id: ID do tomador ou None para todas as notas
+        :param ao_concluir: Função chamada após o último pedaço ser produzido
+        :return: Gerador de pedaços do arquivo
+        :raises ValueError: Se o formato não for suportado
+        """
+        conn = self.create_connection()
+        try:
+            pedacos = gerar_exportacao(conn, formato, tomador_id)
+        except Exception:
+            conn.close()
+            raise
+
+        def produzir():
+            try:
+                yield from pedacos
+            finally:
+                conn.close()
+            if ao_concluir is not None:
+                ao_concluir()
+
+        return produzir()
+
+    def limpar_notas_fiscais(self):
+        """
+        Limpa todas as notas fiscais da tabela
+
+        :return: True se a limpeza for bem-sucedida, False caso contrário
+        """
+        try:
+            with self.transacao_escrita() as conn:
+                # Excluir todas as notas fiscais (commit ao sair do bloco)
+                conn.execute("DELETE FROM tb_notas_fiscais")
+
+            logging.info("Todas as notas fiscais foram excluídas")
+            return True
+
+        except Exception as e:
+            logging.error(f"Erro ao limpar notas fiscais: {e}")
+            return False
+
+        return False
+
+    def _exportar_notas_arquivo(self, filepath=None, tomador_id=None, formato='xlsx'):
+        """
+        Grava as notas fiscais em arquivo lendo e escrevendo em lotes (memória constante)
+
+        :param filepath: Caminho do arquivo ou None para um arquivo temporário
+        :param tomador_id: ID do tomador ou None para todas as notas
+        :param formato: 'xlsx', 'csv' ou 'parquet'
+        :return: Caminho do arquivo ou False se falhar
+        """
+        conn = self.create_connection()
+        if conn is None:
+            logging.error("Não foi possível conectar ao banco de dados")
+            return False
+
+        try:
+            if filepath is None:
+                with tempfile.NamedTemporaryFile(delete=False, suffix=f'.{formato}') as temp:
+                    filepath = temp.name
+
+            exportar_notas_arquivo(conn, filepath, formato, tomador_id)
+
+            if tomador_id is None:
+                logging.info(f"Notas fiscais exportadas com sucesso para {filepath}")
+            else:
+                logging.info(f"Notas fiscais do tomador {tomador_id} exportadas com sucesso para {filepath}")
+            return filepath
+
+        except Exception as e:
+            logging.error(f"Erro ao exportar notas fiscais: {e}")
+            return False
+
+        finally:
+            conn.close()
+
     def populate_default_data(self):
         """Popula dados padrão se necessário"""
         conn = self.create_connection()
@@ -468,16 +1298,19 @@ class DatabaseManager:
                 print(f"Erro ao popular dados padrão: {e}")
             finally:
                 conn.close()
-    def import_municipios_from_txt(self, filepath):
+    def import_municipios_from_txt(self, filepath, batch_size=DEFAULT_BATCH_SIZE, progresso=None,
+                                   parser=PARSER_PADRAO, diferencial=False, processos=1):
         """
         Importa municípios de um arquivo TXT
 
         :param filepath: Caminho para o arquivo de municípios
-        :return: Número de municípios importados
+        :param batch_size: Quantidade de registros gravados por lote
+        :param progresso: Função que recebe o progresso após cada lote gravado
+        :param parser: 'linhas' (linha a linha) ou 'colunar' (pandas, em blocos)
+        :param diferencial: Se deve aplicar apenas as diferenças em vez de apagar e regravar
+        :param processos: Processos usados na conversão de arquivos grandes (1 = sem paralelismo)
+        :return: Número de municípios importados (presentes no arquivo)
         """
-        import os
-        import chardet
-
         logging.info(f"Iniciando importação de municípios: {filepath}")
 
         # Verificar existência do arquivo
@@ -485,62 +1318,19 @@ class DatabaseManager:
             logging.error(f"Arquivo não encontrado: {filepath}")
             return 0
 
-        # Detectar encoding do arquivo
         try:
-            with open(filepath, 'rb') as file:
-                raw_data = file.read(10000)  # Ler primeiros 10 KB
-                result = chardet.detect(raw_data)
-                encoding = result['encoding']
-                confidence = result['confidence']
-
-            logging.info(f"Encoding detectado: {encoding} (Confiança: {confidence * 100:.2f}%)")
-
-            # Lista de encodings para tentar
-            encodings_to_try = [
-                encoding,       # Encoding detectado
-                'utf-8',        # UTF-8 padrão
-                'latin1',       # Alternativa comum
-                'iso-8859-1',   # Alternativa comum
-                'cp1252'        # Windows Latin-1
-            ]
-
-            # Remover duplicatas e None
-            encodings_to_try = list(dict.fromkeys([e for e in encodings_to_try if e]))
-
-            # Determinar formato do arquivo
-            formato = self._detectar_formato_arquivo(filepath, encodings_to_try)
-            if not formato:
-                logging.error("Não foi possível determinar o formato do arquivo")
-                return 0
-
-            logging.info(f"Formato detectado: {formato['tipo']}")
-
             # Criar ou verificar tabela
             conn = self.create_connection()
             if not conn:
                 return 0
 
             try:
-                cursor = conn.cursor()
-
-                # Criar tabela se não existir
-                cursor.execute('''
-                    CREATE TABLE IF NOT EXISTS tb_municipios (
-                        uf TEXT,
-                        cod_municipio TEXT,
-                        nome_municipio TEXT,
-                        PRIMARY KEY (uf, cod_municipio)
-                    )
-                ''')
-
-                # Limpar tabela existente
-                cursor.execute("DELETE FROM tb_municipios")
-
-                # Importar municípios
-                imported_count = self._importar_arquivo(filepath, formato, conn)
-
-                # Commit das alterações
-                conn.commit()
+                # Importar municípios (limpeza, gravação e commit em uma transação)
+                imported_count = self._importar_arquivo(
+                    filepath, conn, batch_size, progresso, parser, diferencial, processos
+                )
+                if imported_count > 0:
+                    self.recarregar_indice_municipios()
 
                 return imported_count
 
@@ -552,531 +1342,123 @@ class DatabaseManager:
 
         except Exception as e:
             logging.error(f"Erro ao processar arquivo: {e}")
-            return 0
-
-    def _detectar_formato_arquivo(self, filepath, encodings):
-        """
-        Detecta o formato do arquivo de municípios
-
-        :param filepath: Caminho para o arquivo
-        :param encodings: Lista de encodings para tentar
-        :return: Dicionário com informações do formato ou None se não detectado
-        """
-        for encoding in encodings:
-            try:
-                with open(filepath, 'r', encoding=encoding) as file:
-                    # Ler primeiras linhas não vazias
-                    linhas = []
-                    for _ in range(10):  # Ler até 10 linhas
-                        linha = file.readline().strip()
-                        if linha:
-                            linhas.append(linha)
-                        if len(linhas) >= 3:
-                            break
-
-                    if not linhas:
-                        continue
-
-                    # Verificar formato pelo separador
-                    primeira_linha = linhas[0]
-
-                    # Formato 1: codigo;nome;uf
-                    if ';' in primeira_linha:
-                        parts = primeira_linha.split(';')
-                        if len(parts) == 3:
-                            # Verificar qual elemento é a UF (geralmente tem 2 caracteres)
-                            if len(parts[0].strip()) == 2 and parts[0].strip().isalpha():
-                                # Formato: UF;NOME;CODIGO
-                                return {
-                                    'tipo': 'ponto_virgula',
-                                    'encoding': encoding,
-                                    'ordem': ['uf', 'nome', 'codigo']
-                                }
-                            elif len(parts[2].strip()) == 2 and parts[2].strip().isalpha():
-                                # Formato: CODIGO;NOME;UF
-                                return {
-                                    'tipo': 'ponto_virgula',
-                                    'encoding': encoding,
-                                    'ordem': ['codigo', 'nome', 'uf']
-                                }
-
-                    # Formato 2: codigo,nome,uf
-                    elif ',' in primeira_linha and not "Código=" in primeira_linha:
-                        parts = primeira_linha.split(',')
-                        if len(parts) == 3:
-                            # Verificar qual elemento é a UF (geralmente tem 2 caracteres)
-                            if len(parts[0].strip()) == 2 and parts[0].strip().isalpha():
-                                # Formato: UF,NOME,CODIGO
-                                return {
-                                    'tipo': 'virgula',
-                                    'encoding': encoding,
-                                    'ordem': ['uf', 'nome', 'codigo']
-                                }
-                            elif len(parts[2].strip()) == 2 and parts[2].strip().isalpha():
-                                # Formato: CODIGO,NOME,UF
-                                return {
-                                    'tipo': 'virgula',
-                                    'encoding': encoding,
-                                    'ordem': ['codigo', 'nome', 'uf']
-                                }
-
-                    # Formato 3: Processando: Código=123, Município=Nome, UF=XX
-                    elif "Código=" in primeira_linha and "Município=" in primeira_linha and "UF=" in primeira_linha:
-                        return {
-                            'tipo': 'chave_valor',
-                            'encoding': encoding
-                        }
-
-            except UnicodeDecodeError:
-                continue
-            except Exception as e:
-                logging.error(f"Erro ao detectar formato com encoding {encoding}: {e}")
-
-        return None
-
-    def _importar_arquivo(self, filepath, formato, conn):
-        """
-        Importa os municípios do arquivo para o banco de dados
-
-        :param filepath: Caminho para o arquivo
-        :param formato: Informações do formato
-        :param conn: Conexão com o banco de dados
-        :return: Número de municípios importados
-        """
-        cursor = conn.cursor()
-        imported_count = 0
-        error_count = 0
-
-        try:
-            with open(filepath, 'r', encoding=formato['encoding']) as file:
-                for line_num, line in enumerate(file, 1):
-                    line = line.strip()
-                    if not line:
-                        continue
-
-                    try:
-                        # Extrair dados conforme o formato
-                        cod_municipio = None
-                        nome_municipio = None
-                        uf = None
-
-                        if formato['tipo'] == 'ponto_virgula':
-                            parts = [p.strip() for p in line.split(';')]
-                            if len(parts) != 3:
-                                logging.error(f"Linha {line_num} inválida: {line}")
-                                continue
-
-                            # Atribuir valores conforme a ordem detectada
-                            for i, campo in enumerate(formato['ordem']):
-                                if campo == 'codigo':
-                                    cod_municipio = parts[i]
-                                elif campo == 'nome':
-                                    nome_municipio = parts[i]
-                                elif campo == 'uf':
-                                    uf = parts[i]
-
-                        elif formato['tipo'] == 'virgula':
-                            parts = [p.strip() for p in line.split(',')]
-                            if len(parts) != 3:
-                                logging.error(f"Linha {line_num} inválida: {line}")
-                                continue
-
-                            # Atribuir valores conforme a ordem detectada
-                            for i, campo in enumerate(formato['ordem']):
-                                if campo == 'codigo':
-                                    cod_municipio = parts[i]
-                                elif campo == 'nome':
-                                    nome_municipio = parts[i]
-                                elif campo == 'uf':
-                                    uf = parts[i]
-
-                        elif formato['tipo'] == 'chave_valor':
-                            # Remover prefixo se existir
-                            if line.startswith("Processando: "):
-                                line = line.replace("Processando: ", "")
-
-                            # Extrair valores utilizando os identificadores
-                            if "Código=" in line and "Município=" in line and "UF=" in line:
-                                cod_municipio = line.split("Código=")[1].split(",")[0].strip()
-                                nome_municipio = line.split("Município=")[1].split(",")[0].strip()
-                                uf = line.split("UF=")[1].strip()
-
-                        # Validar dados
-                        if not all([cod_municipio, nome_municipio, uf]):
-                            logging.error(
-                                f"Dados incompletos na linha {line_num}: código={cod_municipio}, "
-                                f"município={nome_municipio}, UF={uf}"
-                            )
-                            continue
-
-                        # Normalizar dados
-                        uf = uf.upper()
-                        nome_municipio = nome_municipio.upper()
-
-                        # Inserir no banco
-                        cursor.execute("""
-                            INSERT OR REPLACE INTO tb_municipios
-                            (uf, cod_municipio, nome_municipio)
-                            VALUES (?, ?, ?)
-                        """, (uf, cod_municipio, nome_municipio))
-
-                        imported_count += 1
-
-                    except Exception as e:
-                        logging.error(f"Erro ao processar linha {line_num}: {e}")
-                        error_count += 1
-
-            logging.info(f"Importação concluída: {imported_count} municípios importados, {error_count} erros")
-            return imported_count
-
-        except Exception as e:
-            logging.error(f"Erro ao ler arquivo: {e}")
-            return imported_count
-
-
-def update_tomador(self, dados):
-    """
-    Atualiza um tomador existente no banco de dados
-    
-    :param dados: Dicionário com os dados do tomador, incluindo o ID
-    :return: True se bem-sucedido, False caso contrário
-    """
-    conn = self.create_connection()
-    if conn is not None:
-        try:
-            cursor = conn.cursor()
-            
-            cursor.execute("""
-                UPDATE tb_tomadores 
-                SET razao_social = ?, 
-                    cnpj = ?, 
-                    inscricao = ?, 
-                    usuario = ?
-                WHERE id = ?
-            """, (
-                dados['razao_social'],
-                dados['cnpj'],
-                dados['inscricao'],
-                dados['usuario'],
-                dados['id']
-            ))
-                
-            conn.commit()
-            return cursor.rowcount > 0
-        except Exception as e:
-            print(f"Erro ao atualizar tomador: {e}")
-            return False
-        finally:
-            conn.close()
-    return False
-
-def delete_tomador(self, tomador_id):
-    """
-    Exclui um tomador do banco de dados
-    
-    :param tomador_id: ID do tomador a ser excluído
-    :return: True se bem-sucedido, False caso contrário
-    """
-    conn = self.create_connection()
-    if conn is not None:
-        try:
-            cursor = conn.cursor()
-            
-            # Verificar se há notas fiscais associadas
-            cursor.execute("SELECT COUNT(*) FROM tb_notas_fiscais WHERE tomador_id = ?", (tomador_id,))
-            count = cursor.fetchone()[0]
-            
-            if count > 0:
-                print(f"Não é possível excluir o tomador: existem {count} notas fiscais associadas")
-                return False
-                
-            # Excluir tomador
-            cursor.execute("DELETE FROM tb_tomadores WHERE id = ?", (tomador_id,))
-            conn.commit()
-            
-            return cursor.rowcount > 0
-        except Exception as e:
-            print(f"Erro ao excluir tomador: {e}")
-            return False
-        finally:
-            conn.close()
-    return False
+            return 0
 
-def export_to_excel(self, query, filename="export.xlsx"):
-        """Exporta dados do banco de dados para um arquivo Excel"""
-        try:
-            with self.app.app_context():
-                db = self.get_db()
-                df = pd.read_sql_query(query, db)
+    def sincronizar_municipios(self, filepath, batch_size=DEFAULT_BATCH_SIZE, diferencial=False):
+        """
+        Reimporta os municípios apenas se o conteúdo do arquivo mudou
 
-                # Cria um buffer na memória para o arquivo Excel
-                output = io.BytesIO()
-                with pd.ExcelWriter(output, engine='xlsxwriter') as writer:
-                    df.to_excel(writer, index=False, sheet_name='Dados')
+        O hash SHA-256 do arquivo é comparado com o último hash importado,
+        guardado em tb_metadados. A verificação é repetida dentro de uma
+        transação BEGIN IMMEDIATE, de modo que, com vários workers iniciando
+        ao mesmo tempo, apenas o primeiro reimporta e os demais apenas
+        aguardam o lock e encontram o hash já atualizado.
 
-                # Prepara a resposta para download
-                output.seek(0)
-                response = make_response(output.getvalue())
-                response.headers["Content-Disposition"] = f"attachment; filename={filename}"
-                response.headers["Content-Type"] = "application/vnd.openxmlformats-officedocument.spreadsheetml.sheet"
+        :param filepath: Caminho para o arquivo de municípios
+        :param batch_size: Quantidade de registros gravados por lote
+        :param diferencial: Se deve aplicar apenas as diferenças em vez de apagar e regravar
+        :return: Número de municípios importados (0 se o arquivo não mudou)
+        """
+        if not os.path.exists(filepath):
+            logging.error(f"Arquivo não encontrado: {filepath}")
+            return 0
 
-                self.logger.info(f"Dados exportados para Excel com sucesso: {filename}")
-                return response
+        hash_arquivo = self._calcular_hash_arquivo(filepath)
+        if self.get_metadado('municipios_hash') == hash_arquivo:
+            logging.info(f"Municípios já atualizados ({filepath}), importação ignorada")
+            return 0
 
-        except Exception as e:
-            self.logger.error(f"Erro ao exportar dados para Excel: {str(e)}")
-            raise
+        try:
+            with self.transacao_escrita() as conn:
+                cursor = conn.cursor()
 
+                # Outro processo pode ter importado enquanto aguardávamos o lock
+                cursor.execute("SELECT valor FROM tb_metadados WHERE chave = 'municipios_hash'")
+                row = cursor.fetchone()
+                if row and row[0] == hash_arquivo:
+                    logging.info("Municípios importados por outro processo, importação ignorada")
+                    return 0
+
+                imported_count = self._importar_arquivo(filepath, conn, batch_size, diferencial=diferencial)
+                if imported_count == 0:
+                    conn.rollback()
+                    return 0
 
-def insert_tomador(self, dados):
-    """
-    Insere um novo tomador no banco de dados
-    
-    :param dados: Dicionário com dados do tomador
-    :return: ID do tomador inserido ou None se falhar
-    """
-    conn = self.create_connection()
-    if conn is not None:
-        try:
-            cursor = conn.cursor()
-            
-            # Remover caracteres não numéricos do CNPJ
-            cnpj = ''.join(filter(str.isdigit, dados['cnpj']))
-            
-            # Validar campos obrigatórios
-            if not dados.get('razao_social'):
-                print("Erro: Razão social é obrigatória")
-                return None
-            
-            if not cnpj or len(cnpj) < 11:
-                print("Erro: CNPJ/CPF inválido")
-                return None
-            
-            # Verificar se o tomador já existe pelo CNPJ
-            cursor.execute("SELECT id FROM tb_tomadores WHERE cnpj = ?", (cnpj,))
-            existing_tomador = cursor.fetchone()
-            
-            if existing_tomador:
-                # Atualizar tomador existente
-                cursor.execute("""
-                    UPDATE tb_tomadores 
-                    SET razao_social = ?, 
-                        inscricao = ?, 
-                        usuario = ? 
-                    WHERE id = ?
-                """, (
-                    dados['razao_social'], 
-                    dados.get('inscricao', ''), 
-                    dados.get('usuario', ''),
-                    existing_tomador[0]
-                ))
-                conn.commit()
-                print(f"Tomador atualizado: {dados['razao_social']}")
-                return existing_tomador[0]
-            else:
-                # Inserir novo tomador
                 cursor.execute("""
-                    INSERT INTO tb_tomadores 
-                    (razao_social, cnpj, inscricao, usuario) 
-                    VALUES (?, ?, ?, ?)
-                """, (
-                    dados['razao_social'], 
-                    cnpj, 
-                    dados.get('inscricao', ''), 
-                    dados.get('usuario', '')
-                ))
-                conn.commit()
-                tomador_id = cursor.lastrowid
-                print(f"Novo tomador inserido: {dados['razao_social']}")
-                return tomador_id
-        
+                    INSERT OR REPLACE INTO tb_metadados (chave, valor)
+                    VALUES ('municipios_hash', ?)
+                """, (hash_arquivo,))
+
+            logging.info(f"{imported_count} municípios importados de {filepath}")
+            self.recarregar_indice_municipios()
+            return imported_count
+
         except Exception as e:
-            print(f"Erro ao inserir/atualizar tomador: {e}")
-            conn.rollback()
-            return None
-        
-        finally:
-            if conn:
-                conn.close()
-    
-    return None
+            logging.error(f"Erro ao sincronizar municípios: {e}")
+            return 0
 
+    def _calcular_hash_arquivo(self, filepath):
+        """Calcula o hash SHA-256 do conteúdo de um arquivo"""
+        sha256 = hashlib.sha256()
+        with open(filepath, 'rb') as file:
+            for bloco in iter(lambda: file.read(1024 * 1024), b''):
+                sha256.update(bloco)
+        return sha256.hexdigest()
 
-def export_to_excel(self, filepath=None):
-    """
-    Exporta todas as notas fiscais para um arquivo Excel
-    
-    :param filepath: Caminho para salvar o arquivo. Se None, usa um arquivo temporário
-    :return: Caminho do arquivo ou objeto de resposta para download
-    """
-    try:
-        # Conectar ao banco de dados
-        conn = self.create_connection()
-        
-        if conn is None:
-            logging.error("Não foi possível conectar ao banco de dados")
-            return False
+    def get_metadado(self, chave):
+        """
+        Obtém um valor de controle gravado em tb_metadados
 
-        try:
-            # Consulta para obter todas as notas fiscais com detalhes completos
-            query = """
-            SELECT 
-                nf.id AS 'Identificador',
-                nf.referencia AS 'Referência',
-                nf.cnpj AS 'CNPJ',
-                f.descricao_fornecedor AS 'Fornecedor',
-                nf.tipo_servico AS 'Tipo de Serviço',
-                nf.base_calculo AS 'Base de Cálculo',
-                nf.numero_nf AS 'Número NF',
-                nf.dt_emissao AS 'Data de Emissão',
-                nf.dt_pagamento AS 'Data de Pagamento',
-                nf.aliquota AS 'Alíquota',
-                nf.valor_nf AS 'Valor NF',
-                nf.recolhimento AS 'Recolhimento',
-                nf.recibo AS 'Recibo',
-                nf.inscricao_municipal AS 'Inscrição Municipal',
-                CASE WHEN nf.cadastrado_goiania = 1 THEN 'Sim' ELSE 'Não' END AS 'Cadastrado em Goiânia',
-                CASE WHEN nf.fora_pais = 1 THEN 'Sim' ELSE 'Não' END AS 'Fora do País'
-            FROM tb_notas_fiscais nf
-            LEFT JOIN tb_fornecedores f ON nf.fornecedor_id = f.id
-            ORDER BY nf.dt_emissao DESC
-            """
-            
-            # Ler dados para um DataFrame
-            df = pd.read_sql_query(query, conn)
-            
-            # Criar arquivo temporário se não for fornecido
-            close_temp = False
-            if filepath is None:
-                # Cria um arquivo temporário
-                temp = tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx')
-                filepath = temp.name
-                close_temp = True
-                temp.close()
-            
-            # Exportar para Excel
-            df.to_excel(filepath, index=False, engine='openpyxl')
-            
-            logging.info(f"Notas fiscais exportadas com sucesso para {filepath}")
-            
-            return filepath
-        
-        except Exception as e:
-            logging.error(f"Erro ao exportar notas fiscais: {e}")
-            return False
-        
-        finally:
-            if conn:
+        :param chave: Nome do metadado
+        :return: Valor gravado ou None se não existir
+        """
+        conn = self.create_connection()
+        if conn is not None:
+            try:
+                cursor = conn.cursor()
+                cursor.execute("SELECT valor FROM tb_metadados WHERE chave = ?", (chave,))
+                row = cursor.fetchone()
+                return row[0] if row else None
+            except Error as e:
+                print(f"Erro ao obter metadado {chave}: {e}")
+            finally:
                 conn.close()
-    
-    except Exception as e:
-        logging.error(f"Erro geral na exportação: {e}")
-        return False
+        return None
 
-def export_to_excel_por_tomador(self, tomador_id, filepath=None):
-    """
-    Exporta notas fiscais de um tomador específico para Excel
-    
-    :param tomador_id: ID do tomador
-    :param filepath: Caminho para salvar o arquivo. Se None, usa um arquivo temporário
-    :return: Caminho do arquivo ou False se falhar
-    """
-    try:
-        # Conectar ao banco de dados
-        conn = self.create_connection()
-        
-        if conn is None:
-            logging.error("Não foi possível conectar ao banco de dados")
-            return False
+    def _importar_arquivo(self, filepath, conn, batch_size=DEFAULT_BATCH_SIZE, progresso=None,
+                          parser=PARSER_PADRAO, diferencial=False, processos=1):
+        """
+        Importa os municípios do arquivo para o banco de dados
 
-        try:
-            # Consulta para obter notas fiscais do tomador
-            query = """
-            SELECT 
-                nf.id AS 'Identificador',
-                nf.referencia AS 'Referência',
-                nf.cnpj AS 'CNPJ',
-                f.descricao_fornecedor AS 'Fornecedor',
-                nf.tipo_servico AS 'Tipo de Serviço',
-                nf.base_calculo AS 'Base de Cálculo',
-                nf.numero_nf AS 'Número NF',
-                nf.dt_emissao AS 'Data de Emissão',
-                nf.dt_pagamento AS 'Data de Pagamento',
-                nf.aliquota AS 'Alíquota',
-                nf.valor_nf AS 'Valor NF',
-                nf.recolhimento AS 'Recolhimento',
-                nf.recibo AS 'Recibo',
-                nf.inscricao_municipal AS 'Inscrição Municipal',
-                CASE WHEN nf.cadastrado_goiania = 1 THEN 'Sim' ELSE 'Não' END AS 'Cadastrado em Goiânia',
-                CASE WHEN nf.fora_pais = 1 THEN 'Sim' ELSE 'Não' END AS 'Fora do País'
-            FROM tb_notas_fiscais nf
-            LEFT JOIN tb_fornecedores f ON nf.fornecedor_id = f.id
-            LEFT JOIN tb_tomadores t ON nf.tomador_id = t.id
-            WHERE t.id = ?
-            ORDER BY nf.dt_emissao DESC
-            """
-            
-            # Ler dados para um DataFrame
-            df = pd.read_sql_query(query, conn, params=(tomador_id,))
-            
-            # Criar arquivo temporário se não for fornecido
-            close_temp = False
-            if filepath is None:
-                # Cria um arquivo temporário
-                temp = tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx')
-                filepath = temp.name
-                close_temp = True
-                temp.close()
-            
-            # Exportar para Excel
-            df.to_excel(filepath, index=False, engine='openpyxl')
-            
-            logging.info(f"Notas fiscais do tomador {tomador_id} exportadas com sucesso para {filepath}")
-            
-            return filepath
-        
-        except Exception as e:
-            logging.error(f"Erro ao exportar notas fiscais do tomador: {e}")
-            return False
-        
-        finally:
-            if conn:
-                conn.close()
-    
-    except Exception as e:
-        logging.error(f"Erro geral na exportação: {e}")
-        return False
+        O encoding e o formato são detectados no trecho inicial do arquivo,
+        que é aberto uma única vez para a detecção e a leitura.
+
+        :param filepath: Caminho para o arquivo
+        :param conn: Conexão com o banco de dados
+        :param batch_size: Quantidade de registros gravados por lote
+        :param progresso: Função que recebe o progresso após cada lote gravado
+        :param parser: 'linhas' (linha a linha) ou 'colunar' (pandas, em blocos)
+        :param diferencial: Se deve aplicar apenas as diferenças (inclusões,
+                            alterações e exclusões) em vez de apagar e regravar
+        :param processos: Processos usados na conversão de arquivos grandes (1 = sem paralelismo)
+        :return: Número de municípios importados
+        """
+        engine = MunicipioImportEngine(batch_size=batch_size, parser=parser, processos=processos)
 
-def limpar_notas_fiscais(self):
-    """
-    Limpa todas as notas fiscais da tabela
-    
-    :return: True se a limpeza for bem-sucedida, False caso contrário
-    """
-    conn = self.create_connection()
-    if conn is not None:
         try:
-            cursor = conn.cursor()
-            
-            # Excluir todas as notas fiscais
-            cursor.execute("DELETE FROM tb_notas_fiscais")
-            
-            # Commit da transação
-            conn.commit()
-            
-            logging.info("Todas as notas fiscais foram excluídas")
-            return True
-        
+            with abrir_arquivo_municipios(filepath) as (formato, file):
+                if not formato:
+                    return 0
+                if diferencial:
+                    resultado = engine.importar_diferencial(conn, file, formato, progresso=progresso)
+                else:
+                    resultado = engine.importar(conn, file, formato, progresso=progresso)
+
+            return resultado['importados']
+
         except Exception as e:
-            logging.error(f"Erro ao limpar notas fiscais: {e}")
-            conn.rollback()
-            return False
-        
-        finally:
-            if conn:
-                conn.close()
-    
-    return False
+            logging.error(f"Erro ao ler arquivo: {e}")
+            return 0
 
 
 def validate_cnpj(self, cnpj):
@@ -1145,127 +1527,6 @@ def clean_cnpj(self, cnpj):
     """
     return ''.join(filter(str.isdigit, str(cnpj)))
 
-def get_fornecedor_by_cnpj(self, cnpj):
-    """
-    Busca um fornecedor pelo CNPJ
-    
-    :param cnpj: CNPJ do fornecedor
-    :return: Dados do fornecedor ou None
-    """
-    # Limpar CNPJ
-    cnpj_limpo = self.clean_cnpj(cnpj)
-    
-    conn = self.create_connection()
-    if conn is not None:
-        try:
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT descricao_fornecedor, uf, municipio, cod_municipio,
-                       cadastrado_goiania, fora_pais
-                FROM tb_fornecedores 
-                WHERE REPLACE(REPLACE(REPLACE(cnpj, '.', ''), '/', ''), '-', '') = ?
-            """, (cnpj_limpo,))
-            
-            fornecedor = cursor.fetchone()
-            return fornecedor
-        
-        except Exception as e:
-            print(f"Erro ao buscar fornecedor por CNPJ: {e}")
-            return None
-        
-        finally:
-            if conn:
-                conn.close()
-    
-    return None
-
-def insert_fornecedor(self, cnpj, descricao, uf, municipio, cod_municipio, fora_pais=False, cadastrado_goiania=False):
-    """
-    Insere ou atualiza um fornecedor
-    
-    :param cnpj: CNPJ do fornecedor
-    :param descricao: Nome/Descrição do fornecedor
-    :param uf: UF do fornecedor
-    :param municipio: Município do fornecedor
-    :param cod_municipio: Código do município
-    :param fora_pais: Se o fornecedor está fora do país
-    :param cadastrado_goiania: Se o fornecedor está cadastrado em Goiânia
-    :return: ID do fornecedor
-    """
-    # Validar CNPJ
-    if not self.validate_cnpj(cnpj):
-        print("CNPJ inválido")
-        return None
-
-    # Limpar CNPJ
-    cnpj_limpo = self.clean_cnpj(cnpj)
-    
-    conn = self.create_connection()
-    if conn is not None:
-        try:
-            cursor = conn.cursor()
-            
-            # Verificar se o fornecedor já existe
-            cursor.execute("""
-                SELECT id FROM tb_fornecedores 
-                WHERE REPLACE(REPLACE(REPLACE(cnpj, '.', ''), '/', ''), '-', '') = ?
-            """, (cnpj_limpo,))
-            
-            existing_fornecedor = cursor.fetchone()
-            
-            if existing_fornecedor:
-                # Atualizar fornecedor existente
-                cursor.execute("""
-                    UPDATE tb_fornecedores 
-                    SET descricao_fornecedor = ?, 
-                        uf = ?, 
-                        municipio = ?, 
-                        cod_municipio = ?,
-                        cadastrado_goiania = ?,
-                        fora_pais = ?
-                    WHERE id = ?
-                """, (
-                    descricao, 
-                    uf, 
-                    municipio, 
-                    cod_municipio, 
-                    cadastrado_goiania,
-                    fora_pais,
-                    existing_fornecedor[0]
-                ))
-                conn.commit()
-                return existing_fornecedor[0]
-            else:
-                # Inserir novo fornecedor
-                cursor.execute("""
-                    INSERT INTO tb_fornecedores 
-                    (descricao_fornecedor, uf, municipio, cod_municipio, 
-                     cadastrado_goiania, fora_pais, cnpj) 
-                    VALUES (?, ?, ?, ?, ?, ?, ?)
-                """, (
-                    descricao, 
-                    uf, 
-                    municipio, 
-                    cod_municipio, 
-                    cadastrado_goiania,
-                    fora_pais,
-                    cnpj_limpo
-                ))
-                conn.commit()
-                return cursor.lastrowid
-        
-        except Exception as e:
-            print(f"Erro ao inserir/atualizar fornecedor: {e}")
-            conn.rollback()
-            return None
-        
-        finally:
-            if conn:
-                conn.close()
-    
-    return None
-
-
 def get_notas_fiscais_paginadas(self, page=1, per_page=10, search=None):
     """Retorna notas fiscais paginadas com busca opcional"""
     # Primeiro, garantir que as tabelas estejam criadas
@@ -1511,137 +1772,22 @@ def import_municipios_from_txt(self, filepath):
             return False, "Não foi possível conectar ao banco de dados"
         
         try:
-            cursor = conn.cursor()
-            
-            # Verificar se a tabela existe
-            cursor.execute("""
-                SELECT name FROM sqlite_master 
-                WHERE type='table' AND name='tb_municipios'
-            """)
-            
-            if not cursor.fetchone():
-                # Criar tabela se não existir
-                logger.info("Criando tabela tb_municipios")
-                cursor.execute('''
-                  CREATE TABLE IF NOT EXISTS tb_municipios (
-                        uf TEXT,
-                        cod_municipio TEXT,
-                        nome_municipio TEXT,
-                        PRIMARY KEY (uf, cod_municipio)
-                    )
-                ''')
-            
-            # Limpar tabela existente
-            cursor.execute("DELETE FROM tb_municipios")
-            logger.info("Tabela tb_municipios limpa para nova importação")
-            
-            # Contadores
-            total_lines = 0
-            imported_count = 0
-            error_count = 0
+            # Formatos legados mapeados para o motor de importação
+            formatos = {
+                "SEPARADOR_PONTO_VIRGULA": {'tipo': 'ponto_virgula', 'ordem': ['codigo', 'nome', 'uf']},
+                "SEPARADOR_VIRGULA": {'tipo': 'virgula', 'ordem': ['uf', 'codigo', 'nome']},
+                "FORMATO_PROCESSANDO": {'tipo': 'chave_valor'},
+                "DESCONHECIDO": {'tipo': 'generico'},
+            }
             
-            # Processar o arquivo
+            # Limpar a tabela e gravar os municípios em lotes, em uma única transação
+            engine = MunicipioImportEngine()
             with open(filepath, 'r', encoding=encoding) as file:
-                for line_num, line in enumerate(file, 1):
-                    line = line.strip()
-                    if not line:  # Pular linhas vazias
-                        continue
-                        
-                    total_lines += 1
-                    
-                    try:
-                        # Extrair dados conforme o formato detectado
-                        cod_municipio = None
-                        nome_municipio = None
-                        uf = None
-                        
-                        if formato_detectado == "SEPARADOR_PONTO_VIRGULA":
-                            parts = [part.strip() for part in line.split(';')]
-                            if len(parts) >= 3:
-                                cod_municipio, nome_municipio, uf = parts[0], parts[1], parts[2]
-                                
-                        elif formato_detectado == "SEPARADOR_VIRGULA":
-                            parts = [part.strip() for part in line.split(',')]
-                            if len(parts) >= 3:
-                                uf, cod_municipio, nome_municipio = parts[0], parts[1], parts[2]
-                                
-                        elif formato_detectado == "FORMATO_PROCESSANDO":
-                            # Remover prefixo se existir
-                            if line.startswith("Processando: "):
-                                line = line.replace("Processando: ", "")
-                            
-                            # Extrair partes - padrão: "Código=X, Município=Y, UF=Z"
-                            if "Código=" in line and "," in line:
-                                cod_municipio = line.split("Código=")[1].split(",")[0].strip()
-                            
-                            if "Município=" in line and "," in line:
-                                nome_municipio = line.split("Município=")[1].split(",")[0].strip()
-                            
-                            if "UF=" in line:
-                                uf = line.split("UF=")[1].strip()
-                                
-                        else:
-                            # Tentar formato genérico como último recurso
-                            parts = None
-                            if ';' in line:
-                                parts = [part.strip() for part in line.split(';')]
-                            elif ',' in line:
-                                parts = [part.strip() for part in line.split(',')]
-                                
-                            if parts and len(parts) >= 3:
-                                # Tentar detectar qual parte é qual baseado em padrões
-                                for i, part in enumerate(parts):
-                                    if len(part) == 2 and part.isalpha():
-                                        uf = part
-                                    elif part.isdigit() or (part.startswith('0') and part[1:].isdigit()):
-                                        cod_municipio = part
-                                    else:
-                                        nome_municipio = part
-                                        
-                                # Se não conseguiu identificar, usar posição padrão
-                                if not all([cod_municipio, nome_municipio, uf]):
-                                    if len(parts) >= 3:
-                                        cod_municipio = parts[0]
-                                        nome_municipio = parts[1]
-                                        uf = parts[2]
-                        
-                        # Validar dados extraídos
-                        if not all([cod_municipio, nome_municipio, uf]):
-                            logger.warning(f"Dados incompletos na linha {line_num}: {line}")
-                            error_count += 1
-                            continue
-                        
-                        # Normalizar dados
-                        uf = uf.upper()
-                        nome_municipio = nome_municipio.strip().upper()
-                        cod_municipio = cod_municipio.strip()
-                        
-                        # Validar UF
-                        if len(uf) != 2 or not uf.isalpha():
-                            logger.warning(f"UF inválida na linha {line_num}: {uf}")
-                            error_count += 1
-                            continue
-                        
-                        # Inserir no banco de dados
-                        cursor.execute("""
-                            INSERT OR REPLACE INTO tb_municipios 
-                            (uf, cod_municipio, nome_municipio) 
-                            VALUES (?, ?, ?)
-                        """, (uf, cod_municipio, nome_municipio))
-                        
-                        imported_count += 1
-                        
-                        # Log a cada 100 registros para acompanhamento
-                        if imported_count % 100 == 0:
-                            logger.info(f"Progresso: {imported_count} municípios importados")
-                        
-                    except Exception as e:
-                        error_count += 1
-                        logger.error(f"Erro na linha {line_num}: {str(e)}")
-                        # Continuar com a próxima linha
+                resultado = engine.importar(conn, file, formatos[formato_detectado])
             
-            # Commit das alterações
-            conn.commit()
+            total_lines = resultado['total_linhas']
+            imported_count = resultado['importados']
+            error_count = resultado['erros']
             
             # Relatório final
             msg = (f"Importação concluída!\n"
@@ -1653,6 +1799,7 @@ def import_municipios_from_txt(self, filepath):
             
             # Retornar resultado
             if imported_count > 0:
+                self.recarregar_indice_municipios()
                 return True, msg
             else:
                 return False, "Nenhum município foi importado. Verifique o formato do arquivo."
@@ -1671,43 +1818,3 @@ def import_municipios_from_txt(self, filepath):
         logger.error(msg)
         return False, msg
     
-
-def get_municipio_by_codigo(self, codigo):
-    """
-    Obtém dados de um município pelo código
-    
-    :param codigo: Código do município
-    :return: Tupla (nome_municipio, uf, cod_municipio) ou None se não encontrado
-    """
-    # Limpar código (remover caracteres não numéricos)
-    codigo_numerico = ''.join(filter(str.isdigit, str(codigo)))
-    
-    if not codigo_numerico:
-        return None
-    
-    conn = self.create_connection()
-    if conn is None:
-        return None
-    
-    try:
-        cursor = conn.cursor()
-        
-        # Buscar município pelo código
-        cursor.execute("""
-            SELECT nome_municipio, uf, cod_municipio
-            FROM tb_municipios
-            WHERE cod_municipio = ?
-        """, (codigo_numerico,))
-        
-        municipio = cursor.fetchone()
-        return municipio
-    
-    except Exception as e:
-        print(f"Erro ao buscar município por código: {e}")
-        return None
-    
-    finally:
-        if conn:
-            conn.close()
-
-
@@ -0,0 +1,160 @@
+"""
+db_pool.py - Pool de conexões SQLite por thread
+
+Cada thread (e, portanto, cada requisição atendida por ela) reaproveita uma
+única conexão por arquivo de banco. Os PRAGMAs são aplicados apenas quando a
+conexão é aberta, e o close() chamado pelo código existente devolve a conexão
+ao pool em vez de fechá-la.
+
+Modo de concorrência (vários leitores, um escritor):
+
+- O banco opera em journal_mode=WAL. Leitores (como /api/municipios/<uf>)
+  leem o último snapshot confirmado e nunca são bloqueados por uma escrita
+  em andamento, seja uma importação de municípios ou a gravação de notas.
+- Há no máximo um escritor por vez. Dentro do processo, escritas feitas por
+  ConnectionPool.escrita() são serializadas por um lock; entre processos
+  (vários workers), BEGIN IMMEDIATE e o busy_timeout fazem o segundo
+  escritor aguardar em vez de falhar com "database is locked".
+- Transações de escrita devem ser curtas: prepare os dados antes de abrir
+  a transação e grave tudo de uma vez.
+"""
+
+import logging
+import os
+import sqlite3
+import threading
+from contextlib import contextmanager
+from typing import Dict, Iterator, Optional
+
+logger = logging.getLogger(__name__)
+
+# PRAGMAs aplicados uma única vez, na abertura de cada conexão
+PRAGMAS_PADRAO: Dict[str, object] = {
+    'journal_mode': 'WAL',      # Leitores não bloqueiam o escritor (e vice-versa)
+    'synchronous': 'NORMAL',    # Seguro em WAL; fsync apenas nos checkpoints
+    'cache_size': -32000,       # Cache de páginas de ~32 MB por conexão (valor em KiB)
+    'mmap_size': 268435456,     # Até 256 MB do arquivo lidos via memória mapeada
+    'temp_store': 'MEMORY',     # Tabelas e índices temporários em memória
+    'recursive_triggers': 'ON', # INSERT OR REPLACE dispara os triggers de DELETE da linha substituída
+}
+
+# Tempo máximo (segundos) aguardando um lock de escrita de outra conexão
+TIMEOUT_PADRAO = 30.0
+
+
+class PooledConnection(sqlite3.Connection):
+    """
+    Conexão SQLite que volta para o pool quando fechada
+
+    Chamadas aninhadas de create_connection() na mesma thread recebem a mesma
+    conexão; apenas o último close() desfaz uma transação pendente, como o
+    fechamento real faria.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.emprestimos = 0
+
+    def close(self):
+        """Devolve a conexão ao pool"""
+        self.emprestimos = max(self.emprestimos - 1, 0)
+        if self.emprestimos == 0 and self.in_transaction:
+            self.rollback()
+
+    def fechar(self):
+        """Fecha de fato a conexão com o banco de dados"""
+        super().close()
+
+
+class ConnectionPool:
+    """Mantém uma conexão reutilizável por thread para um arquivo de banco"""
+
+    def __init__(self, db_file: str, pragmas: Optional[Dict[str, object]] = None,
+                 timeout: float = TIMEOUT_PADRAO):
+        """
+        :param db_file: Caminho do banco de dados SQLite
+        :param pragmas: PRAGMAs aplicados na abertura de cada conexão
+        :param timeout: Tempo máximo aguardando locks de escrita
+        """
+        self.db_file = db_file
+        self.pragmas = dict(PRAGMAS_PADRAO if pragmas is None else pragmas)
+        self.timeout = timeout
+        self._local = threading.local()
+        self._pid = os.getpid()
+        self._lock_escrita = threading.RLock()
+
+    def _conectar(self) -> PooledConnection:
+        """Abre uma nova conexão e aplica os PRAGMAs configurados"""
+        conn = sqlite3.connect(self.db_file, timeout=self.timeout, factory=PooledConnection)
+        for nome, valor in self.pragmas.items():
+            conn.execute(f"PRAGMA {nome} = {valor}")
+        logger.debug(f"Nova conexão aberta para {self.db_file} na thread {threading.get_ident()}")
+        return conn
+
+    def get(self) -> PooledConnection:
+        """
+        Obtém a conexão da thread atual, abrindo-a na primeira chamada
+
+        :return: Conexão SQLite (chame close() para devolvê-la ao pool)
+        """
+        # Conexões herdadas de outro processo (fork) não podem ser reutilizadas
+        if self._pid != os.getpid():
+            self._local = threading.local()
+            self._pid = os.getpid()
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = self._conectar()
+            self._local.conn = conn
+
+        conn.emprestimos += 1
+        return conn
+
+    @contextmanager
+    def escrita(self) -> Iterator[PooledConnection]:
+        """
+        Abre uma transação de escrita (BEGIN IMMEDIATE) serializada
+
+        Faz commit ao final do bloco ou rollback se ocorrer uma exceção.
+
+        :return: Conexão da thread atual, já dentro da transação
+        """
+        with self._lock_escrita:
+            conn = self.get()
+            try:
+                conn.execute("BEGIN IMMEDIATE")
+                yield conn
+                conn.commit()
+            except Exception:
+                if conn.in_transaction:
+                    conn.rollback()
+                raise
+            finally:
+                conn.close()
+
+    def liberar(self):
+        """Fecha a conexão da thread atual, se existir"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is not None:
+            self._local.conn = None
+            conn.fechar()
+
+
+_pools: Dict[str, ConnectionPool] = {}
+_pools_lock = threading.Lock()
+
+
+def obter_pool(db_file: str) -> ConnectionPool:
+    """
+    Obtém o pool compartilhado de um arquivo de banco de dados
+
+    :param db_file: Caminho do banco de dados SQLite
+    :return: Pool de conexões (criado na primeira chamada)
+    """
+    chave = os.path.abspath(db_file)
+    with _pools_lock:
+        pool = _pools.get(chave)
+        if pool is None:
+            pool = ConnectionPool(chave)
+            _pools[chave] = pool
+        return pool
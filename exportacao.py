@@ -0,0 +1,398 @@
+"""
+exportacao.py - Exportação de notas fiscais em fluxo contínuo
+
+As notas são lidas do cursor em lotes (fetchmany) e gravadas linha a linha
+em uma planilha xlsxwriter no modo constant_memory, que descarrega cada linha
+no disco assim que a próxima começa. O uso de memória fica constante, seja
+qual for o tamanho de tb_notas_fiscais, ao contrário de montar um DataFrame
+com toda a consulta antes de gravar.
+
+Para downloads, gerar_exportacao() produz o arquivo em pedaços de bytes
+enviados direto na resposta HTTP. O CSV e o Parquet saem à medida que as
+linhas são lidas, com o primeiro byte logo após a primeira leitura. O XLSX é
+a exceção: ele usa o mesmo writer xlsxwriter da gravação em arquivo, que só
+monta o pacote ZIP ao fechar a planilha. Por isso a planilha inteira é
+gravada em um arquivo temporário antes do primeiro byte, e exportações
+grandes devem usar CSV ou Parquet (ou a exportação em segundo plano). O CSV
+segue o padrão brasileiro (ponto e vírgula, vírgula decimal) e o Parquet,
+disponível quando o pyarrow está instalado, é gravado em grupos de linhas
+colunares.
+"""
+
+import csv
+import functools
+import io
+import logging
+import math
+import sqlite3
+import tempfile
+from typing import Any, Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import xlsxwriter
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # Parquet é opcional
+    pa = None
+    pq = None
+
+logger = logging.getLogger(__name__)
+
+# Quantidade de linhas lidas do banco por chamada a fetchmany
+TAMANHO_LOTE_EXPORTACAO = 5000
+
+# Tamanho dos pedaços em que o XLSX gravado é enviado no download
+TAMANHO_PEDACO_XLSX = 1024 * 1024
+
+# Formatos disponíveis para download em fluxo: (mimetype, extensão); o
+# Werkzeug acrescenta charset=utf-8 aos tipos text/*
+FORMATOS_EXPORTACAO: Dict[str, Tuple[str, str]] = {
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx'),
+    'csv': ('text/csv', 'csv'),
+}
+if pa is not None:
+    FORMATOS_EXPORTACAO['parquet'] = ('application/vnd.apache.parquet', 'parquet')
+
+# Quantidade de linhas por grupo de linhas (row group) do Parquet
+LINHAS_POR_GRUPO_PARQUET = 50000
+
+# Tipos das colunas numéricas da exportação de notas no Parquet; as demais são texto
+TIPOS_PARQUET_NOTAS = {
+    'Identificador': 'int64',
+    'Alíquota': 'float64',
+    'Valor NF': 'float64',
+}
+
+# Colunas da exportação de notas fiscais; a ordem segue o índice
+# idx_notas_emissao_id, evitando ordenar a tabela inteira antes da primeira linha
+SQL_EXPORTAR_NOTAS = """
+    SELECT
+        nf.id AS 'Identificador',
+        nf.referencia AS 'Referência',
+        nf.cnpj AS 'CNPJ',
+        f.descricao_fornecedor AS 'Fornecedor',
+        nf.tipo_servico AS 'Tipo de Serviço',
+        nf.base_calculo AS 'Base de Cálculo',
+        nf.numero_nf AS 'Número NF',
+        nf.dt_emissao AS 'Data de Emissão',
+        nf.dt_pagamento AS 'Data de Pagamento',
+        nf.aliquota AS 'Alíquota',
+        nf.valor_nf AS 'Valor NF',
+        nf.recolhimento AS 'Recolhimento',
+        nf.recibo AS 'Recibo',
+        nf.inscricao_municipal AS 'Inscrição Municipal',
+        CASE WHEN nf.cadastrado_goiania = 1 THEN 'Sim' ELSE 'Não' END AS 'Cadastrado em Goiânia',
+        CASE WHEN nf.fora_pais = 1 THEN 'Sim' ELSE 'Não' END AS 'Fora do País'
+    FROM tb_notas_fiscais nf
+    LEFT JOIN tb_fornecedores f ON nf.fornecedor_id = f.id
+    {filtro}
+    ORDER BY COALESCE(nf.dt_emissao, '') DESC, nf.id DESC
+"""
+
+
+def consulta_notas(tomador: bool = False) -> str:
+    """
+    Monta a consulta de exportação de notas fiscais
+
+    :param tomador: Se deve filtrar pelo tomador (um parâmetro: ID do tomador)
+    :return: Consulta SQL
+    """
+    filtro = ""
+    if tomador:
+        filtro = "LEFT JOIN tb_tomadores t ON nf.tomador_id = t.id WHERE t.id = ?"
+    return SQL_EXPORTAR_NOTAS.format(filtro=filtro)
+
+
+def iterar_linhas(cursor: sqlite3.Cursor,
+                  tamanho_lote: int = TAMANHO_LOTE_EXPORTACAO) -> Iterator[List[Tuple]]:
+    """
+    Percorre o resultado de uma consulta já executada em lotes
+
+    :param cursor: Cursor com a consulta executada
+    :param tamanho_lote: Quantidade de linhas por lote
+    :return: Gerador de listas de linhas
+    """
+    while True:
+        lote = cursor.fetchmany(tamanho_lote)
+        if not lote:
+            break
+        yield lote
+
+
+def _valor_xlsx(valor: Any) -> Any:
+    """Números não finitos (NaN, infinito) não existem no XLSX: viram células vazias"""
+    if isinstance(valor, float) and not math.isfinite(valor):
+        return None
+    return valor
+
+
+def exportar_xlsx(conn: sqlite3.Connection, query: str, destino,
+                  params: Sequence = (), nome_planilha: str = 'Notas Fiscais',
+                  tamanho_lote: int = TAMANHO_LOTE_EXPORTACAO) -> int:
+    """
+    Grava o resultado de uma consulta em uma planilha XLSX sem carregá-lo inteiro
+
+    :param conn: Conexão com o banco de dados
+    :param query: Consulta SQL (os nomes das colunas viram o cabeçalho)
+    :param destino: Caminho do arquivo ou objeto de arquivo binário
+    :param params: Parâmetros da consulta
+    :param nome_planilha: Nome da planilha
+    :param tamanho_lote: Quantidade de linhas lidas por lote
+    :return: Quantidade de linhas exportadas
+    """
+    cursor = conn.cursor()
+    cursor.execute(query, params)
+    return _gravar_xlsx(cursor, destino, nome_planilha, tamanho_lote)
+
+
+def _gravar_xlsx(cursor: sqlite3.Cursor, destino, nome_planilha: str = 'Notas Fiscais',
+                 tamanho_lote: int = TAMANHO_LOTE_EXPORTACAO) -> int:
+    """
+    Grava o resultado de uma consulta já executada em uma planilha XLSX
+
+    Único writer de XLSX do módulo, usado pela gravação em arquivo e pelos
+    downloads (gerar_xlsx).
+
+    :param cursor: Cursor com a consulta executada
+    :param destino: Caminho do arquivo ou objeto de arquivo binário
+    :param nome_planilha: Nome da planilha
+    :param tamanho_lote: Quantidade de linhas lidas por lote
+    :return: Quantidade de linhas exportadas
+    """
+    colunas = [descricao[0] for descricao in cursor.description]
+
+    workbook = xlsxwriter.Workbook(destino, {'constant_memory': True, 'in_memory': False})
+    try:
+        planilha = workbook.add_worksheet(nome_planilha)
+        negrito = workbook.add_format({'bold': True})
+        planilha.write_row(0, 0, colunas, negrito)
+
+        total = 0
+        for lote in iterar_linhas(cursor, tamanho_lote):
+            for linha in lote:
+                total += 1
+                planilha.write_row(total, 0, [_valor_xlsx(valor) for valor in linha])
+    finally:
+        workbook.close()
+
+    logger.info(f"{total} linhas exportadas para XLSX")
+    return total
+
+
+def exportar_notas_xlsx(conn: sqlite3.Connection, destino,
+                        tomador_id: Optional[int] = None) -> int:
+    """
+    Exporta as notas fiscais (todas ou de um tomador) para XLSX
+
+    :param conn: Conexão com o banco de dados
+    :param destino: Caminho do arquivo ou objeto de arquivo binário
+    :param tomador_id: ID do tomador ou None para todas as notas
+    :return: Quantidade de notas exportadas
+    """
+    if tomador_id is None:
+        return exportar_xlsx(conn, consulta_notas(), destino)
+    return exportar_xlsx(conn, consulta_notas(tomador=True), destino, params=(tomador_id,))
+
+
+def gerar_xlsx(cursor: sqlite3.Cursor, nome_planilha: str = 'Notas Fiscais',
+               tamanho_lote: int = TAMANHO_LOTE_EXPORTACAO) -> Iterator[bytes]:
+    """
+    Produz um arquivo XLSX em pedaços a partir de uma consulta já executada
+
+    A planilha é gravada pelo mesmo writer de exportar_xlsx (xlsxwriter em
+    constant_memory) em um arquivo temporário, já que o xlsxwriter só monta
+    o pacote ZIP ao fechar a planilha; o arquivo é então enviado em pedaços.
+    Diferente de gerar_csv e gerar_parquet, o primeiro pedaço só sai depois
+    de toda a planilha gravada: para exportações grandes, use CSV ou Parquet.
+
+    :param cursor: Cursor com a consulta executada
+    :param nome_planilha: Nome da planilha
+    :param tamanho_lote: Quantidade de linhas lidas por lote
+    :return: Gerador de pedaços do arquivo
+    """
+    with tempfile.TemporaryFile() as arquivo:
+        _gravar_xlsx(cursor, arquivo, nome_planilha, tamanho_lote)
+        arquivo.seek(0)
+        for pedaco in iter(lambda: arquivo.read(TAMANHO_PEDACO_XLSX), b''):
+            yield pedaco
+
+
+def _decimal_brasileiro(valor: Any) -> Any:
+    """Escreve números reais com vírgula decimal (1234.5 -> 1234,5)"""
+    if isinstance(valor, float):
+        return repr(valor).replace('.', ',')
+    return valor
+
+
+def gerar_csv(cursor: sqlite3.Cursor, delimitador: str = ';', decimal: str = ',',
+              tamanho_lote: int = TAMANHO_LOTE_EXPORTACAO) -> Iterator[bytes]:
+    """
+    Produz um arquivo CSV (UTF-8 com BOM, lido corretamente pelo Excel) em pedaços
+
+    :param cursor: Cursor com a consulta executada
+    :param delimitador: Separador de campos
+    :param decimal: Separador decimal dos números reais ('.' ou ',')
+    :param tamanho_lote: Quantidade de linhas lidas por lote
+    :return: Gerador de pedaços do arquivo
+    """
+    buffer = io.StringIO()
+    escritor = csv.writer(buffer, delimiter=delimitador, lineterminator='\r\n')
+    escritor.writerow([descricao[0] for descricao in cursor.description])
+    yield ('\ufeff' + buffer.getvalue()).encode('utf-8')
+
+    total = 0
+    for lote in iterar_linhas(cursor, tamanho_lote):
+        buffer.seek(0)
+        buffer.truncate()
+        if decimal == ',':
+            lote = [[_decimal_brasileiro(valor) for valor in linha] for linha in lote]
+        escritor.writerows(lote)
+        total += len(lote)
+        yield buffer.getvalue().encode('utf-8')
+
+    logger.info(f"{total} linhas exportadas para CSV")
+
+
+class _SaidaContinua:
+    """
+    Destino de escrita não posicionável que acumula bytes até serem consumidos
+
+    O ParquetWriter grava cada grupo de linhas ao final de write_batch; os
+    bytes acumulados são enviados na resposta e descartados em seguida.
+    """
+
+    def __init__(self):
+        self._partes: List[bytes] = []
+        self._posicao = 0
+        self.closed = False
+
+    def write(self, dados) -> int:
+        self._partes.append(bytes(dados))
+        self._posicao += len(dados)
+        return len(dados)
+
+    def tell(self) -> int:
+        return self._posicao
+
+    def flush(self):
+        pass
+
+    def close(self):
+        self.closed = True
+
+    def consumir(self) -> bytes:
+        """Retorna os bytes acumulados desde a última chamada"""
+        dados = b''.join(self._partes)
+        self._partes.clear()
+        return dados
+
+
+def _coluna_parquet(valores: Sequence[Any], tipo: str):
+    """Converte os valores de uma coluna para o tipo Arrow indicado"""
+    if tipo == 'int64':
+        return pa.array([None if v is None else int(v) for v in valores], type=pa.int64())
+    if tipo == 'float64':
+        return pa.array([None if v is None else float(v) for v in valores], type=pa.float64())
+    return pa.array([None if v is None else str(v) for v in valores], type=pa.string())
+
+
+def gerar_parquet(cursor: sqlite3.Cursor, tipos: Optional[Dict[str, str]] = None,
+                  linhas_por_grupo: int = LINHAS_POR_GRUPO_PARQUET,
+                  tamanho_lote: int = TAMANHO_LOTE_EXPORTACAO) -> Iterator[bytes]:
+    """
+    Produz um arquivo Parquet em pedaços, um grupo de linhas por vez
+
+    :param cursor: Cursor com a consulta executada
+    :param tipos: Tipo ('int64', 'float64' ou 'string') por coluna; o padrão é texto
+    :param linhas_por_grupo: Linhas acumuladas antes de gravar cada grupo
+    :param tamanho_lote: Quantidade de linhas lidas por lote
+    :return: Gerador de pedaços do arquivo
+    :raises ValueError: Se o pyarrow não estiver instalado
+    """
+    if pa is None:
+        raise ValueError("Exportação em Parquet requer o pacote pyarrow")
+
+    tipos = tipos or {}
+    colunas = [descricao[0] for descricao in cursor.description]
+    tipos_colunas = [tipos.get(coluna, 'string') for coluna in colunas]
+    schema = pa.schema([
+        (coluna, _coluna_parquet([], tipo).type) for coluna, tipo in zip(colunas, tipos_colunas)
+    ])
+
+    saida = _SaidaContinua()
+    total = 0
+    with pq.ParquetWriter(pa.PythonFile(saida, mode='w'), schema, compression='snappy') as escritor:
+        def gravar(linhas):
+            valores_por_coluna = list(zip(*linhas))
+            escritor.write_batch(pa.record_batch(
+                [_coluna_parquet(valores, tipo) for valores, tipo in zip(valores_por_coluna, tipos_colunas)],
+                schema=schema
+            ))
+
+        pendentes = []
+        for lote in iterar_linhas(cursor, tamanho_lote):
+            pendentes.extend(lote)
+            total += len(lote)
+            if len(pendentes) >= linhas_por_grupo:
+                gravar(pendentes)
+                pendentes = []
+                dados = saida.consumir()
+                if dados:
+                    yield dados
+
+        if pendentes:
+            gravar(pendentes)
+
+    yield saida.consumir()
+    logger.info(f"{total} linhas exportadas para Parquet")
+
+
+_GERADORES: Dict[str, Callable[[sqlite3.Cursor], Iterator[bytes]]] = {
+    'xlsx': gerar_xlsx,
+    'csv': gerar_csv,
+    'parquet': functools.partial(gerar_parquet, tipos=TIPOS_PARQUET_NOTAS),
+}
+
+
+def gerar_exportacao(conn: sqlite3.Connection, formato: str = 'xlsx',
+                     tomador_id: Optional[int] = None) -> Iterator[bytes]:
+    """
+    Produz a exportação de notas fiscais em pedaços, no formato pedido
+
+    :param conn: Conexão com o banco de dados
+    :param formato: Um dos formatos de FORMATOS_EXPORTACAO
+    :param tomador_id: ID do tomador ou None para todas as notas
+    :return: Gerador de pedaços do arquivo
+    :raises ValueError: Se o formato não for suportado
+    """
+    if formato not in FORMATOS_EXPORTACAO:
+        raise ValueError(f"Formato de exportação não suportado: {formato}")
+
+    cursor = conn.cursor()
+    if tomador_id is None:
+        cursor.execute(consulta_notas())
+    else:
+        cursor.execute(consulta_notas(tomador=True), (tomador_id,))
+    return _GERADORES[formato](cursor)
+
+
+def exportar_notas_arquivo(conn: sqlite3.Connection, destino: str, formato: str = 'xlsx',
+                           tomador_id: Optional[int] = None) -> None:
+    """
+    Grava a exportação de notas fiscais em um arquivo, no formato pedido
+
+    :param conn: Conexão com o banco de dados
+    :param destino: Caminho do arquivo
+    :param formato: Um dos formatos de FORMATOS_EXPORTACAO
+    :param tomador_id: ID do tomador ou None para todas as notas
+    :raises ValueError: Se o formato não for suportado
+    """
+    if formato == 'xlsx':
+        exportar_notas_xlsx(conn, destino, tomador_id)
+        return
+
+    pedacos = gerar_exportacao(conn, formato, tomador_id)
+    with open(destino, 'wb') as arquivo:
+        for pedaco in pedacos:
+            arquivo.write(pedaco)
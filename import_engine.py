@@ -0,0 +1,1018 @@
+"""
+import_engine.py - Motor compartilhado de importação de municípios
+
+Centraliza a conversão das linhas dos arquivos de municípios (IBGE/SIAFI)
+em registros e a gravação em lote na tabela tb_municipios. Os registros
+são agrupados em lotes e gravados com executemany; o lock de escrita do
+banco (BEGIN IMMEDIATE) só é tomado com os lotes já convertidos, e nunca
+fica preso enquanto o arquivo é lido e convertido.
+
+O encoding e o formato do arquivo são detectados a partir de um único trecho
+inicial de tamanho fixo (abrir_arquivo_municipios), e o mesmo arquivo aberto
+é entregue ao parser, sem reabri-lo para cada encoding candidato.
+
+Na recarga completa (importar), o arquivo é gravado em uma tabela ao lado
+(tb_municipios_new_<id>, com nome único por recarga), um lote por transação
+curta, sem prender o lock de escrita durante a leitura do arquivo. A tabela
+é então indexada e trocada por tb_municipios (DROP + RENAME) em uma
+transação curta: tb_municipios só é alterada na troca e os leitores veem a
+tabela antiga, completa, até o commit dela.
+
+Na importação diferencial (importar_diferencial), o arquivo é gravado em uma
+tabela temporária e apenas as diferenças em relação a tb_municipios
+(inclusões, alterações de nome e exclusões) são aplicadas, com três comandos
+SQL sobre conjuntos, em uma transação curta.
+
+Há dois parsers: 'linhas' converte linha a linha (extrair_municipio) e aceita
+todos os formatos; 'colunar' lê os formatos com separador (CODIGO;NOME;UF)
+com pandas.read_csv em blocos e normaliza e valida colunas inteiras de uma
+vez, registrando as linhas inválidas de cada bloco em um único aviso.
+
+Com processos > 1, arquivos grandes são divididos em blocos de bytes
+alinhados ao fim das linhas (dividir_em_blocos), convertidos em paralelo por
+um ProcessPoolExecutor (_processar_bloco) e entregues em ordem à thread que
+grava no banco, que continua sendo a única escritora.
+"""
+
+import codecs
+import contextlib
+import csv
+import io
+import itertools
+import logging
+import multiprocessing
+import os
+import re
+import sqlite3
+import time
+import uuid
+from collections import deque
+from concurrent.futures import ProcessPoolExecutor
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, TextIO, Tuple
+
+import chardet
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+# Quantidade de registros enviados por chamada a executemany
+DEFAULT_BATCH_SIZE = 2000
+
+SQL_INSERIR_MUNICIPIO = """
+    INSERT OR REPLACE INTO tb_municipios
+    (uf, cod_municipio, nome_municipio)
+    VALUES (?, ?, ?)
+"""
+
+SQL_CRIAR_TABELA_MUNICIPIOS = '''
+    CREATE TABLE IF NOT EXISTS tb_municipios (
+        uf TEXT,
+        cod_municipio TEXT,
+        nome_municipio TEXT,
+        PRIMARY KEY (uf, cod_municipio)
+    )
+'''
+
+SQL_CRIAR_TABELA_METADADOS = '''
+    CREATE TABLE IF NOT EXISTS tb_metadados (
+        chave TEXT PRIMARY KEY,
+        valor TEXT
+    )
+'''
+
+# Área de preparação da importação diferencial (temporária, por conexão)
+SQL_CRIAR_TABELA_STAGING = '''
+    CREATE TEMP TABLE IF NOT EXISTS tb_municipios_staging (
+        uf TEXT,
+        cod_municipio TEXT,
+        nome_municipio TEXT,
+        PRIMARY KEY (uf, cod_municipio)
+    )
+'''
+
+SQL_INSERIR_STAGING = """
+    INSERT OR REPLACE INTO temp.tb_municipios_staging
+    (uf, cod_municipio, nome_municipio)
+    VALUES (?, ?, ?)
+"""
+
+# Importação sem limpar: todos os municípios da preparação gravados de uma vez
+SQL_MESCLAR_STAGING = """
+    INSERT OR REPLACE INTO tb_municipios (uf, cod_municipio, nome_municipio)
+    SELECT uf, cod_municipio, nome_municipio FROM temp.tb_municipios_staging
+"""
+
+# Diferença entre o arquivo (staging) e tb_municipios, aplicada nesta ordem
+SQL_DIFERENCA_REMOVER = """
+    DELETE FROM tb_municipios
+    WHERE NOT EXISTS (
+        SELECT 1 FROM temp.tb_municipios_staging AS s
+        WHERE s.uf = tb_municipios.uf AND s.cod_municipio = tb_municipios.cod_municipio
+    )
+"""
+
+SQL_DIFERENCA_ATUALIZAR = """
+    UPDATE tb_municipios
+    SET nome_municipio = s.nome_municipio
+    FROM temp.tb_municipios_staging AS s
+    WHERE s.uf = tb_municipios.uf
+      AND s.cod_municipio = tb_municipios.cod_municipio
+      AND s.nome_municipio IS NOT tb_municipios.nome_municipio
+"""
+
+SQL_DIFERENCA_INSERIR = """
+    INSERT INTO tb_municipios (uf, cod_municipio, nome_municipio)
+    SELECT s.uf, s.cod_municipio, s.nome_municipio
+    FROM temp.tb_municipios_staging AS s
+    WHERE NOT EXISTS (
+        SELECT 1 FROM tb_municipios AS m
+        WHERE m.uf = s.uf AND m.cod_municipio = s.cod_municipio
+    )
+"""
+
+# Versão dos dados de municípios, usada para invalidar índices e caches
+SQL_INCREMENTAR_VERSAO = """
+    INSERT INTO tb_metadados (chave, valor) VALUES ('municipios_versao', '1')
+    ON CONFLICT(chave) DO UPDATE SET valor = CAST(valor AS INTEGER) + 1
+"""
+
+# Registra a versão inicial se ainda não houver uma (importação sem alterações)
+SQL_GARANTIR_VERSAO = """
+    INSERT OR IGNORE INTO tb_metadados (chave, valor) VALUES ('municipios_versao', '1')
+"""
+
+# Recarga completa: tabela montada ao lado e trocada por tb_municipios ao
+# final. Cada recarga usa o prefixo seguido de um identificador próprio, então
+# recargas simultâneas (outro worker) não gravam na mesma tabela
+TABELA_MUNICIPIOS_NOVA = 'tb_municipios_new'
+
+SQL_INSERIR_MUNICIPIO_NOVA = """
+    INSERT OR REPLACE INTO {tabela}
+    (uf, cod_municipio, nome_municipio)
+    VALUES (?, ?, ?)
+"""
+
+# Sufixo de recarga nos nomes dos índices da tabela nova: os nomes dos índices
+# são únicos no banco e os da tabela atual só deixam de existir na troca, então
+# cada recarga troca o sufixo da anterior (se houver) pelo seu identificador
+_RE_SUFIXO_INDICE_RECARGA = re.compile(r'__[0-9a-f]{8}$')
+
+# Início de "CREATE [UNIQUE] INDEX nome ON tb_municipios" em sqlite_master.sql
+_RE_CRIAR_INDICE = re.compile(
+    r'^\s*CREATE\s+(UNIQUE\s+)?INDEX\s+(?:IF\s+NOT\s+EXISTS\s+)?"?(\w+)"?\s+ON\s+"?tb_municipios"?\s*',
+    re.IGNORECASE
+)
+
+# Recebe o progresso da importação após cada lote gravado
+CallbackProgresso = Callable[[Dict[str, Any]], None]
+
+SEPARADORES = {
+    'ponto_virgula': ';',
+    'virgula': ',',
+}
+
+# Parsers disponíveis para MunicipioImportEngine
+PARSERS = ('linhas', 'colunar')
+PARSER_PADRAO = 'linhas'
+
+# Linhas lidas por bloco no parser colunar (os lotes gravados continuam com batch_size)
+TAMANHO_BLOCO_COLUNAR = 50000
+
+# Quantidade de linhas inválidas citadas no aviso de cada bloco (parser colunar)
+MAX_ERROS_DETALHADOS = 10
+
+# Separador que não ocorre nos arquivos: o read_csv entrega cada linha inteira
+# em uma única coluna e a divisão em campos é feita depois, de forma vetorizada
+_SEPARADOR_LINHA_INTEIRA = '\x01'
+
+# Tamanho dos blocos de bytes convertidos por processo na leitura paralela;
+# arquivos menores que um bloco são lidos sem criar processos
+TAMANHO_BLOCO_PARALELO = 4 * 1024 * 1024
+
+# Blocos enviados aos processos à frente da gravação (limita a memória usada
+# quando a gravação é mais lenta que a conversão)
+BLOCOS_PENDENTES_POR_PROCESSO = 2
+
+# Início dos processos da leitura paralela: a importação roda em threads da
+# aplicação (requisições, JobManager) enquanto outras threads seguram locks
+# (pool de conexões, SQLite), e um fork do processo copiaria esses locks já
+# adquiridos; forkserver e spawn iniciam processos sem o estado das threads
+METODO_INICIO_PROCESSOS = (
+    'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+)
+
+# Tamanho do trecho inicial usado para detectar encoding e formato
+TAMANHO_AMOSTRA_DETECCAO = 16 * 1024
+
+# Encodings tentados, em ordem, quando a amostra não é UTF-8 válido e o
+# chardet não tem confiança mínima no encoding detectado
+ENCODINGS_ALTERNATIVOS = ('cp1252', 'latin1')
+
+# Confiança mínima para usar o encoding detectado pelo chardet
+CONFIANCA_MINIMA_ENCODING = 0.7
+
+
+def _formato_da_linha(linha: str) -> Optional[Dict[str, Any]]:
+    """
+    Identifica o formato do arquivo a partir da primeira linha não vazia
+
+    :param linha: Linha já sem espaços nas pontas
+    :return: Dicionário com tipo (e ordem das colunas) ou None se desconhecido
+    """
+    # Formato 3: Processando: Código=123, Município=Nome, UF=XX
+    if "Código=" in linha:
+        if "Município=" in linha and "UF=" in linha:
+            return {'tipo': 'chave_valor'}
+        return None
+
+    # Formatos 1 e 2: codigo;nome;uf e codigo,nome,uf (ou com a UF primeiro)
+    for tipo, separador in SEPARADORES.items():
+        if separador not in linha:
+            continue
+        parts = [p.strip() for p in linha.split(separador)]
+        if len(parts) != 3:
+            return None
+        # A UF é a coluna com duas letras
+        if len(parts[0]) == 2 and parts[0].isalpha():
+            return {'tipo': tipo, 'ordem': ['uf', 'nome', 'codigo']}
+        if len(parts[2]) == 2 and parts[2].isalpha():
+            return {'tipo': tipo, 'ordem': ['codigo', 'nome', 'uf']}
+        return None
+
+    return None
+
+
+def detectar_formato(amostra: bytes, completa: bool = False) -> Optional[Dict[str, Any]]:
+    """
+    Detecta o encoding e o formato a partir do trecho inicial do arquivo
+
+    Apenas as linhas completas da amostra são consideradas, para que um
+    caractere multibyte cortado no fim do trecho não invalide o encoding.
+
+    :param amostra: Primeiros bytes do arquivo
+    :param completa: Se a amostra contém o arquivo inteiro
+    :return: Dicionário com tipo, ordem e encoding, ou None se não detectado
+    """
+    if not completa and b'\n' in amostra:
+        amostra = amostra[:amostra.rindex(b'\n') + 1]
+
+    # UTF-8 válido raramente é coincidência; só sem ele o chardet é consultado
+    candidatos = ['utf-8']
+    try:
+        amostra.decode('utf-8')
+    except UnicodeDecodeError:
+        deteccao = chardet.detect(amostra)
+        confianca = deteccao['confidence'] or 0
+        logger.info(f"Encoding detectado: {deteccao['encoding']} (Confiança: {confianca * 100:.2f}%)")
+        candidatos = ENCODINGS_ALTERNATIVOS
+        if deteccao['encoding'] and confianca >= CONFIANCA_MINIMA_ENCODING:
+            candidatos = (deteccao['encoding'], *ENCODINGS_ALTERNATIVOS)
+
+    for candidato in dict.fromkeys(candidatos):
+        try:
+            texto = amostra.decode(candidato)
+        except (UnicodeDecodeError, LookupError):
+            continue
+
+        # Primeira linha não vazia entre as dez primeiras
+        linhas = [linha.strip() for linha in texto.splitlines()[:10]]
+        primeira_linha = next((linha for linha in linhas if linha), None)
+        if primeira_linha is None:
+            return None
+
+        formato = _formato_da_linha(primeira_linha.lstrip('\ufeff'))
+        if formato is None:
+            return None
+        formato['encoding'] = candidato
+        logger.info(f"Formato detectado: {formato['tipo']} ({candidato})")
+        return formato
+
+    return None
+
+
+@contextlib.contextmanager
+def abrir_arquivo_municipios(filepath: str,
+                             tamanho_amostra: int = TAMANHO_AMOSTRA_DETECCAO
+                             ) -> Iterator[Tuple[Optional[Dict[str, Any]], Optional[TextIO]]]:
+    """
+    Abre um arquivo de municípios, detectando encoding e formato
+
+    O arquivo é aberto uma única vez: o trecho inicial é lido para a
+    detecção e o mesmo arquivo volta ao início para ser lido como texto.
+
+        with abrir_arquivo_municipios(caminho) as (formato, linhas):
+            if formato:
+                engine.importar(conn, linhas, formato)
+
+    :param filepath: Caminho para o arquivo
+    :param tamanho_amostra: Quantidade de bytes lidos para a detecção
+    :return: Tupla (formato, linhas do arquivo); (None, None) se não detectado
+    """
+    with open(filepath, 'rb') as arquivo:
+        amostra = arquivo.read(tamanho_amostra)
+        formato = detectar_formato(amostra, completa=len(amostra) < tamanho_amostra)
+        if formato is None:
+            logger.error(f"Não foi possível determinar o formato do arquivo {filepath}")
+            yield None, None
+            return
+
+        # Caminho e início dos dados (após o BOM), usados pela leitura paralela
+        formato['caminho'] = filepath
+        formato['inicio_dados'] = len(codecs.BOM_UTF8) if amostra.startswith(codecs.BOM_UTF8) else 0
+
+        arquivo.seek(0)
+        # utf-8-sig descarta o BOM, se houver
+        encoding = 'utf-8-sig' if formato['encoding'].lower() in ('utf-8', 'utf8') else formato['encoding']
+        linhas = io.TextIOWrapper(arquivo, encoding=encoding)
+        try:
+            yield formato, linhas
+        finally:
+            linhas.detach()
+
+
+def extrair_municipio(line: str, formato: Dict[str, Any]) -> Optional[Tuple[str, str, str]]:
+    """
+    Extrai os campos de um município de uma linha já sem espaços nas pontas
+
+    :param line: Linha do arquivo
+    :param formato: Informações do formato (tipo e ordem das colunas)
+    :return: Tupla (uf, cod_municipio, nome_municipio) normalizada
+    :raises ValueError: Se a linha não contiver um município válido
+    """
+    cod_municipio = None
+    nome_municipio = None
+    uf = None
+    tipo = formato['tipo']
+
+    if tipo in SEPARADORES:
+        parts = [p.strip() for p in line.split(SEPARADORES[tipo])]
+        if len(parts) != 3:
+            raise ValueError(f"número incorreto de campos: {line}")
+
+        # Atribuir valores conforme a ordem detectada
+        for i, campo in enumerate(formato.get('ordem', ['codigo', 'nome', 'uf'])):
+            if campo == 'codigo':
+                cod_municipio = parts[i]
+            elif campo == 'nome':
+                nome_municipio = parts[i]
+            elif campo == 'uf':
+                uf = parts[i]
+
+    elif tipo == 'chave_valor':
+        # Remover prefixo se existir
+        if line.startswith("Processando: "):
+            line = line.replace("Processando: ", "")
+
+        # Extrair valores utilizando os identificadores
+        if "Código=" in line and "Município=" in line and "UF=" in line:
+            cod_municipio = line.split("Código=")[1].split(",")[0]
+            nome_municipio = line.split("Município=")[1].split(",")[0]
+            uf = line.split("UF=")[1]
+
+    elif tipo == 'generico':
+        # Último recurso: identificar cada parte pelo seu conteúdo
+        parts = None
+        if ';' in line:
+            parts = [p.strip() for p in line.split(';')]
+        elif ',' in line:
+            parts = [p.strip() for p in line.split(',')]
+
+        if parts and len(parts) >= 3:
+            for part in parts:
+                if len(part) == 2 and part.isalpha():
+                    uf = part
+                elif part.isdigit():
+                    cod_municipio = part
+                else:
+                    nome_municipio = part
+
+            # Se não conseguiu identificar, usar posição padrão
+            if not all([cod_municipio, nome_municipio, uf]):
+                cod_municipio, nome_municipio, uf = parts[0], parts[1], parts[2]
+
+    else:
+        raise ValueError(f"formato não suportado: {tipo}")
+
+    # Validar dados
+    if not all([cod_municipio, nome_municipio, uf]):
+        raise ValueError(
+            f"dados incompletos: código={cod_municipio}, "
+            f"município={nome_municipio}, UF={uf}"
+        )
+
+    # Normalizar dados
+    uf = uf.strip().upper()
+    if len(uf) != 2 or not uf.isalpha():
+        raise ValueError(f"UF inválida: {uf}")
+
+    return uf, cod_municipio.strip(), nome_municipio.strip().upper()
+
+
+def dividir_em_blocos(filepath: str, inicio: int = 0,
+                      tamanho_bloco: int = TAMANHO_BLOCO_PARALELO) -> List[Tuple[int, int]]:
+    """
+    Divide o arquivo em intervalos de bytes que terminam no fim de uma linha
+
+    :param filepath: Caminho para o arquivo
+    :param inicio: Posição do primeiro byte de dados (após o BOM)
+    :param tamanho_bloco: Tamanho aproximado de cada bloco, em bytes
+    :return: Lista de tuplas (início, fim) cobrindo o arquivo, em ordem
+    """
+    tamanho = os.path.getsize(filepath)
+    blocos = []
+    with open(filepath, 'rb') as arquivo:
+        while inicio < tamanho:
+            # Avançar até o fim da linha em que o bloco terminaria
+            arquivo.seek(min(inicio + tamanho_bloco, tamanho))
+            arquivo.readline()
+            fim = min(arquivo.tell(), tamanho)
+            blocos.append((inicio, fim))
+            inicio = fim
+    return blocos
+
+
+def _processar_bloco(filepath: str, inicio: int, fim: int,
+                     formato: Dict[str, Any]) -> Tuple[List[Tuple[str, str, str]], int, int, int, List[Tuple[int, str]]]:
+    """
+    Converte um bloco do arquivo em registros (executada nos processos auxiliares)
+
+    :param filepath: Caminho para o arquivo
+    :param inicio: Posição do primeiro byte do bloco
+    :param fim: Posição seguinte ao último byte do bloco
+    :param formato: Informações do formato (tipo, ordem e encoding)
+    :return: Tupla (registros, linhas do bloco, linhas com dados, erros,
+             primeiras linhas inválidas como (número no bloco, motivo))
+    """
+    with open(filepath, 'rb') as arquivo:
+        arquivo.seek(inicio)
+        dados = arquivo.read(fim - inicio)
+
+    registros = []
+    linhas_bloco = total_linhas = erros = 0
+    detalhes = []
+    # newline=None separa as linhas como a leitura sequencial (\n, \r\n ou \r)
+    for linhas_bloco, line in enumerate(io.StringIO(dados.decode(formato['encoding']), newline=None), 1):
+        line = line.strip()
+        if not line:
+            continue
+
+        total_linhas += 1
+        try:
+            registros.append(extrair_municipio(line, formato))
+        except ValueError as e:
+            erros += 1
+            if len(detalhes) < MAX_ERROS_DETALHADOS:
+                detalhes.append((linhas_bloco, str(e)))
+
+    return registros, linhas_bloco, total_linhas, erros, detalhes
+
+
+def _separar_campos(texto: pd.Series, separador: str) -> List[pd.Series]:
+    """
+    Divide linhas com exatamente 3 campos nas três colunas
+
+    Nos arquivos de layout fixo (campos preenchidos com espaços até a mesma
+    largura, como o municipios.txt do IBGE), os separadores ficam nas mesmas
+    posições em todas as linhas e as colunas são obtidas por fatiamento
+    vetorizado; as linhas fora desse layout são divididas individualmente.
+
+    :param texto: Linhas sem espaços nas pontas, todas com 2 separadores
+    :param separador: Separador dos campos
+    :return: Lista com as três colunas, no índice original das linhas
+    """
+    if texto.empty:
+        return [texto.copy() for _ in range(3)]
+
+    # Posições dos separadores na primeira linha
+    primeira = texto.iloc[0]
+    p1 = primeira.find(separador)
+    p2 = primeira.find(separador, p1 + 1)
+    fixo = (texto.str.get(p1) == separador) & (texto.str.get(p2) == separador)
+
+    linhas_fixas = texto[fixo]
+    partes = [linhas_fixas.str.slice(0, p1), linhas_fixas.str.slice(p1 + 1, p2), linhas_fixas.str.slice(p2 + 1)]
+
+    variaveis = texto[~fixo]
+    if not variaveis.empty:
+        divididas = pd.DataFrame(
+            [linha.split(separador) for linha in variaveis.tolist()], index=variaveis.index, dtype=texto.dtype
+        )
+        partes = [pd.concat([parte, divididas[i]]).sort_index() for i, parte in enumerate(partes)]
+
+    return partes
+
+
+class MunicipioImportEngine:
+    """
+    Importa municípios em lote para a tabela tb_municipios
+
+    O mesmo motor é usado pelo DatabaseManager, pelo MunicipioService e pelo
+    script importa_municipios.py, de forma que todos gravam da mesma maneira.
+    """
+
+    def __init__(self, batch_size: int = DEFAULT_BATCH_SIZE, parser: str = PARSER_PADRAO,
+                 processos: int = 1):
+        """
+        :param batch_size: Quantidade de registros por chamada a executemany
+        :param parser: 'linhas' (linha a linha) ou 'colunar' (pandas, em blocos)
+        :param processos: Processos usados na conversão de arquivos grandes
+                          (1 = conversão na própria thread)
+        """
+        if batch_size < 1:
+            raise ValueError("batch_size deve ser maior que zero")
+        if parser not in PARSERS:
+            raise ValueError(f"parser deve ser um de: {', '.join(PARSERS)}")
+        if processos < 1:
+            raise ValueError("processos deve ser maior que zero")
+        self.batch_size = batch_size
+        self.parser = parser
+        self.processos = processos
+
+    def iterar_lotes(self, linhas: Iterable[str], formato: Dict[str, Any],
+                     resultado: Dict[str, Any]) -> Iterator[List[Tuple[str, str, str]]]:
+        """
+        Converte as linhas em lotes de registros prontos para gravação
+
+        Usa o parser configurado; o colunar só se aplica aos formatos com
+        separador, os demais são sempre lidos linha a linha. Com mais de um
+        processo, arquivos maiores que um bloco são convertidos em paralelo
+        (iterar_lotes_paralelo) e as linhas informadas não são usadas.
+
+        :param linhas: Linhas do arquivo (com ou sem quebra de linha)
+        :param formato: Informações do formato
+        :param resultado: Dicionário de contadores atualizado durante a leitura
+        :return: Gerador de listas de tuplas (uf, cod_municipio, nome_municipio)
+        """
+        if self.processos > 1 and self._leitura_paralela_possivel(formato):
+            return self.iterar_lotes_paralelo(formato, resultado)
+        if self.parser == 'colunar' and formato['tipo'] in SEPARADORES:
+            return self.iterar_lotes_colunar(linhas, formato, resultado)
+        return self.iterar_lotes_linhas(linhas, formato, resultado)
+
+    @staticmethod
+    def _leitura_paralela_possivel(formato: Dict[str, Any]) -> bool:
+        """Se o arquivo do formato pode ser dividido em blocos de bytes por linha"""
+        caminho = formato.get('caminho')
+        if not caminho:
+            return False
+        # A divisão procura o byte da quebra de linha (não vale para UTF-16, por exemplo)
+        try:
+            if '\n'.encode(formato['encoding']) != b'\n':
+                return False
+        except LookupError:
+            return False
+        return os.path.getsize(caminho) - formato.get('inicio_dados', 0) > TAMANHO_BLOCO_PARALELO
+
+    def iterar_lotes_paralelo(self, formato: Dict[str, Any],
+                              resultado: Dict[str, Any]) -> Iterator[List[Tuple[str, str, str]]]:
+        """
+        Converte o arquivo em lotes de registros usando vários processos
+
+        O arquivo (formato['caminho']) é dividido em blocos alinhados ao fim
+        das linhas; cada bloco é convertido linha a linha (extrair_municipio)
+        em um processo auxiliar. Os resultados são entregues na ordem do
+        arquivo, com no máximo BLOCOS_PENDENTES_POR_PROCESSO blocos por
+        processo à frente da gravação. As linhas inválidas de cada bloco são
+        registradas em um único aviso. Os processos são iniciados com
+        METODO_INICIO_PROCESSOS (nunca fork), pois a importação pode rodar em
+        qualquer thread da aplicação.
+
+        :param formato: Informações do formato, com caminho e inicio_dados
+        :param resultado: Dicionário de contadores atualizado durante a leitura
+        :return: Gerador de listas de tuplas (uf, cod_municipio, nome_municipio)
+        """
+        caminho = formato['caminho']
+        blocos = iter(dividir_em_blocos(caminho, formato.get('inicio_dados', 0), TAMANHO_BLOCO_PARALELO))
+        linha_inicial = 0
+
+        contexto = multiprocessing.get_context(METODO_INICIO_PROCESSOS)
+        with ProcessPoolExecutor(max_workers=self.processos, mp_context=contexto) as executor:
+            pendentes = deque(
+                executor.submit(_processar_bloco, caminho, inicio, fim, formato)
+                for inicio, fim in itertools.islice(blocos, self.processos * BLOCOS_PENDENTES_POR_PROCESSO)
+            )
+            try:
+                while pendentes:
+                    registros, linhas_bloco, total_linhas, erros, detalhes = pendentes.popleft().result()
+                    proximo = next(blocos, None)
+                    if proximo is not None:
+                        pendentes.append(executor.submit(_processar_bloco, caminho, *proximo, formato))
+
+                    resultado['total_linhas'] += total_linhas
+                    if erros:
+                        resultado['erros'] += erros
+                        texto_detalhes = '; '.join(
+                            f"linha {linha_inicial + numero}: {motivo}" for numero, motivo in detalhes
+                        )
+                        logger.warning(f"{erros} linhas ignoradas ({texto_detalhes})")
+                    linha_inicial += linhas_bloco
+
+                    for inicio in range(0, len(registros), self.batch_size):
+                        yield registros[inicio:inicio + self.batch_size]
+            finally:
+                # Leitura interrompida (erro na gravação): descartar os blocos ainda não iniciados
+                for futuro in pendentes:
+                    futuro.cancel()
+
+    def iterar_lotes_linhas(self, linhas: Iterable[str], formato: Dict[str, Any],
+                            resultado: Dict[str, Any]) -> Iterator[List[Tuple[str, str, str]]]:
+        """
+        Converte as linhas em lotes de registros, uma linha por vez
+
+        :param linhas: Linhas do arquivo (com ou sem quebra de linha)
+        :param formato: Informações do formato
+        :param resultado: Dicionário de contadores atualizado durante a leitura
+        :return: Gerador de listas de tuplas (uf, cod_municipio, nome_municipio)
+        """
+        lote = []
+        for line_num, line in enumerate(linhas, 1):
+            line = line.strip()
+            if not line:
+                continue
+
+            resultado['total_linhas'] += 1
+            try:
+                lote.append(extrair_municipio(line, formato))
+            except ValueError as e:
+                logger.warning(f"Linha {line_num} ignorada: {e}")
+                resultado['erros'] += 1
+                continue
+
+            if len(lote) >= self.batch_size:
+                yield lote
+                lote = []
+
+        if lote:
+            yield lote
+
+    def iterar_lotes_colunar(self, linhas: Iterable[str], formato: Dict[str, Any],
+                             resultado: Dict[str, Any]) -> Iterator[List[Tuple[str, str, str]]]:
+        """
+        Converte as linhas em lotes de registros com operações sobre colunas
+
+        O arquivo é lido pelo pandas.read_csv em blocos de
+        TAMANHO_BLOCO_COLUNAR linhas; a divisão em campos, a normalização
+        (strip/upper) e a validação são feitas sobre o bloco inteiro. As linhas inválidas de cada bloco são
+        contadas em resultado['erros'] e registradas em um único aviso.
+
+        :param linhas: Arquivo aberto em modo texto (ou lista de linhas)
+        :param formato: Informações do formato (tipo com separador e ordem)
+        :param resultado: Dicionário de contadores atualizado durante a leitura
+        :return: Gerador de listas de tuplas (uf, cod_municipio, nome_municipio)
+        """
+        if not hasattr(linhas, 'read'):
+            linhas = io.StringIO(''.join(linha if linha.endswith('\n') else linha + '\n' for linha in linhas))
+
+        separador = SEPARADORES[formato['tipo']]
+        ordem = formato.get('ordem', ['codigo', 'nome', 'uf'])
+        blocos = pd.read_csv(
+            linhas, sep=_SEPARADOR_LINHA_INTEIRA, header=None, names=['linha'], dtype=str,
+            quoting=csv.QUOTE_NONE, na_filter=False, skip_blank_lines=False,
+            chunksize=max(self.batch_size, TAMANHO_BLOCO_COLUNAR),
+            encoding_errors='strict'
+        )
+
+        for bloco in blocos:
+            # Linhas vazias (ou só com espaços) não contam, como no parser por linha
+            texto = bloco['linha'].str.strip()
+            texto = texto[texto != '']
+            if texto.empty:
+                continue
+            resultado['total_linhas'] += len(texto)
+
+            # Divisão em campos; apenas linhas com exatamente 3 campos são válidas
+            campos_ok = texto.str.count(re.escape(separador)) == 2
+            partes = _separar_campos(texto[campos_ok], separador)
+            colunas = {campo: partes[i].str.strip() for i, campo in enumerate(ordem)}
+
+            uf = colunas['uf'].str.upper()
+            cod_municipio = colunas['codigo']
+            nome_municipio = colunas['nome'].str.upper()
+            completos = (uf != '') & (cod_municipio != '') & (nome_municipio != '')
+            uf_ok = uf.str.fullmatch(r'[^\W\d_]{2}').astype(bool)
+            validos = completos & uf_ok
+
+            # Relatório das linhas inválidas do bloco
+            invalidas = len(texto) - int(validos.sum())
+            if invalidas:
+                resultado['erros'] += invalidas
+                motivos = pd.concat([
+                    pd.Series('número incorreto de campos', index=texto.index[~campos_ok]),
+                    pd.Series('dados incompletos', index=completos.index[~completos]),
+                    pd.Series('UF inválida', index=uf_ok.index[completos & ~uf_ok]),
+                ]).sort_index()
+                detalhes = '; '.join(
+                    f"linha {indice + 1}: {motivo}" for indice, motivo in motivos.head(MAX_ERROS_DETALHADOS).items()
+                )
+                logger.warning(f"{invalidas} linhas ignoradas ({detalhes})")
+
+            registros = list(zip(uf[validos].tolist(), cod_municipio[validos].tolist(),
+                                 nome_municipio[validos].tolist()))
+            for inicio in range(0, len(registros), self.batch_size):
+                yield registros[inicio:inicio + self.batch_size]
+
+    @staticmethod
+    def _publicar_progresso(progresso: Optional[CallbackProgresso], resultado: Dict[str, Any],
+                            inicio: float, concluido: bool = False):
+        """Envia ao callback as linhas lidas, gravadas, erros e a vazão atual"""
+        if progresso is None:
+            return
+        decorrido = time.perf_counter() - inicio
+        progresso({
+            'linhas_lidas': resultado['total_linhas'],
+            'linhas_gravadas': resultado['importados'],
+            'erros': resultado['erros'],
+            'linhas_por_segundo': round(resultado['total_linhas'] / decorrido, 1) if decorrido > 0 else 0.0,
+            'decorrido': round(decorrido, 3),
+            'concluido': concluido,
+            # Contagem de alterações da importação diferencial
+            **{chave: resultado[chave] for chave in ('inseridos', 'atualizados', 'removidos') if chave in resultado},
+        })
+
+    def importar(self, conn: sqlite3.Connection, linhas: Iterable[str],
+                 formato: Dict[str, Any], limpar: bool = True,
+                 progresso: Optional[CallbackProgresso] = None) -> Dict[str, Any]:
+        """
+        Grava os municípios das linhas informadas
+
+        Com limpar, os municípios são gravados em uma tabela nova
+        (tb_municipios_new_<id>), um lote por transação BEGIN IMMEDIATE: cada
+        lote é convertido antes de a transação começar, e outros escritores
+        podem gravar entre um lote e outro. Depois da carga, a tabela nova
+        recebe os mesmos índices de tb_municipios (em outra transação curta) e,
+        em uma última transação, tb_municipios é apagada e a tabela nova é
+        renomeada no lugar dela. Os leitores (WAL) veem a tabela antiga,
+        completa, até o commit da troca; se a importação falhar, a tabela nova
+        é apagada. Sem limpar, os municípios são convertidos para a tabela
+        temporária tb_municipios_staging (sem lock de escrita no banco) e
+        gravados em tb_municipios com um único INSERT ... SELECT, em uma
+        transação curta: o lock dura a gravação, não a leitura do arquivo.
+
+        Se a conexão já estiver em uma transação, ela é reaproveitada (carga,
+        índices e troca ficam nela) e o commit fica a cargo de quem chamou.
+        Quando algum município é gravado, a versão dos dados
+        (tb_metadados.municipios_versao) é incrementada junto com a troca.
+
+        :param conn: Conexão com o banco de dados
+        :param linhas: Linhas do arquivo
+        :param formato: Informações do formato
+        :param limpar: Se deve substituir os municípios existentes pelos do arquivo
+        :param progresso: Função chamada após cada lote com linhas_lidas,
+                          linhas_gravadas, erros e linhas_por_segundo
+        :return: Dicionário com total_linhas, importados, erros e duracao
+        """
+        resultado = {'total_linhas': 0, 'importados': 0, 'erros': 0, 'duracao': 0.0}
+        inicio = time.perf_counter()
+        transacao_propria = not conn.in_transaction
+        cursor = conn.cursor()
+        cursor.execute(SQL_CRIAR_TABELA_MUNICIPIOS)
+        cursor.execute(SQL_CRIAR_TABELA_METADADOS)
+
+        if not transacao_propria:
+            self._gravar_em_transacao(conn, linhas, formato, limpar, resultado, inicio, progresso)
+        elif limpar:
+            self._recarregar(conn, linhas, formato, resultado, inicio, progresso)
+        else:
+            self._mesclar(conn, linhas, formato, resultado, inicio, progresso)
+
+        resultado['duracao'] = time.perf_counter() - inicio
+        self._publicar_progresso(progresso, resultado, inicio, concluido=True)
+        logger.info(
+            f"Importação concluída: {resultado['importados']} municípios importados, "
+            f"{resultado['erros']} erros em {resultado['duracao']:.3f}s"
+        )
+        return resultado
+
+    def _recarregar(self, conn: sqlite3.Connection, linhas: Iterable[str], formato: Dict[str, Any],
+                    resultado: Dict[str, Any], inicio: float, progresso: Optional[CallbackProgresso]):
+        """Recarga completa com transações próprias: carga por lote, índices e troca (ver importar)"""
+        cursor = conn.cursor()
+        tabela_nova = f"{TABELA_MUNICIPIOS_NOVA}_{uuid.uuid4().hex[:8]}"
+        sql_inserir = SQL_INSERIR_MUNICIPIO_NOVA.format(tabela=tabela_nova)
+        criada = False
+
+        try:
+            for lote in self.iterar_lotes(linhas, formato, resultado):
+                cursor.execute("BEGIN IMMEDIATE")
+                if not criada:
+                    self._criar_tabela_nova(cursor, tabela_nova)
+                    criada = True
+                cursor.executemany(sql_inserir, lote)
+                conn.commit()
+                resultado['importados'] += len(lote)
+                self._publicar_progresso(progresso, resultado, inicio)
+
+            if criada:
+                cursor.execute("BEGIN IMMEDIATE")
+                self._indexar_tabela_nova(cursor, tabela_nova)
+                conn.commit()
+
+                cursor.execute("BEGIN IMMEDIATE")
+                self._trocar_tabela_nova(cursor, tabela_nova)
+                cursor.execute(SQL_INCREMENTAR_VERSAO)
+                conn.commit()
+
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            if criada:
+                self._apagar_tabela_nova(conn, tabela_nova)
+            raise
+
+    def _mesclar(self, conn: sqlite3.Connection, linhas: Iterable[str], formato: Dict[str, Any],
+                 resultado: Dict[str, Any], inicio: float, progresso: Optional[CallbackProgresso]):
+        """Importação sem limpar: preparação na tabela temporária e gravação em uma transação curta"""
+        cursor = conn.cursor()
+        cursor.execute(SQL_CRIAR_TABELA_STAGING)
+
+        try:
+            # Preparação: a tabela temporária não bloqueia o banco principal
+            cursor.execute("DELETE FROM temp.tb_municipios_staging")
+            for lote in self.iterar_lotes(linhas, formato, resultado):
+                cursor.executemany(SQL_INSERIR_STAGING, lote)
+                resultado['importados'] += len(lote)
+                self._publicar_progresso(progresso, resultado, inicio)
+
+            if resultado['importados'] > 0:
+                if conn.in_transaction:
+                    conn.commit()
+                cursor.execute("BEGIN IMMEDIATE")
+                cursor.execute(SQL_MESCLAR_STAGING)
+                cursor.execute(SQL_INCREMENTAR_VERSAO)
+
+            if conn.in_transaction:
+                conn.commit()
+
+        except Exception:
+            if conn.in_transaction:
+                conn.rollback()
+            raise
+
+        finally:
+            cursor.execute("DROP TABLE IF EXISTS temp.tb_municipios_staging")
+
+    def _gravar_em_transacao(self, conn: sqlite3.Connection, linhas: Iterable[str], formato: Dict[str, Any],
+                             limpar: bool, resultado: Dict[str, Any], inicio: float,
+                             progresso: Optional[CallbackProgresso]):
+        """
+        Grava o arquivo na transação já aberta na conexão por quem chamou
+
+        O lock de escrita já pertence a quem chamou; carga (direta ou na
+        tabela nova), índices e troca acontecem dentro da transação dele, e o
+        commit (ou rollback) fica a cargo de quem chamou.
+        """
+        cursor = conn.cursor()
+        tabela_nova = f"{TABELA_MUNICIPIOS_NOVA}_{uuid.uuid4().hex[:8]}"
+        sql_inserir = SQL_INSERIR_MUNICIPIO_NOVA.format(tabela=tabela_nova) if limpar else SQL_INSERIR_MUNICIPIO
+
+        for lote in self.iterar_lotes(linhas, formato, resultado):
+            if limpar and resultado['importados'] == 0:
+                self._criar_tabela_nova(cursor, tabela_nova)
+            cursor.executemany(sql_inserir, lote)
+            resultado['importados'] += len(lote)
+            self._publicar_progresso(progresso, resultado, inicio)
+
+        if resultado['importados'] > 0:
+            if limpar:
+                self._indexar_tabela_nova(cursor, tabela_nova)
+                self._trocar_tabela_nova(cursor, tabela_nova)
+            cursor.execute(SQL_INCREMENTAR_VERSAO)
+
+    @staticmethod
+    def _criar_tabela_nova(cursor: sqlite3.Cursor, tabela_nova: str):
+        """Cria a tabela nova vazia, com a mesma definição de tb_municipios"""
+        cursor.execute("SELECT sql FROM sqlite_master WHERE type = 'table' AND name = 'tb_municipios'")
+        definicao = cursor.fetchone()[0]
+        definicao = re.sub(
+            r'^\s*CREATE\s+TABLE\s+(?:IF\s+NOT\s+EXISTS\s+)?"?tb_municipios"?',
+            f'CREATE TABLE {tabela_nova}', definicao, count=1, flags=re.IGNORECASE
+        )
+        cursor.execute(definicao)
+
+    @staticmethod
+    def _indexar_tabela_nova(cursor: sqlite3.Cursor, tabela_nova: str):
+        """
+        Cria na tabela nova os índices secundários de tb_municipios
+
+        Os índices são criados depois da carga, de uma vez, em vez de
+        atualizados a cada INSERT. Como o nome de um índice é único no banco,
+        cada índice recebe o nome original seguido do identificador da
+        recarga (o da recarga anterior, se houver, é substituído).
+        """
+        sufixo = '__' + tabela_nova.rsplit('_', 1)[1]
+        cursor.execute("""
+            SELECT name, sql FROM sqlite_master
+            WHERE type = 'index' AND tbl_name = 'tb_municipios' AND sql IS NOT NULL
+        """)
+        for nome, definicao in cursor.fetchall():
+            correspondencia = _RE_CRIAR_INDICE.match(definicao)
+            if not correspondencia:
+                logger.warning(f"Índice {nome} não recriado na tabela nova: definição não reconhecida")
+                continue
+            nome_novo = _RE_SUFIXO_INDICE_RECARGA.sub('', nome) + sufixo
+            unico = 'UNIQUE ' if correspondencia.group(1) else ''
+            cursor.execute(
+                f"CREATE {unico}INDEX {nome_novo} ON {tabela_nova} "
+                + definicao[correspondencia.end():]
+            )
+
+    @staticmethod
+    def _trocar_tabela_nova(cursor: sqlite3.Cursor, tabela_nova: str):
+        """Substitui tb_municipios pela tabela nova (com os índices dela)"""
+        cursor.execute("DROP TABLE tb_municipios")
+        cursor.execute(f"ALTER TABLE {tabela_nova} RENAME TO tb_municipios")
+
+    @staticmethod
+    def _apagar_tabela_nova(conn: sqlite3.Connection, tabela_nova: str):
+        """Apaga a tabela nova de uma recarga que falhou (já gravada em transações anteriores)"""
+        try:
+            conn.execute("BEGIN IMMEDIATE")
+            conn.execute(f"DROP TABLE IF EXISTS {tabela_nova}")
+            conn.commit()
+        except sqlite3.Error as e:
+            if conn.in_transaction:
+                conn.rollback()
+            logger.error(f"Não foi possível apagar {tabela_nova} após a falha da recarga: {e}")
+
+    def importar_diferencial(self, conn: sqlite3.Connection, linhas: Iterable[str],
+                             formato: Dict[str, Any],
+                             progresso: Optional[CallbackProgresso] = None) -> Dict[str, Any]:
+        """
+        Aplica em tb_municipios apenas as diferenças em relação ao arquivo
+
+        Os municípios do arquivo são gravados na tabela temporária
+        tb_municipios_staging, fora da transação de escrita do banco. Em
+        seguida, em uma única transação BEGIN IMMEDIATE, são removidos os
+        municípios ausentes do arquivo, atualizados os nomes alterados e
+        incluídos os novos. Municípios sem alteração não são regravados, e a
+        versão dos dados só é incrementada se algo mudou (se ainda não existir,
+        é criada mesmo sem alterações).
+
+        Se a conexão já estiver em uma transação, ela é reaproveitada e o
+        commit fica a cargo de quem chamou. Um arquivo sem nenhum município
+        válido não altera a tabela.
+
+        :param conn: Conexão com o banco de dados
+        :param linhas: Linhas do arquivo
+        :param formato: Informações do formato
+        :param progresso: Função chamada após cada lote com linhas_lidas,
+                          linhas_gravadas, erros e linhas_por_segundo
+        :return: Dicionário com total_linhas, importados, erros, inseridos,
+                 atualizados, removidos e duracao
+        """
+        resultado = {'total_linhas': 0, 'importados': 0, 'erros': 0,
+                     'inseridos': 0, 'atualizados': 0, 'removidos': 0, 'duracao': 0.0}
+        inicio = time.perf_counter()
+        transacao_propria = not conn.in_transaction
+        cursor = conn.cursor()
+        cursor.execute(SQL_CRIAR_TABELA_MUNICIPIOS)
+        cursor.execute(SQL_CRIAR_TABELA_METADADOS)
+        cursor.execute(SQL_CRIAR_TABELA_STAGING)
+
+        try:
+            # Preparação: a tabela temporária não bloqueia o banco principal
+            cursor.execute("DELETE FROM temp.tb_municipios_staging")
+            for lote in self.iterar_lotes(linhas, formato, resultado):
+                cursor.executemany(SQL_INSERIR_STAGING, lote)
+                resultado['importados'] += len(lote)
+                self._publicar_progresso(progresso, resultado, inicio)
+
+            if resultado['importados'] > 0:
+                if transacao_propria:
+                    if conn.in_transaction:
+                        conn.commit()
+                    cursor.execute("BEGIN IMMEDIATE")
+
+                cursor.execute(SQL_DIFERENCA_REMOVER)
+                resultado['removidos'] = cursor.rowcount
+                cursor.execute(SQL_DIFERENCA_ATUALIZAR)
+                resultado['atualizados'] = cursor.rowcount
+                cursor.execute(SQL_DIFERENCA_INSERIR)
+                resultado['inseridos'] = cursor.rowcount
+
+                if resultado['removidos'] or resultado['atualizados'] or resultado['inseridos']:
+                    cursor.execute(SQL_INCREMENTAR_VERSAO)
+                else:
+                    # Sem versão não há ETag nem chave de cache para os dados atuais
+                    cursor.execute(SQL_GARANTIR_VERSAO)
+
+            if transacao_propria and conn.in_transaction:
+                conn.commit()
+
+        except Exception:
+            if transacao_propria and conn.in_transaction:
+                conn.rollback()
+            raise
+
+        finally:
+            # Liberar a memória da preparação (a tabela só existe nesta conexão)
+            cursor.execute("DROP TABLE IF EXISTS temp.tb_municipios_staging")
+
+        resultado['duracao'] = time.perf_counter() - inicio
+        self._publicar_progresso(progresso, resultado, inicio, concluido=True)
+        logger.info(
+            f"Importação diferencial concluída: {resultado['importados']} municípios no arquivo, "
+            f"{resultado['inseridos']} incluídos, {resultado['atualizados']} alterados, "
+            f"{resultado['removidos']} removidos, {resultado['erros']} erros em {resultado['duracao']:.3f}s"
+        )
+        return resultado
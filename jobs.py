@@ -0,0 +1,430 @@
+"""
+jobs.py - Tarefas em segundo plano (exportações e importações longas)
+
+As tarefas rodam em um ThreadPoolExecutor, fora da thread que atende a
+requisição: a rota enfileira o trabalho, devolve o ID da tarefa e o cliente
+consulta /api/jobs/<id> até a conclusão, baixando o arquivo gerado quando
+houver um.
+
+Cada tarefa tem uma linha em tb_jobs com tipo, estado, resultado e arquivo,
+que continua disponível após reinicializações. Com vários processos (workers)
+usando o mesmo banco, cada tarefa registra o processo dono (host:pid), que
+grava periodicamente um batimento na linha enquanto a tarefa não termina.
+Só são marcadas como interrompidas as tarefas do próprio processo deixadas
+por uma execução anterior (mesmo host:pid) e as cujo dono deixou de bater;
+as que outros processos ativos estão executando não são afetadas.
+
+O progresso de uma tarefa é publicado em memória a cada atualização (para
+/api/jobs/<id> e os eventos SSE do próprio processo) e gravado em tb_jobs no
+máximo uma vez por INTERVALO_PROGRESSO, por uma thread própria: a tarefa não
+espera pela escrita no banco, e outro worker que atenda a consulta da tarefa
+lê o progresso e acompanha as mudanças pela linha da tabela.
+"""
+
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, Dict, Optional, Set
+
+from db_pool import obter_pool
+
+logger = logging.getLogger(__name__)
+
+# Estados de uma tarefa
+PENDENTE = 'pendente'
+EXECUTANDO = 'executando'
+CONCLUIDO = 'concluido'
+ERRO = 'erro'
+
+ESTADOS_FINAIS = (CONCLUIDO, ERRO)
+
+SQL_CRIAR_TABELA_JOBS = '''
+    CREATE TABLE IF NOT EXISTS tb_jobs (
+        id TEXT PRIMARY KEY,
+        tipo TEXT NOT NULL,
+        estado TEXT NOT NULL,
+        resultado TEXT,
+        erro TEXT,
+        arquivo TEXT,
+        nome_arquivo TEXT,
+        mimetype TEXT,
+        criado_em REAL NOT NULL,
+        atualizado_em REAL NOT NULL,
+        dono TEXT,
+        batimento REAL,
+        progresso TEXT
+    )
+'''
+
+# Colunas acrescentadas a tb_jobs criadas antes delas existirem
+COLUNAS_ADICIONAIS_JOBS = {
+    'dono': 'TEXT',
+    'batimento': 'REAL',
+    'progresso': 'TEXT',
+}
+
+# Campos de tb_jobs devolvidos por JobManager.obter()
+CAMPOS_JOB = ('id', 'tipo', 'estado', 'resultado', 'erro', 'arquivo', 'nome_arquivo',
+              'mimetype', 'criado_em', 'atualizado_em', 'progresso')
+
+# Intervalo mínimo (segundos) entre as gravações do progresso de uma tarefa em
+# tb_jobs; também é o intervalo de consulta da linha de tarefas de outro processo
+INTERVALO_PROGRESSO = 1.0
+
+# Intervalo (segundos) entre os batimentos das tarefas não concluídas de um processo
+INTERVALO_BATIMENTO = 30.0
+
+# Batimentos perdidos até que as tarefas de um processo sejam dadas como
+# interrompidas (folga para escritas longas que atrasem o batimento)
+BATIMENTOS_PERDIDOS = 10
+
+
+class JobContexto:
+    """Canal entre a função executada e o gerenciador de tarefas"""
+
+    def __init__(self, gerenciador: 'JobManager', job_id: str):
+        self.gerenciador = gerenciador
+        self.job_id = job_id
+
+    def atualizar_progresso(self, **dados):
+        """
+        Publica o progresso atual da tarefa (substitui os valores informados)
+
+        :param dados: Valores de progresso serializáveis em JSON
+        """
+        self.gerenciador._atualizar_progresso(self.job_id, dados)
+
+    def caminho_resultado(self, extensao: str) -> str:
+        """
+        Obtém o caminho onde a tarefa deve gravar seu arquivo de resultado
+
+        :param extensao: Extensão do arquivo (sem ponto)
+        :return: Caminho dentro da pasta de resultados
+        """
+        return os.path.join(self.gerenciador.pasta_resultados, f"{self.job_id}.{extensao}")
+
+    def definir_arquivo(self, caminho: str, nome: str, mimetype: str):
+        """
+        Registra o arquivo gerado pela tarefa para download
+
+        :param caminho: Caminho do arquivo gerado
+        :param nome: Nome sugerido para o download
+        :param mimetype: Tipo do arquivo
+        """
+        self.gerenciador._atualizar(self.job_id, arquivo=caminho, nome_arquivo=nome, mimetype=mimetype)
+
+
+class JobManager:
+    """Enfileira, executa e acompanha tarefas em segundo plano"""
+
+    def __init__(self, db_file: str, pasta_resultados: str = 'resultados',
+                 max_workers: int = 2, validade_horas: float = 24.0,
+                 intervalo_batimento: float = INTERVALO_BATIMENTO):
+        """
+        :param db_file: Caminho do banco de dados SQLite
+        :param pasta_resultados: Pasta dos arquivos gerados pelas tarefas
+        :param max_workers: Quantidade de tarefas executadas ao mesmo tempo
+        :param validade_horas: Tempo que tarefas concluídas (e arquivos) são mantidas
+        :param intervalo_batimento: Intervalo entre os batimentos das tarefas em andamento
+        """
+        self.db_file = db_file
+        self.pasta_resultados = pasta_resultados
+        self.validade_horas = validade_horas
+        self.intervalo_batimento = intervalo_batimento
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+        self._lock = threading.Lock()
+        self._mudanca = threading.Condition(self._lock)
+        self._jobs: Dict[str, Dict[str, Any]] = {}
+        self._progresso: Dict[str, Dict[str, Any]] = {}
+        self._versoes: Dict[str, int] = {}
+        self._progresso_pendente: Set[str] = set()
+        self._encerrado = threading.Event()
+        self._pid_batimento: Optional[int] = None
+
+        os.makedirs(pasta_resultados, exist_ok=True)
+        self._preparar_tabela()
+
+    @property
+    def dono(self) -> str:
+        """Identificação do processo atual (host:pid) gravada nas tarefas que ele executa"""
+        return f"{socket.gethostname()}:{os.getpid()}"
+
+    def _preparar_tabela(self):
+        """Cria tb_jobs e marca como interrompidas as tarefas de processos encerrados"""
+        with obter_pool(self.db_file).escrita() as conn:
+            conn.execute(SQL_CRIAR_TABELA_JOBS)
+            colunas = [row[1] for row in conn.execute("PRAGMA table_info(tb_jobs)")]
+            for coluna, tipo in COLUNAS_ADICIONAIS_JOBS.items():
+                if coluna not in colunas:
+                    conn.execute(f"ALTER TABLE tb_jobs ADD COLUMN {coluna} {tipo}")
+
+            # Recém-iniciado, o processo ainda não tem tarefas: as registradas
+            # com o mesmo host:pid são de uma execução anterior
+            self._interromper_abandonadas(conn, dono_anterior=self.dono)
+
+    def _interromper_abandonadas(self, conn: sqlite3.Connection, dono_anterior: Optional[str] = None):
+        """
+        Marca como interrompidas as tarefas pendentes ou em execução sem dono ativo
+
+        Uma tarefa é dada como abandonada quando o processo dono não grava um
+        batimento há BATIMENTOS_PERDIDOS intervalos (ou quando ela não tem
+        batimento, como as registradas antes da coluna existir).
+
+        :param conn: Conexão em uma transação de escrita
+        :param dono_anterior: Dono cujas tarefas são interrompidas mesmo com batimento recente
+        """
+        agora = time.time()
+        cursor = conn.execute(
+            """
+            UPDATE tb_jobs SET estado = ?, erro = ?, atualizado_em = ?
+            WHERE estado IN (?, ?) AND (batimento IS NULL OR batimento < ? OR dono = ?)
+            """,
+            (ERRO, 'Tarefa interrompida: o processo que a executava foi encerrado', agora,
+             PENDENTE, EXECUTANDO, agora - self.intervalo_batimento * BATIMENTOS_PERDIDOS, dono_anterior)
+        )
+        if cursor.rowcount:
+            logger.warning(f"{cursor.rowcount} tarefas de processos encerrados marcadas como interrompidas")
+
+    def _iniciar_batimento(self):
+        """
+        Inicia a thread de batimento e progresso do processo atual, se ainda não existir
+
+        A verificação é feita pelo pid: um processo criado por fork (worker)
+        não herda a thread do processo que criou o JobManager.
+        """
+        with self._lock:
+            if self._pid_batimento == os.getpid():
+                return
+            self._pid_batimento = os.getpid()
+        threading.Thread(target=self._manter_batimento, name='job-batimento', daemon=True).start()
+
+    def _manter_batimento(self):
+        """
+        Grava o progresso e o batimento das tarefas não concluídas deste processo
+
+        O progresso alterado desde a última gravação é gravado a cada
+        INTERVALO_PROGRESSO; o batimento, a cada intervalo_batimento. Na
+        transação do batimento, as tarefas de processos que deixaram de bater
+        (encerrados sem reiniciar) são marcadas como interrompidas.
+        """
+        ultimo_batimento = time.monotonic()
+        while not self._encerrado.wait(min(INTERVALO_PROGRESSO, self.intervalo_batimento)):
+            bater = time.monotonic() - ultimo_batimento >= self.intervalo_batimento
+            with self._lock:
+                progresso = [(json.dumps(self._progresso[job_id], ensure_ascii=False), job_id)
+                             for job_id in self._progresso_pendente if job_id in self._progresso]
+                self._progresso_pendente.clear()
+                ativas = [job_id for job_id, job in self._jobs.items()
+                          if bater and job['estado'] not in ESTADOS_FINAIS]
+            if not progresso and not ativas:
+                continue
+
+            agora = time.time()
+            try:
+                with obter_pool(self.db_file).escrita() as conn:
+                    conn.executemany("UPDATE tb_jobs SET progresso = ?, atualizado_em = ? WHERE id = ?",
+                                     ((dados, agora, job_id) for dados, job_id in progresso))
+                    if ativas:
+                        conn.executemany("UPDATE tb_jobs SET batimento = ? WHERE id = ?",
+                                         ((agora, job_id) for job_id in ativas))
+                        self._interromper_abandonadas(conn)
+            except sqlite3.Error as e:
+                # O progresso volta a ser gravado na próxima atualização da tarefa
+                logger.error(f"Erro ao gravar o progresso e o batimento das tarefas: {e}")
+            if ativas:
+                ultimo_batimento = time.monotonic()
+
+    def enfileirar(self, tipo: str, funcao: Callable[..., Optional[Dict[str, Any]]],
+                   *args, **kwargs) -> str:
+        """
+        Registra uma tarefa e a coloca na fila de execução
+
+        A função é chamada como funcao(contexto, *args, **kwargs) e pode
+        retornar um dicionário (serializável em JSON) com o resultado.
+
+        :param tipo: Tipo da tarefa (ex: 'exportacao_notas')
+        :param funcao: Função a executar
+        :return: ID da tarefa
+        """
+        self.remover_expirados()
+
+        agora = time.time()
+        job = {campo: None for campo in CAMPOS_JOB}
+        job.update(id=uuid.uuid4().hex, tipo=tipo, estado=PENDENTE, criado_em=agora, atualizado_em=agora)
+
+        with self._lock:
+            self._jobs[job['id']] = job
+        with obter_pool(self.db_file).escrita() as conn:
+            conn.execute(
+                """
+                INSERT INTO tb_jobs (id, tipo, estado, criado_em, atualizado_em, dono, batimento)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+                """,
+                (job['id'], tipo, PENDENTE, agora, agora, self.dono, agora)
+            )
+
+        self._iniciar_batimento()
+        self._executor.submit(self._executar, job['id'], funcao, args, kwargs)
+        logger.info(f"Tarefa {job['id']} ({tipo}) enfileirada")
+        return job['id']
+
+    def _executar(self, job_id: str, funcao: Callable, args, kwargs):
+        """Executa a tarefa na thread do executor e registra o desfecho"""
+        self._atualizar(job_id, estado=EXECUTANDO)
+        try:
+            resultado = funcao(JobContexto(self, job_id), *args, **kwargs)
+            self._atualizar(job_id, estado=CONCLUIDO, resultado=resultado, progresso=self._progresso_atual(job_id))
+            logger.info(f"Tarefa {job_id} concluída")
+        except Exception as e:
+            logger.exception(f"Erro na tarefa {job_id}: {e}")
+            self._atualizar(job_id, estado=ERRO, erro=str(e), progresso=self._progresso_atual(job_id))
+
+    def _progresso_atual(self, job_id: str) -> Dict[str, Any]:
+        """Cópia do último progresso publicado pela tarefa (gravado junto com o desfecho)"""
+        with self._lock:
+            self._progresso_pendente.discard(job_id)
+            return dict(self._progresso.get(job_id, {}))
+
+    def _atualizar(self, job_id: str, **campos):
+        """Atualiza os campos de uma tarefa em memória e em tb_jobs"""
+        campos['atualizado_em'] = time.time()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job.update(campos)
+                self._notificar(job_id)
+
+        for campo in ('resultado', 'progresso'):
+            if campo in campos:
+                campos[campo] = json.dumps(campos[campo], ensure_ascii=False)
+        atribuicoes = ', '.join(f"{campo} = ?" for campo in campos)
+        try:
+            with obter_pool(self.db_file).escrita() as conn:
+                conn.execute(f"UPDATE tb_jobs SET {atribuicoes} WHERE id = ?", (*campos.values(), job_id))
+        except sqlite3.Error as e:
+            # O estado em memória continua valendo enquanto o processo estiver ativo
+            logger.error(f"Erro ao gravar estado da tarefa {job_id}: {e}")
+
+    def _atualizar_progresso(self, job_id: str, dados: Dict[str, Any]):
+        """Guarda o progresso de uma tarefa em execução (gravado em tb_jobs pela thread de batimento)"""
+        with self._lock:
+            self._progresso.setdefault(job_id, {}).update(dados)
+            self._progresso_pendente.add(job_id)
+            self._notificar(job_id)
+
+    def _notificar(self, job_id: str):
+        """Avisa quem aguarda mudanças da tarefa (chamar com o lock adquirido)"""
+        self._versoes[job_id] = self._versoes.get(job_id, 0) + 1
+        self._mudanca.notify_all()
+
+    def aguardar_mudanca(self, job_id: str, versao: float, timeout: float = 15.0) -> float:
+        """
+        Aguarda até que o estado ou o progresso da tarefa mude
+
+        Tarefas deste processo são acompanhadas em memória. As de outro
+        processo são acompanhadas pela linha de tb_jobs, consultada a cada
+        INTERVALO_PROGRESSO; a versão é então o atualizado_em da linha.
+
+        :param job_id: ID da tarefa
+        :param versao: Última versão conhecida (use -1 na primeira chamada)
+        :param timeout: Tempo máximo de espera, em segundos
+        :return: Versão atual (igual à informada se nada mudou no prazo)
+        """
+        with self._mudanca:
+            if job_id in self._jobs:
+                self._mudanca.wait_for(lambda: self._versoes.get(job_id, 0) != versao, timeout)
+                return self._versoes.get(job_id, 0)
+
+        limite = time.monotonic() + timeout
+        while True:
+            atual = self._versao_gravada(job_id)
+            restante = limite - time.monotonic()
+            if atual != versao or restante <= 0:
+                return atual
+            time.sleep(min(INTERVALO_PROGRESSO, restante))
+
+    def _versao_gravada(self, job_id: str) -> float:
+        """Versão de uma tarefa em tb_jobs (atualizado_em da linha, ou 0 se ela não existir)"""
+        conn = obter_pool(self.db_file).get()
+        try:
+            row = conn.execute("SELECT atualizado_em FROM tb_jobs WHERE id = ?", (job_id,)).fetchone()
+        finally:
+            conn.close()
+        return row[0] if row is not None else 0
+
+    def obter(self, job_id: str) -> Optional[Dict[str, Any]]:
+        """
+        Obtém o estado de uma tarefa
+
+        :param job_id: ID da tarefa
+        :return: Dicionário com os campos de tb_jobs e o progresso, ou None
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None:
+                job = dict(job)
+                job['progresso'] = dict(self._progresso.get(job_id, {}))
+                return job
+
+        conn = obter_pool(self.db_file).get()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(f"SELECT {', '.join(CAMPOS_JOB)} FROM tb_jobs WHERE id = ?", (job_id,))
+            row = cursor.fetchone()
+        finally:
+            conn.close()
+
+        if row is None:
+            return None
+        job = dict(zip(CAMPOS_JOB, row))
+        job['resultado'] = json.loads(job['resultado']) if job['resultado'] else None
+        job['progresso'] = json.loads(job['progresso']) if job['progresso'] else {}
+        return job
+
+    def remover_expirados(self):
+        """Remove tarefas concluídas há mais de validade_horas e seus arquivos"""
+        limite = time.time() - self.validade_horas * 3600
+        conn = obter_pool(self.db_file).get()
+        try:
+            cursor = conn.cursor()
+            cursor.execute(
+                "SELECT id, arquivo FROM tb_jobs WHERE estado IN (?, ?) AND atualizado_em < ?",
+                (*ESTADOS_FINAIS, limite)
+            )
+            expirados = cursor.fetchall()
+        finally:
+            conn.close()
+
+        if not expirados:
+            return
+
+        for job_id, arquivo in expirados:
+            if arquivo and os.path.exists(arquivo):
+                try:
+                    os.remove(arquivo)
+                except OSError as e:
+                    logger.warning(f"Não foi possível remover {arquivo}: {e}")
+            with self._lock:
+                self._jobs.pop(job_id, None)
+                self._progresso.pop(job_id, None)
+                self._progresso_pendente.discard(job_id)
+                self._versoes.pop(job_id, None)
+
+        with obter_pool(self.db_file).escrita() as conn:
+            conn.executemany("DELETE FROM tb_jobs WHERE id = ?", ((job_id,) for job_id, _ in expirados))
+        logger.info(f"{len(expirados)} tarefas expiradas removidas")
+
+    def encerrar(self, aguardar: bool = True):
+        """
+        Encerra o executor de tarefas
+
+        :param aguardar: Se deve aguardar as tarefas em andamento
+        """
+        self._executor.shutdown(wait=aguardar)
+        self._encerrado.set()
@@ -0,0 +1,113 @@
+"""
+municipios_consulta.py - Resolução das consultas de municípios por UF
+
+O banco pode ter os municípios em tb_municipios, em tb_cod_municipio ou em
+outra tabela com 'munic' no nome. Descobrir qual tabela e quais colunas usar
+exige ler sqlite_master e PRAGMA table_info, o que não deve acontecer a cada
+requisição: o resultado é guardado como uma lista de consultas prontas e só é
+recalculado quando o PRAGMA schema_version do banco muda.
+"""
+
+import logging
+import sqlite3
+import threading
+from typing import List, Optional, Sequence, Tuple
+
+from import_engine import TABELA_MUNICIPIOS_NOVA
+
+logger = logging.getLogger(__name__)
+
+
+class PlanoConsultaMunicipios:
+    """Consultas de municípios por UF resolvidas para o schema atual do banco"""
+
+    def __init__(self, termos_codigo: Sequence[str] = ('cod',)):
+        """
+        :param termos_codigo: Trechos que identificam a coluna de código nas
+                              tabelas detectadas automaticamente
+        """
+        self.termos_codigo = tuple(termos_codigo)
+        self._schema_version: Optional[int] = None
+        self._consultas: Tuple[Tuple[str, str], ...] = ()
+        self._lock = threading.Lock()
+
+    def consultas(self, cursor: sqlite3.Cursor) -> Tuple[Tuple[str, str], ...]:
+        """
+        Obtém as consultas na ordem em que devem ser tentadas
+
+        Cada consulta recebe a UF como único parâmetro e retorna tuplas
+        (nome_municipio, cod_municipio) ordenadas pelo nome.
+
+        :param cursor: Cursor do banco de dados
+        :return: Tupla de (tabela, consulta SQL)
+        """
+        cursor.execute("PRAGMA schema_version")
+        schema_version = cursor.fetchone()[0]
+        if schema_version == self._schema_version:
+            return self._consultas
+
+        with self._lock:
+            if schema_version != self._schema_version:
+                self._consultas = tuple(self._resolver(cursor))
+                self._schema_version = schema_version
+                logger.info(
+                    f"Consultas de municípios resolvidas (schema_version={schema_version}): "
+                    f"{', '.join(tabela for tabela, _ in self._consultas) or 'nenhuma tabela'}"
+                )
+            return self._consultas
+
+    def _resolver(self, cursor: sqlite3.Cursor) -> List[Tuple[str, str]]:
+        """Lê o schema e monta as consultas de cada estratégia"""
+        cursor.execute("SELECT name FROM sqlite_master WHERE type='table'")
+        tabelas = [row[0] for row in cursor.fetchall()]
+        consultas = []
+
+        # Estratégia 1: tabela tb_municipios (padrão mais recente)
+        if 'tb_municipios' in tabelas:
+            consultas.append(('tb_municipios', """
+                SELECT nome_municipio, cod_municipio
+                FROM tb_municipios
+                WHERE uf = ?
+                ORDER BY nome_municipio
+            """))
+
+        # Estratégia 2: tabela tb_cod_municipio (estrutura alternativa)
+        if 'tb_cod_municipio' in tabelas:
+            consultas.append(('tb_cod_municipio', """
+                SELECT municipio, cod_municipio
+                FROM tb_cod_municipio
+                WHERE UF = ?
+                ORDER BY municipio
+            """))
+
+        # Estratégia 3: qualquer outra tabela com 'munic' no nome (exceto as
+        # tabelas em montagem de recargas de tb_municipios)
+        for tabela in tabelas:
+            if 'munic' not in tabela.lower() or tabela in ['tb_municipios', 'tb_cod_municipio']:
+                continue
+            if tabela.startswith(TABELA_MUNICIPIOS_NOVA):
+                continue
+
+            try:
+                cursor.execute(f"PRAGMA table_info({tabela})")
+                colunas = [row[1] for row in cursor.fetchall()]
+            except sqlite3.Error as e:
+                logger.error(f"Erro ao analisar tabela {tabela}: {e}")
+                continue
+
+            # Tentar identificar as colunas relevantes
+            col_uf = next((col for col in colunas if col.lower() == 'uf'), None)
+            col_nome = next((col for col in colunas
+                             if 'nome' in col.lower() or 'munic' in col.lower()), None)
+            col_codigo = next((col for col in colunas
+                               if any(termo in col.lower() for termo in self.termos_codigo)), None)
+
+            if col_uf and col_nome and col_codigo:
+                consultas.append((tabela, f"""
+                    SELECT {col_nome}, {col_codigo}
+                    FROM {tabela}
+                    WHERE {col_uf} = ?
+                    ORDER BY {col_nome}
+                """))
+
+        return consultas
@@ -0,0 +1,82 @@
+"""
+municipios_index.py - Índice de municípios em memória
+
+Os municípios só mudam quando um arquivo é importado. Por isso, as consultas
+das APIs de UF/município são atendidas por um índice imutável carregado uma
+vez do banco e substituído por inteiro (troca atômica de referência) após
+cada importação.
+"""
+
+import sqlite3
+from typing import Dict, Iterable, Optional, Tuple
+
+
+class MunicipioIndex:
+    """
+    Índice imutável de municípios
+
+    Guarda, por UF, uma tupla de (nome_municipio, cod_municipio) ordenada por
+    nome e, por código, a tupla (nome_municipio, uf, cod_municipio), nos
+    mesmos formatos devolvidos pelas consultas SQL que substitui.
+    """
+
+    __slots__ = ('versao', '_por_uf', '_por_codigo', '_ufs')
+
+    def __init__(self, registros: Iterable[Tuple[str, str, str]], versao: Optional[str] = None):
+        """
+        :param registros: Tuplas (uf, cod_municipio, nome_municipio)
+        :param versao: Versão dos dados de municípios usada na carga
+        """
+        por_uf: Dict[str, list] = {}
+        por_codigo: Dict[str, Tuple[str, str, str]] = {}
+
+        for uf, cod_municipio, nome_municipio in registros:
+            por_uf.setdefault(uf, []).append((nome_municipio, cod_municipio))
+            por_codigo.setdefault(cod_municipio, (nome_municipio, uf, cod_municipio))
+
+        self.versao = versao
+        self._por_uf = {uf: tuple(sorted(municipios)) for uf, municipios in por_uf.items()}
+        self._por_codigo = por_codigo
+        self._ufs = tuple(sorted(por_uf))
+
+    @classmethod
+    def carregar(cls, conn: sqlite3.Connection, versao: Optional[str] = None) -> 'MunicipioIndex':
+        """
+        Carrega o índice a partir da tabela tb_municipios
+
+        :param conn: Conexão com o banco de dados
+        :param versao: Versão dos dados de municípios lida antes da carga
+        :return: Novo índice
+        """
+        cursor = conn.cursor()
+        cursor.execute("""
+            SELECT uf, cod_municipio, nome_municipio
+            FROM tb_municipios
+            ORDER BY uf, nome_municipio
+        """)
+        return cls(cursor.fetchall(), versao)
+
+    def __len__(self) -> int:
+        return len(self._por_codigo)
+
+    def ufs(self) -> Tuple[str, ...]:
+        """Retorna as UFs presentes no índice, em ordem alfabética"""
+        return self._ufs
+
+    def municipios_por_uf(self, uf: str) -> Tuple[Tuple[str, str], ...]:
+        """
+        Obtém os municípios de uma UF ordenados por nome
+
+        :param uf: Sigla da UF (ex: GO, SP, RJ)
+        :return: Tupla de (nome_municipio, cod_municipio)
+        """
+        return self._por_uf.get(uf.upper(), ())
+
+    def municipio_por_codigo(self, codigo: str) -> Optional[Tuple[str, str, str]]:
+        """
+        Obtém um município pelo código
+
+        :param codigo: Código do município
+        :return: Tupla (nome_municipio, uf, cod_municipio) ou None
+        """
+        return self._por_codigo.get(codigo)
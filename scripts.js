@@ -425,6 +425,28 @@ function configurarFormularioImportacao(form) {
             body: formData
         })
         .then(response => response.json())
+        .then(data => {
+            // A importação roda em segundo plano: acompanhar a tarefa até o fim
+            if (data.job_id) {
+                let linhaProgresso = null;
+                if (statusArea) {
+                    linhaProgresso = document.createElement('p');
+                    linhaProgresso.textContent = 'Importação em andamento...';
+                    statusArea.appendChild(linhaProgresso);
+                }
+                return acompanharTarefa(data.status_url, job => {
+                    if (linhaProgresso) {
+                        linhaProgresso.textContent = descreverProgressoImportacao(job.progresso);
+                    }
+                }).then(job => {
+                    if (job.estado === 'concluido') {
+                        return job.resultado;
+                    }
+                    return {status: 'error', message: job.erro || 'Falha na importação'};
+                });
+            }
+            return data;
+        })
         .then(data => {
             if (btnEnviar) {
                 btnEnviar.disabled = false;
@@ -462,6 +484,80 @@ function configurarFormularioImportacao(form) {
     });
 }
 
+/**
+ * Acompanha uma tarefa em segundo plano até que ela termine
+ *
+ * Usa os eventos de /api/jobs/<id>/eventos (server-sent events) quando o
+ * navegador oferece suporte e, se a conexão falhar, consulta /api/jobs/<id>
+ * periodicamente.
+ * @param {string} statusUrl - URL de /api/jobs/<id>
+ * @param {function} [aoAtualizar] - Chamada a cada atualização com o estado da tarefa
+ * @param {number} [intervalo] - Intervalo entre consultas, em milissegundos
+ * @return {Promise<Object>} - Estado final da tarefa (concluido ou erro)
+ */
+function acompanharTarefa(statusUrl, aoAtualizar, intervalo = 1000) {
+    return new Promise((resolve, reject) => {
+        let finalizado = false;
+
+        function atualizar(job) {
+            if (aoAtualizar) {
+                aoAtualizar(job);
+            }
+            if (job.estado === 'concluido' || job.estado === 'erro') {
+                finalizado = true;
+                resolve(job);
+            }
+        }
+
+        if (window.EventSource) {
+            const eventos = new EventSource(`${statusUrl}/eventos`);
+            eventos.onmessage = event => {
+                atualizar(JSON.parse(event.data));
+                if (finalizado) {
+                    eventos.close();
+                }
+            };
+            eventos.onerror = () => {
+                eventos.close();
+                if (!finalizado) {
+                    consultar();
+                }
+            };
+            return;
+        }
+        consultar();
+
+        function consultar() {
+            fetch(statusUrl)
+                .then(response => response.json())
+                .then(job => {
+                    if (job.status === 'error') {
+                        reject(new Error(job.message));
+                        return;
+                    }
+                    atualizar(job);
+                    if (!finalizado) {
+                        setTimeout(consultar, intervalo);
+                    }
+                })
+                .catch(reject);
+        }
+    });
+}
+
+/**
+ * Descreve o progresso de uma importação de municípios
+ * @param {Object} progresso - Progresso publicado pela tarefa
+ * @return {string} - Texto para a área de status
+ */
+function descreverProgressoImportacao(progresso) {
+    if (!progresso || progresso.linhas_lidas === undefined) {
+        return 'Importação em andamento...';
+    }
+    return `${progresso.linhas_lidas} linhas lidas, ${progresso.linhas_gravadas} gravadas, ` +
+        `${progresso.erros} erros (${Math.round(progresso.linhas_por_segundo)} linhas/s)`;
+}
+
 /**
  * Valida um CNPJ
  * @param {string} cnpj - CNPJ a ser validado (com ou sem formatação)
@@ -6,14 +6,146 @@ Este módulo adiciona funcionalidade de geração SQL ao seu sistema Flask exist
 """
 
 import os
-import tempfile
 import sqlite3
 import logging
+import threading
+from collections import OrderedDict
 from datetime import datetime
-from flask import render_template, request, redirect, jsonify, send_file, url_for
+from db_pool import obter_pool
+from sql_dialetos import (LINHAS_POR_INSERT, comandos_insert, criar_tabela, inicio_transacao,
+                          validar_dialeto, validar_linhas_por_insert)
+from flask import Response, render_template, request, redirect, jsonify, stream_with_context, url_for
 
 logger = logging.getLogger(__name__)
 
+# Quantidade de municípios lidos do banco (e enviados) por pedaço do script
+TAMANHO_LOTE_SQL = 1000
+
+# Limites padrão do cache de scripts gerados (SQL_CACHE_MAX_CHARS / SQL_CACHE_MAX_ITENS)
+CACHE_MAX_CHARS = 64 * 1024 * 1024
+CACHE_MAX_ITENS = 32
+
+COLUNAS_MUNICIPIOS = ['uf', 'cod_municipio', 'nome_municipio']
+
+
+class CacheScripts:
+    """
+    Cache LRU dos scripts SQL gerados, limitado por tamanho total e quantidade
+
+    A chave inclui a versão dos dados de municípios (municipios_versao), então
+    uma importação torna as entradas antigas inalcançáveis; elas saem do cache
+    à medida que novas entradas são incluídas.
+    """
+
+    def __init__(self, max_chars=CACHE_MAX_CHARS, max_itens=CACHE_MAX_ITENS):
+        """
+        :param max_chars: Soma máxima do tamanho dos scripts guardados (caracteres)
+        :param max_itens: Quantidade máxima de scripts guardados
+        """
+        self.max_chars = max_chars
+        self.max_itens = max_itens
+        self._itens = OrderedDict()
+        self._tamanho = 0
+        self._lock = threading.Lock()
+
+    def obter(self, chave):
+        """
+        Obtém um script do cache, marcando-o como usado recentemente
+
+        :param chave: Chave gerada por chave_cache_sql()
+        :return: Script SQL ou None se não estiver no cache
+        """
+        with self._lock:
+            script = self._itens.get(chave)
+            if script is not None:
+                self._itens.move_to_end(chave)
+            return script
+
+    def guardar(self, chave, script):
+        """
+        Guarda um script, descartando os menos usados se os limites forem excedidos
+
+        Scripts maiores que o limite total não são guardados.
+
+        :param chave: Chave gerada por chave_cache_sql()
+        :param script: Script SQL gerado
+        """
+        if len(script) > self.max_chars:
+            return
+        with self._lock:
+            anterior = self._itens.pop(chave, None)
+            if anterior is not None:
+                self._tamanho -= len(anterior)
+            self._itens[chave] = script
+            self._tamanho += len(script)
+            while self._tamanho > self.max_chars or len(self._itens) > self.max_itens:
+                _, removido = self._itens.popitem(last=False)
+                self._tamanho -= len(removido)
+
+    def limpar(self):
+        """Remove todos os scripts do cache"""
+        with self._lock:
+            self._itens.clear()
+            self._tamanho = 0
+
+    def __len__(self):
+        return len(self._itens)
+
+
+def normalizar_parametros_sql(ufs, selected_columns, include_create_table, limit, search):
+    """
+    Normaliza os parâmetros de geração do script
+
+    Os mesmos valores são usados na chave do cache e na geração, então
+    parâmetros que produzem o mesmo script (UFs repetidas ou em outra ordem,
+    busca com outra caixa, colunas inválidas, limite vazio) geram a mesma
+    chave e o script guardado corresponde sempre a ela.
+
+    :return: Dicionário com ufs, selected_columns, include_create_table, limit e search
+    """
+    if not isinstance(ufs, list):
+        ufs = [ufs] if ufs else []
+    try:
+        limit = max(int(limit or 0), 0)
+    except (TypeError, ValueError):
+        limit = 0
+    return {
+        'ufs': sorted(set(ufs)),
+        'selected_columns': [col for col in (selected_columns or COLUNAS_MUNICIPIOS) if col in COLUNAS_MUNICIPIOS],
+        'include_create_table': bool(include_create_table),
+        'limit': limit,
+        # A busca é feita em maiúsculas (nome_municipio LIKE '%BUSCA%')
+        'search': (search or '').upper(),
+    }
+
+
+def chave_cache_sql(versao, parametros, dialect, rows_per_insert):
+    """
+    Monta a chave de cache de um script
+
+    :param versao: Versão dos dados de municípios (DatabaseManager.get_versao_municipios)
+    :param parametros: Parâmetros de normalizar_parametros_sql()
+    :param dialect: Dialeto validado
+    :param rows_per_insert: Linhas por INSERT validadas
+    :return: Tupla imutável usada como chave
+    """
+    return (versao, tuple(parametros['ufs']), tuple(parametros['selected_columns']),
+            parametros['include_create_table'], parametros['limit'], parametros['search'],
+            dialect, rows_per_insert)
+
+
+def _anotar_script_em_cache(script):
+    """
+    Indica no cabeçalho que o script veio do cache
+
+    A linha "Gerado em" continua com a data da geração original; os dados
+    não mudaram desde então, já que a chave inclui a versão dos municípios.
+    """
+    primeira_linha, _, resto = script.partition('\n')
+    agora = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
+    return f"{primeira_linha}\n-- Reaproveitado do cache em: {agora} (dados inalterados desde a geração)\n{resto}"
+
+
 def setup_sql_generator(app, db_manager):
     """
     Adiciona as rotas do SQL Generator à aplicação Flask existente
@@ -21,6 +153,13 @@ def setup_sql_generator(app, db_manager):
     :param app: Aplicação Flask
     :param db_manager: Instância do DatabaseManager
     """
+    # Scripts já gerados, por parâmetros e versão dos dados
+    cache = CacheScripts(
+        max_chars=app.config.get('SQL_CACHE_MAX_CHARS', CACHE_MAX_CHARS),
+        max_itens=app.config.get('SQL_CACHE_MAX_ITENS', CACHE_MAX_ITENS)
+    )
+    app.extensions['sql_generator_cache'] = cache
+
     # Rota principal do gerador SQL
     @app.route('/sql-generator')
     def sql_generator_home():
@@ -41,31 +180,49 @@ def setup_sql_generator(app, db_manager):
             include_create_table = data.get('include_create_table', True)
             limit = data.get('limit', 0)  # 0 = sem limite
             search = data.get('search', '')  # Filtro por texto
+            dialect = data.get('dialect', 'sqlite')  # sqlite, postgresql ou mysql
+            rows_per_insert = data.get('rows_per_insert', LINHAS_POR_INSERT)  # Linhas por INSERT
             
             # Validar parâmetros
-            if not isinstance(ufs, list):
-                ufs = [ufs] if ufs else []
+            parametros = normalizar_parametros_sql(ufs, selected_columns, include_create_table, limit, search)
+            try:
+                dialect = validar_dialeto(dialect)
+                rows_per_insert = validar_linhas_por_insert(rows_per_insert)
+            except ValueError as e:
+                return jsonify({'status': 'error', 'message': str(e)}), 400
             
-            # Conectar ao banco e gerar SQL
-            sql_commands = generate_sql_commands(
-                db_path=db_manager.db_file,
-                ufs=ufs,
-                selected_columns=selected_columns,
-                include_create_table=include_create_table,
-                limit=limit,
-                search=search
-            )
+            # Reaproveitar o script se os dados não mudaram desde a última geração
+            chave = chave_cache_sql(db_manager.get_versao_municipios(), parametros, dialect, rows_per_insert)
+            sql_commands = cache.obter(chave)
+            
+            if sql_commands is None:
+                # Conectar ao banco e gerar SQL
+                erros = []
+                sql_commands = generate_sql_commands(
+                    db_path=db_manager.db_file,
+                    dialect=dialect,
+                    rows_per_insert=rows_per_insert,
+                    erros=erros,
+                    **parametros
+                )
+                # Scripts com erro (em qualquer ponto da geração) não são guardados
+                if not erros:
+                    cache.guardar(chave, sql_commands)
+            else:
+                sql_commands = _anotar_script_em_cache(sql_commands)
             
             # Retornar SQL gerado
             return jsonify({
                 'status': 'success',
                 'sql': sql_commands,
                 'params': {
-                    'ufs': ufs,
-                    'columns': selected_columns,
-                    'include_create_table': include_create_table,
-                    'limit': limit,
-                    'search': search
+                    'ufs': parametros['ufs'],
+                    'columns': parametros['selected_columns'],
+                    'include_create_table': parametros['include_create_table'],
+                    'limit': parametros['limit'],
+                    'search': parametros['search'],
+                    'dialect': dialect,
+                    'rows_per_insert': rows_per_insert
                 }
             })
         
@@ -82,39 +239,44 @@ def setup_sql_generator(app, db_manager):
         """Download do script SQL gerado"""
         try:
             # Obter parâmetros
-            ufs = request.form.getlist('ufs')
-            columns = request.form.getlist('columns')
-            include_create_table = request.form.get('include_create_table', 'on') == 'on'
-            limit = int(request.form.get('limit', '0'))
-            search = request.form.get('search', '')
-            
-            # Gerar SQL
-            sql_commands = generate_sql_commands(
-                db_path=db_manager.db_file,
-                ufs=ufs,
-                selected_columns=columns,
-                include_create_table=include_create_table,
-                limit=limit,
-                search=search
+            parametros = normalizar_parametros_sql(
+                request.form.getlist('ufs'),
+                request.form.getlist('columns'),
+                request.form.get('include_create_table', 'on') == 'on',
+                request.form.get('limit', '0'),
+                request.form.get('search', '')
             )
+            ufs = parametros['ufs']
+            dialect = validar_dialeto(request.form.get('dialect', 'sqlite'))
+            rows_per_insert = validar_linhas_por_insert(request.form.get('rows_per_insert'))
             
-            # Criar arquivo temporário
-            temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.sql')
-            temp_file.write(sql_commands.encode('utf-8'))
-            temp_file.close()
+            # Script já gerado pela API com os mesmos parâmetros, ou gerado em
+            # pedaços enviados à medida que são produzidos
+            script = cache.obter(chave_cache_sql(
+                db_manager.get_versao_municipios(), parametros, dialect, rows_per_insert
+            ))
+            if script is not None:
+                sql_commands = [_anotar_script_em_cache(script)]
+            else:
+                sql_commands = stream_with_context(iterar_sql_commands(
+                    db_path=db_manager.db_file,
+                    dialect=dialect,
+                    rows_per_insert=rows_per_insert,
+                    **parametros
+                ))
             
-            # Preparar nome do arquivo de saída
+            # Preparar nome do arquivo de saída (com o dialeto, se não for SQLite)
+            sufixo = '' if dialect == 'sqlite' else f"_{dialect}"
             if len(ufs) == 1:
-                filename = f"municipios_{ufs[0]}.sql"
+                filename = f"municipios_{ufs[0]}{sufixo}.sql"
             else:
-                filename = f"municipios_{len(ufs)}_ufs_{datetime.now().strftime('%Y%m%d')}.sql"
+                filename = f"municipios_{len(ufs)}_ufs_{datetime.now().strftime('%Y%m%d')}{sufixo}.sql"
             
-            # Enviar arquivo para download
-            return send_file(
-                temp_file.name,
-                as_attachment=True,
-                download_name=filename,
-                mimetype='text/plain'
+            # Enviar o script diretamente na resposta, sem arquivo temporário
+            return Response(
+                sql_commands,
+                mimetype='text/plain',
+                headers={'Content-Disposition': f'attachment; filename="{filename}"'}
             )
         
         except Exception as e:
@@ -126,7 +288,7 @@ def setup_sql_generator(app, db_manager):
     def get_municipios_count():
         """Obtém a contagem de municípios por UF"""
         try:
-            conn = sqlite3.connect(db_manager.db_file)
+            conn = db_manager.create_connection()
             cursor = conn.cursor()
             
             # Contar municípios por UF
@@ -158,124 +320,165 @@ def setup_sql_generator(app, db_manager):
             if 'conn' in locals() and conn:
                 conn.close()
 
-def generate_sql_commands(db_path, ufs=None, selected_columns=None, include_create_table=True, limit=0, search=''):
+def _montar_consulta(ufs, selected_columns, limit, search):
     """
-    Gera comandos SQL INSERT OR REPLACE para municípios
-    
+    Monta a consulta dos municípios a exportar
+
+    :return: Tupla (consulta SQL, parâmetros)
+    """
+    query = f"SELECT {', '.join(selected_columns)} FROM tb_municipios"
+    params = []
+
+    # Aplicar filtros
+    conditions = []
+
+    if ufs and isinstance(ufs, list) and len(ufs) > 0:
+        placeholders = ', '.join(['?' for _ in ufs])
+        conditions.append(f"uf IN ({placeholders})")
+        params.extend(ufs)
+
+    if search:
+        conditions.append("nome_municipio LIKE ?")
+        params.append(f"%{search.upper()}%")
+
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+
+    # Ordenação
+    query += " ORDER BY uf, nome_municipio"
+
+    # Limite de registros
+    if limit > 0:
+        query += " LIMIT ?"
+        params.append(limit)
+
+    return query, params
+
+
+def iterar_sql_commands(db_path, ufs=None, selected_columns=None, include_create_table=True,
+                        limit=0, search='', batch_size=TAMANHO_LOTE_SQL, dialect='sqlite',
+                        rows_per_insert=LINHAS_POR_INSERT, erros=None):
+    """
+    Gera o script SQL em pedaços, lendo os municípios do cursor em lotes
+
+    O cabeçalho (total e contagem por UF) vem de uma consulta de agregação
+    feita no mesmo snapshot de leitura, de modo que nenhuma linha precisa ser
+    mantida em memória; cada pedaço corresponde a um lote de fetchmany.
+    Um erro é escrito no script como comentário "-- Erro" (possivelmente
+    depois do cabeçalho e de parte dos INSERTs) e registrado em `erros`.
+
     :param db_path: Caminho do banco de dados SQLite
     :param ufs: Lista de UFs para filtrar (None = todas)
     :param selected_columns: Lista de colunas a incluir (None = todas)
     :param include_create_table: Se deve incluir o comando CREATE TABLE
     :param limit: Número máximo de registros (0 = sem limite)
     :param search: Filtro de texto para nome do município
-    :return: String com comandos SQL
+    :param batch_size: Quantidade de municípios por pedaço
+    :param dialect: Banco de destino do script (sqlite, postgresql ou mysql)
+    :param rows_per_insert: Quantidade de municípios por comando INSERT
+    :param erros: Lista opcional que recebe as mensagens de erro da geração
+    :return: Gerador de trechos do script SQL
     """
+    dialect = validar_dialeto(dialect)
+    rows_per_insert = validar_linhas_por_insert(rows_per_insert)
+    # Cada pedaço contém um número inteiro de comandos INSERT
+    batch_size = -(-max(batch_size, rows_per_insert) // rows_per_insert) * rows_per_insert
+
     # Definir colunas padrão se não especificadas
-    all_columns = ['uf', 'cod_municipio', 'nome_municipio']
+    all_columns = COLUNAS_MUNICIPIOS
     if not selected_columns:
         selected_columns = all_columns
-    
+
     # Validar que colunas solicitadas existem
     selected_columns = [col for col in selected_columns if col in all_columns]
-    
+
     if not selected_columns:
-        return "-- Erro: Nenhuma coluna válida selecionada para gerar SQL"
-    
-    # Conectar ao banco
-    conn = sqlite3.connect(db_path)
-    conn.row_factory = sqlite3.Row  # Para acessar colunas pelo nome
-    
+        mensagem = "Nenhuma coluna válida selecionada para gerar SQL"
+        if erros is not None:
+            erros.append(mensagem)
+        yield f"-- Erro: {mensagem}"
+        return
+
+    # Conexão do pool compartilhado com o DatabaseManager
+    conn = obter_pool(db_path).get()
+    transacao_propria = not conn.in_transaction
+
     try:
         cursor = conn.cursor()
-        
-        # Construir a consulta SQL para buscar os municípios
-        query = f"SELECT {', '.join(selected_columns)} FROM tb_municipios"
-        params = []
-        
-        # Aplicar filtros
-        conditions = []
-        
-        if ufs and isinstance(ufs, list) and len(ufs) > 0:
-            placeholders = ', '.join(['?' for _ in ufs])
-            conditions.append(f"uf IN ({placeholders})")
-            params.extend(ufs)
-        
-        if search:
-            conditions.append("nome_municipio LIKE ?")
-            params.append(f"%{search.upper()}%")
-        
-        if conditions:
-            query += " WHERE " + " AND ".join(conditions)
-        
-        # Ordenação
-        query += " ORDER BY uf, nome_municipio"
-        
-        # Limite de registros
-        if limit > 0:
-            query += " LIMIT ?"
-            params.append(limit)
-        
-        # Executar consulta
-        cursor.execute(query, params)
-        municipios = cursor.fetchall()
-        
-        # Contar municípios por UF para o cabeçalho
-        uf_counts = {}
-        for municipio in municipios:
-            if 'uf' in municipio.keys():
-                uf = municipio['uf']
-                uf_counts[uf] = uf_counts.get(uf, 0) + 1
-        
-        # Iniciar a construção do script SQL
-        sql = "-- Script SQL para importação de municípios brasileiros\n"
-        sql += f"-- Gerado em: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\n"
-        sql += f"-- Total de municípios: {len(municipios)}\n"
-        
+        query, params = _montar_consulta(ufs, selected_columns, limit, search)
+
+        # Contagem e linhas no mesmo snapshot
+        if transacao_propria:
+            cursor.execute("BEGIN")
+        cursor.execute(f"SELECT uf, COUNT(*) FROM ({query.replace('SELECT ', 'SELECT uf, ', 1)}) GROUP BY uf", params)
+        uf_counts = dict(cursor.fetchall())
+        total = sum(uf_counts.values())
+
+        # Cabeçalho do script
+        cabecalho = [
+            "-- Script SQL para importação de municípios brasileiros\n",
+            f"-- Gerado em: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\n",
+            f"-- Total de municípios: {total}\n",
+            f"-- Dialeto: {dialect}\n",
+        ]
+
         # Adicionar contagem por UF
-        if uf_counts:
-            sql += "-- UFs incluídas:\n"
+        if uf_counts and 'uf' in selected_columns:
+            cabecalho.append("-- UFs incluídas:\n")
             for uf, count in sorted(uf_counts.items()):
-                sql += f"--   {uf}: {count} municípios\n"
-        
-        sql += "\n"
-        
+                cabecalho.append(f"--   {uf}: {count} municípios\n")
+
+        cabecalho.append("\n")
+
         # Adicionar comando CREATE TABLE se solicitado
         if include_create_table:
-            sql += "-- Criar tabela se não existir\n"
-            sql += "CREATE TABLE IF NOT EXISTS tb_municipios (\n"
-            sql += "    uf TEXT,\n"
-            sql += "    cod_municipio TEXT,\n"
-            sql += "    nome_municipio TEXT,\n"
-            sql += "    PRIMARY KEY (uf, cod_municipio)\n"
-            sql += ");\n\n"
-        
+            cabecalho.append("-- Criar tabela se não existir\n")
+            cabecalho.append(criar_tabela(dialect) + "\n")
+
         # Adicionar transação para melhor performance
-        sql += "BEGIN TRANSACTION;\n\n"
-        
-        # Gerar comandos INSERT OR REPLACE
-        for municipio in municipios:
-            # Montar valores das colunas
-            values = []
-            for col in selected_columns:
-                val = municipio[col]
-                # Escapar aspas simples nos valores de texto
-                if isinstance(val, str):
-                    val = val.replace("'", "''")
-                values.append(f"'{val}'")
-            
-            # Construir comando
-            sql += f"INSERT OR REPLACE INTO tb_municipios ({', '.join(selected_columns)}) "
-            sql += f"VALUES ({', '.join(values)});\n"
-        
+        cabecalho.append(inicio_transacao(dialect) + "\n")
+        yield ''.join(cabecalho)
+
+        # Gerar comandos INSERT (com upsert no dialeto de destino), um lote por vez
+        cursor.execute(query, params)
+        while True:
+            municipios = cursor.fetchmany(batch_size)
+            if not municipios:
+                break
+            yield ''.join(comandos_insert(dialect, selected_columns, municipios, rows_per_insert))
+
         # Finalizar transação
-        sql += "\nCOMMIT;\n"
-        
-        return sql
-    
+        yield "\nCOMMIT;\n"
+
     except Exception as e:
         logger.error(f"Erro ao gerar SQL: {e}")
-        return f"-- Erro ao gerar comandos SQL: {e}"
-    
+        if erros is not None:
+            erros.append(str(e))
+        yield f"-- Erro ao gerar comandos SQL: {e}"
+
     finally:
-        if conn:
-            conn.close()
\ No newline at end of file
+        if transacao_propria and conn.in_transaction:
+            conn.rollback()
+        conn.close()
+
+
+def generate_sql_commands(db_path, ufs=None, selected_columns=None, include_create_table=True, limit=0, search='',
+                          dialect='sqlite', rows_per_insert=LINHAS_POR_INSERT, erros=None):
+    """
+    Gera comandos SQL INSERT (upsert) para municípios
+
+    :param db_path: Caminho do banco de dados SQLite
+    :param ufs: Lista de UFs para filtrar (None = todas)
+    :param selected_columns: Lista de colunas a incluir (None = todas)
+    :param include_create_table: Se deve incluir o comando CREATE TABLE
+    :param limit: Número máximo de registros (0 = sem limite)
+    :param search: Filtro de texto para nome do município
+    :param dialect: Banco de destino do script (sqlite, postgresql ou mysql)
+    :param rows_per_insert: Quantidade de municípios por comando INSERT
+    :param erros: Lista opcional que recebe as mensagens de erro da geração
+    :return: String com comandos SQL
+    """
+    return ''.join(iterar_sql_commands(
+        db_path, ufs, selected_columns, include_create_table, limit, search,
+        dialect=dialect, rows_per_insert=rows_per_insert, erros=erros
+    ))
@@ -0,0 +1,173 @@
+"""
+sql_dialetos.py - Comandos SQL de carga de municípios para outros bancos
+
+Gera os trechos dos scripts de importação de tb_municipios (CREATE TABLE,
+início de transação e INSERTs) no dialeto do banco de destino:
+
+    sqlite      INSERT OR REPLACE
+    postgresql  INSERT ... ON CONFLICT (uf, cod_municipio) DO UPDATE
+    mysql       INSERT ... ON DUPLICATE KEY UPDATE
+
+Os INSERTs podem agrupar várias linhas em um único VALUES (...), (...): o
+banco de destino analisa e executa um comando por lote em vez de um por
+município, o que torna a carga do script muito mais rápida.
+"""
+
+from typing import Any, Iterable, Iterator, Sequence
+
+# Dialetos suportados
+DIALETOS_SQL = ('sqlite', 'postgresql', 'mysql')
+
+# Linhas por INSERT padrão (1 = um comando por município, como nas versões anteriores)
+LINHAS_POR_INSERT = 1
+
+# Limite de linhas por INSERT (mantém cada comando com tamanho razoável)
+MAX_LINHAS_POR_INSERT = 1000
+
+# Chave primária de tb_municipios, usada como alvo do upsert
+CHAVE_MUNICIPIOS = ('uf', 'cod_municipio')
+
+_CREATE_TABLE = {
+    'sqlite': (
+        "CREATE TABLE IF NOT EXISTS tb_municipios (\n"
+        "    uf TEXT,\n"
+        "    cod_municipio TEXT,\n"
+        "    nome_municipio TEXT,\n"
+        "    PRIMARY KEY (uf, cod_municipio)\n"
+        ");\n"
+    ),
+    'postgresql': (
+        "CREATE TABLE IF NOT EXISTS tb_municipios (\n"
+        "    uf TEXT,\n"
+        "    cod_municipio TEXT,\n"
+        "    nome_municipio TEXT,\n"
+        "    PRIMARY KEY (uf, cod_municipio)\n"
+        ");\n"
+    ),
+    # O MySQL não aceita TEXT em chave primária sem tamanho de prefixo
+    'mysql': (
+        "CREATE TABLE IF NOT EXISTS tb_municipios (\n"
+        "    uf VARCHAR(2),\n"
+        "    cod_municipio VARCHAR(20),\n"
+        "    nome_municipio VARCHAR(255),\n"
+        "    PRIMARY KEY (uf, cod_municipio)\n"
+        ");\n"
+    ),
+}
+
+_INICIO_TRANSACAO = {
+    'sqlite': "BEGIN TRANSACTION;\n",
+    'postgresql': "BEGIN;\n",
+    'mysql': "START TRANSACTION;\n",
+}
+
+
+def validar_dialeto(dialeto: str) -> str:
+    """
+    Normaliza e valida o nome do dialeto
+
+    :param dialeto: Nome do dialeto (None = sqlite)
+    :return: Nome normalizado
+    :raises ValueError: Se o dialeto não for suportado
+    """
+    dialeto = (dialeto or 'sqlite').strip().lower()
+    if dialeto in ('postgres', 'pg'):
+        dialeto = 'postgresql'
+    if dialeto not in DIALETOS_SQL:
+        raise ValueError(f"Dialeto SQL não suportado: {dialeto}. Use: {', '.join(DIALETOS_SQL)}")
+    return dialeto
+
+
+def validar_linhas_por_insert(linhas: Any) -> int:
+    """
+    Converte e limita a quantidade de linhas por INSERT
+
+    :param linhas: Valor informado (texto ou número; vazio = padrão)
+    :return: Quantidade entre 1 e MAX_LINHAS_POR_INSERT
+    :raises ValueError: Se o valor não for numérico
+    """
+    if linhas in (None, ''):
+        return LINHAS_POR_INSERT
+    return max(1, min(int(linhas), MAX_LINHAS_POR_INSERT))
+
+
+def criar_tabela(dialeto: str) -> str:
+    """Comando CREATE TABLE de tb_municipios no dialeto informado"""
+    return _CREATE_TABLE[dialeto]
+
+
+def inicio_transacao(dialeto: str) -> str:
+    """Comando de início de transação no dialeto informado"""
+    return _INICIO_TRANSACAO[dialeto]
+
+
+def valor_sql(valor: Any, dialeto: str) -> str:
+    """
+    Formata um valor como literal SQL
+
+    :param valor: Valor da coluna
+    :param dialeto: Dialeto de destino
+    :return: Literal entre aspas simples (ou NULL)
+    """
+    if valor is None:
+        return 'NULL'
+    texto = str(valor)
+    # No MySQL a barra invertida também é caractere de escape
+    if dialeto == 'mysql':
+        texto = texto.replace('\\', '\\\\')
+    return "'" + texto.replace("'", "''") + "'"
+
+
+def _prefixo_insert(dialeto: str, colunas: Sequence[str]) -> str:
+    """Início do comando INSERT (até VALUES) no dialeto informado"""
+    lista = ', '.join(colunas)
+    if dialeto == 'sqlite':
+        return f"INSERT OR REPLACE INTO tb_municipios ({lista}) VALUES"
+    if dialeto == 'mysql' and not [c for c in colunas if c not in CHAVE_MUNICIPIOS]:
+        return f"INSERT IGNORE INTO tb_municipios ({lista}) VALUES"
+    return f"INSERT INTO tb_municipios ({lista}) VALUES"
+
+
+def _sufixo_insert(dialeto: str, colunas: Sequence[str]) -> str:
+    """Cláusula de upsert ao final do INSERT no dialeto informado"""
+    atualizar = [c for c in colunas if c not in CHAVE_MUNICIPIOS]
+    if dialeto == 'postgresql':
+        if not atualizar or not all(c in colunas for c in CHAVE_MUNICIPIOS):
+            return "\nON CONFLICT DO NOTHING"
+        atribuicoes = ', '.join(f"{c} = EXCLUDED.{c}" for c in atualizar)
+        return f"\nON CONFLICT ({', '.join(CHAVE_MUNICIPIOS)}) DO UPDATE SET {atribuicoes}"
+    if dialeto == 'mysql' and atualizar:
+        atribuicoes = ', '.join(f"{c} = VALUES({c})" for c in atualizar)
+        return f"\nON DUPLICATE KEY UPDATE {atribuicoes}"
+    return ''
+
+
+def comandos_insert(dialeto: str, colunas: Sequence[str], linhas: Iterable[Sequence[Any]],
+                    linhas_por_insert: int = LINHAS_POR_INSERT) -> Iterator[str]:
+    """
+    Gera os comandos INSERT (com upsert) para as linhas informadas
+
+    :param dialeto: Dialeto de destino (já validado)
+    :param colunas: Colunas, na ordem dos valores de cada linha
+    :param linhas: Linhas a inserir
+    :param linhas_por_insert: Quantidade de linhas por comando
+    :return: Gerador de comandos, cada um terminado em ";\\n"
+    """
+    prefixo = _prefixo_insert(dialeto, colunas)
+    sufixo = _sufixo_insert(dialeto, colunas)
+
+    lote = []
+    for linha in linhas:
+        lote.append(f"({', '.join(valor_sql(valor, dialeto) for valor in linha)})")
+        if len(lote) >= linhas_por_insert:
+            yield _comando_insert(prefixo, sufixo, lote)
+            lote = []
+    if lote:
+        yield _comando_insert(prefixo, sufixo, lote)
+
+
+def _comando_insert(prefixo: str, sufixo: str, valores: Sequence[str]) -> str:
+    """Monta um INSERT com uma ou várias linhas em VALUES"""
+    if len(valores) == 1:
+        return f"{prefixo} {valores[0]}{sufixo};\n"
+    return f"{prefixo}\n    " + ",\n    ".join(valores) + f"{sufixo};\n"
@@ -0,0 +1,55 @@
+"""
+Fixtures compartilhadas pelos testes
+
+Os testes rodam em um diretório temporário: o banco (app_rest_gyn.db, que
+o DatabaseManager procura na pasta da aplicação), os uploads e os resultados
+de tarefas criados pela aplicação ficam fora do repositório.
+"""
+
+import os
+import sys
+
+import pytest
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, RAIZ)
+
+MUNICIPIOS_TESTE = (
+    "000100;ANANAS                                       ;TO\n"
+    "000200;ARAGUAINA                                    ;TO\n"
+    "925000;GOIANIA                                      ;GO\n"
+    "930200;ANAPOLIS                                     ;GO\n"
+    "710700;SAO PAULO                                    ;SP\n"
+)
+
+
+@pytest.fixture(scope='session')
+def pasta_app(tmp_path_factory):
+    """Diretório de trabalho da aplicação durante os testes"""
+    from database import DatabaseManager
+
+    pasta = tmp_path_factory.mktemp('app')
+    anterior = os.getcwd()
+    caminho_original = DatabaseManager.get_application_path
+    DatabaseManager.get_application_path = lambda self: str(pasta)
+    os.chdir(pasta)
+    yield pasta
+    os.chdir(anterior)
+    DatabaseManager.get_application_path = caminho_original
+
+
+@pytest.fixture(scope='session')
+def web_app(pasta_app):
+    """Módulo web_app importado sem a importação inicial de municípios"""
+    os.environ['MUNICIPIOS_IMPORTACAO_INICIAL'] = 'desativado'
+    import web_app as modulo
+    modulo.app.config['TESTING'] = True
+    return modulo
+
+
+@pytest.fixture
+def arquivo_municipios(tmp_path):
+    """Arquivo de municípios no layout do IBGE (CODIGO;NOME;UF)"""
+    caminho = tmp_path / 'municipios.txt'
+    caminho.write_text(MUNICIPIOS_TESTE, encoding='utf-8')
+    return str(caminho)
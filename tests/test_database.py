@@ -0,0 +1,209 @@
+"""Testes do DatabaseManager (gravações e paginação)"""
+
+import base64
+
+import pytest
+
+
+@pytest.fixture
+def db(web_app):
+    return web_app.db
+
+
+@pytest.fixture
+def transacoes(db, monkeypatch):
+    """Conta as transações abertas por DatabaseManager.transacao_escrita"""
+    contador = []
+    original = db.transacao_escrita
+
+    def transacao_escrita():
+        contador.append(1)
+        return original()
+
+    monkeypatch.setattr(db, 'transacao_escrita', transacao_escrita)
+    return contador
+
+
+def test_gravacoes_usam_a_transacao_de_escrita(db, transacoes):
+    fornecedor_id = db.insert_fornecedor('11.222.333/0231-81', 'FORNECEDOR TESTE', 'GO', 'GOIANIA', '925000')
+    assert fornecedor_id is not None
+    # O upsert pelo CNPJ devolve o mesmo cadastro
+    assert db.insert_fornecedor('11222333023181', 'FORNECEDOR ALTERADO', 'GO', 'GOIANIA', '925000') == fornecedor_id
+    assert db.limpar_notas_fiscais() is True
+    assert len(transacoes) == 3
+
+    conn = db.create_connection()
+    try:
+        assert not conn.in_transaction
+        descricao = conn.execute(
+            "SELECT descricao_fornecedor FROM tb_fornecedores WHERE id = ?", (fornecedor_id,)
+        ).fetchone()[0]
+    finally:
+        conn.close()
+    assert descricao == 'FORNECEDOR ALTERADO'
+
+
+def test_cnpj_invalido_nao_abre_transacao(db, transacoes):
+    assert db.insert_fornecedor('11.222.333/0200-81', 'INVALIDO', 'GO', 'GOIANIA', '925000') is None
+    assert transacoes == []
+
+
+@pytest.mark.parametrize('after', [
+    'nao-e-um-cursor',
+    base64.urlsafe_b64encode(b'["2024-01-01"]').decode(),
+    base64.urlsafe_b64encode(b'{"dt": "2024-01-01", "id": 1}').decode(),
+    base64.urlsafe_b64encode(b'["2024-01-01", "1"]').decode(),
+])
+def test_cursor_de_paginacao_invalido(db, web_app, after):
+    with pytest.raises(ValueError):
+        db.get_notas_fiscais_paginadas(after=after)
+
+    resposta = web_app.app.test_client().get('/notas', query_string={'after': after})
+    assert resposta.status_code == 400
+
+
+def test_cursor_de_paginacao_valido(db):
+    after = db._codificar_cursor_notas('2024-01-01', 1)
+    assert db.get_notas_fiscais_paginadas(after=after)['rows'] == []
+
+
+def test_cadastro_de_tomadores(db, transacoes):
+    dados = {'razao_social': 'TOMADOR TESTE', 'cnpj': '11.222.333/0001-81', 'inscricao': '123', 'usuario': 'teste'}
+    tomador_id = db.insert_tomador(dados)
+    assert tomador_id is not None
+    # O upsert pelo CNPJ devolve o mesmo cadastro
+    assert db.insert_tomador({**dados, 'razao_social': 'TOMADOR ALTERADO'}) == tomador_id
+
+    assert db.update_tomador({**dados, 'id': tomador_id, 'cnpj': '11222333000181', 'inscricao': '456'}) is True
+    assert (tomador_id, 'TOMADOR TESTE', '11222333000181', '456', 'teste') in db.get_all_tomadores()
+
+    assert db.delete_tomador(tomador_id) is True
+    assert db.update_tomador({**dados, 'id': tomador_id}) is False
+    assert len(transacoes) == 5
+
+
+def test_rota_de_exclusao_de_tomador(db, web_app):
+    tomador_id = db.insert_tomador({'razao_social': 'EXCLUIR', 'cnpj': '44555666000199', 'usuario': 'teste'})
+
+    resposta = web_app.app.test_client().post(f'/tomadores/excluir/{tomador_id}')
+    assert resposta.status_code == 302
+    assert tomador_id not in [tomador[0] for tomador in db.get_all_tomadores()]
+
+
+def _inserir_notas(conn, notas, comando='INSERT'):
+    conn.executemany(
+        f"{comando} INTO tb_notas_fiscais (id, referencia, cnpj, numero_nf, dt_emissao) VALUES (?, ?, ?, ?, ?)",
+        [(nota_id, '01/2024', '11222333023181', numero, '2024-01-01') for nota_id, numero in notas]
+    )
+
+
+def _totais_notas(db):
+    conn = db.create_connection()
+    try:
+        contador = conn.execute("SELECT valor FROM tb_contadores WHERE chave = 'notas_fiscais'").fetchone()[0]
+        total = conn.execute("SELECT COUNT(*) FROM tb_notas_fiscais").fetchone()[0]
+        # A listagem sem filtros usa o contador
+        assert db._contar_notas(conn.cursor(), [], []) == (contador, True)
+    finally:
+        conn.close()
+    return contador, total
+
+
+def test_contador_de_notas_acompanha_a_tabela(db):
+    assert db.limpar_notas_fiscais() is True
+    assert _totais_notas(db) == (0, 0)
+
+    with db.transacao_escrita() as conn:
+        _inserir_notas(conn, [(None, str(numero)) for numero in range(1, 6)])
+    assert _totais_notas(db) == (5, 5)
+
+    with db.transacao_escrita() as conn:
+        conn.execute("DELETE FROM tb_notas_fiscais WHERE numero_nf IN ('1', '2')")
+    assert _totais_notas(db) == (3, 3)
+
+    # Reimportação das mesmas notas: o REPLACE substitui as linhas existentes
+    with db.transacao_escrita() as conn:
+        ids = [nota_id for (nota_id,) in conn.execute("SELECT id FROM tb_notas_fiscais")]
+        _inserir_notas(conn, [(nota_id, f"R{nota_id}") for nota_id in ids], 'INSERT OR REPLACE')
+        _inserir_notas(conn, [(ids[0], 'IGNORADA')], 'INSERT OR IGNORE')
+    assert _totais_notas(db) == (3, 3)
+
+    # Reimportação completa: limpa a tabela e grava novamente
+    assert db.limpar_notas_fiscais() is True
+    with db.transacao_escrita() as conn:
+        _inserir_notas(conn, [(None, str(numero)) for numero in range(1, 4)])
+    assert _totais_notas(db) == (3, 3)
+    assert db.limpar_notas_fiscais() is True
+
+
+def _buscar_notas(db, termo, fts=True):
+    """Ids das notas encontradas pela condição de busca da listagem"""
+    busca_fts = db._busca_fts
+    db._busca_fts = fts
+    conn = db.create_connection()
+    try:
+        condicao, params = db._condicao_busca_notas(termo)
+        return sorted(nota_id for (nota_id,) in conn.execute(f"""
+            SELECT nf.id FROM tb_notas_fiscais nf
+            LEFT JOIN tb_fornecedores f ON nf.fornecedor_id = f.id
+            WHERE {condicao}
+        """, params))
+    finally:
+        conn.close()
+        db._busca_fts = busca_fts
+
+
+def test_indice_de_busca_acompanha_notas_e_fornecedores(db):
+    if not db._busca_fts:
+        pytest.skip("SQLite sem FTS5")
+    assert db.limpar_notas_fiscais() is True
+
+    with db.transacao_escrita() as conn:
+        alfa = conn.execute("INSERT INTO tb_fornecedores (descricao_fornecedor) VALUES ('ALFA SERVICOS')").lastrowid
+        beta = conn.execute("INSERT INTO tb_fornecedores (descricao_fornecedor) VALUES ('BETA OBRAS')").lastrowid
+        conn.executemany(
+            "INSERT INTO tb_notas_fiscais (id, referencia, cnpj, numero_nf, fornecedor_id) VALUES (?, '01/2024', ?, ?, ?)",
+            [(1, '11222333000181', 'NF12345', alfa), (2, '44555666000177', '999', beta)]
+        )
+        tomador = conn.execute("""
+            INSERT INTO tb_tomadores (razao_social, cnpj, usuario) VALUES ('TOMADOR ALFA', '11222333000181', 'teste')
+        """).lastrowid
+
+    def conferir(esperado):
+        for termo, ids in esperado.items():
+            assert _buscar_notas(db, termo) == ids, termo
+            # A busca pelo índice dá o mesmo resultado do LIKE
+            assert _buscar_notas(db, termo, fts=False) == ids, termo
+
+    conferir({'ALFA': [1], 'servicos': [1], '2345': [1], '5666': [2], 'OBRAS': [2], '000': [1, 2]})
+
+    # Alteração da nota: número e fornecedor
+    with db.transacao_escrita() as conn:
+        conn.execute("UPDATE tb_notas_fiscais SET numero_nf = 'XYZ777' WHERE id = 2")
+        conn.execute("UPDATE tb_notas_fiscais SET fornecedor_id = ? WHERE id = 1", (beta,))
+    conferir({'XYZ777': [2], '999': [], 'ALFA': [], 'BETA': [1, 2]})
+
+    # Fornecedor renomeado; tomadores não fazem parte do índice
+    with db.transacao_escrita() as conn:
+        conn.execute("UPDATE tb_fornecedores SET descricao_fornecedor = 'GAMA REFORMAS' WHERE id = ?", (beta,))
+        conn.execute("UPDATE tb_tomadores SET razao_social = 'TOMADOR BETA' WHERE id = ?", (tomador,))
+    conferir({'GAMA': [1, 2], 'BETA': [], 'REFORMAS': [1, 2]})
+
+    # Nota regravada, nota excluída e fornecedor excluído
+    with db.transacao_escrita() as conn:
+        conn.execute("""
+            INSERT OR REPLACE INTO tb_notas_fiscais (id, referencia, cnpj, numero_nf, fornecedor_id)
+            VALUES (2, '01/2024', '44555666000177', 'NOVA888', ?)
+        """, (alfa,))
+        conn.execute("DELETE FROM tb_notas_fiscais WHERE id = 1")
+    conferir({'NOVA888': [2], 'XYZ777': [], 'GAMA': [], 'ALFA': [2], '2345': []})
+
+    with db.transacao_escrita() as conn:
+        conn.execute("DELETE FROM tb_fornecedores WHERE id = ?", (alfa,))
+    conferir({'ALFA': [], 'NOVA888': [2]})
+
+    assert db.limpar_notas_fiscais() is True
+    conferir({'NOVA888': []})
+    with db.transacao_escrita() as conn:
+        conn.execute("DELETE FROM tb_fornecedores WHERE id = ?", (beta,))
+        conn.execute("DELETE FROM tb_tomadores WHERE id = ?", (tomador,))
@@ -0,0 +1,195 @@
+"""Testes da exportação de notas fiscais (exportacao.py)"""
+
+import csv
+import io
+import sqlite3
+import time
+
+import openpyxl
+import pyarrow.parquet as pq
+import pytest
+
+from exportacao import consulta_notas, gerar_csv, gerar_exportacao, gerar_parquet, gerar_xlsx
+
+# Cabeçalho da exportação de notas (SQL_EXPORTAR_NOTAS)
+COLUNAS_NOTAS = [
+    'Identificador', 'Referência', 'CNPJ', 'Fornecedor', 'Tipo de Serviço', 'Base de Cálculo',
+    'Número NF', 'Data de Emissão', 'Data de Pagamento', 'Alíquota', 'Valor NF', 'Recolhimento',
+    'Recibo', 'Inscrição Municipal', 'Cadastrado em Goiânia', 'Fora do País',
+]
+
+
+class _CursorFixo:
+    """Cursor com linhas definidas no teste (valores que o SQLite não devolve, como bool)"""
+
+    def __init__(self, colunas, linhas):
+        self.description = [(coluna,) + (None,) * 6 for coluna in colunas]
+        self._linhas = list(linhas)
+
+    def fetchmany(self, tamanho):
+        lote, self._linhas = self._linhas[:tamanho], self._linhas[tamanho:]
+        return lote
+
+
+@pytest.fixture
+def conn_notas():
+    """Banco em memória com três notas fiscais, em ordem de emissão decrescente pelo id"""
+    conn = sqlite3.connect(':memory:')
+    conn.executescript("""
+        CREATE TABLE tb_fornecedores (id INTEGER PRIMARY KEY, descricao_fornecedor TEXT);
+        CREATE TABLE tb_tomadores (id INTEGER PRIMARY KEY);
+        CREATE TABLE tb_notas_fiscais (
+            id INTEGER PRIMARY KEY, referencia TEXT, cadastrado_goiania BOOLEAN, fora_pais BOOLEAN,
+            cnpj TEXT, fornecedor_id INTEGER, tomador_id INTEGER, inscricao_municipal TEXT,
+            tipo_servico TEXT, base_calculo TEXT, numero_nf TEXT, dt_emissao DATE, dt_pagamento DATE,
+            aliquota REAL, valor_nf REAL, recolhimento TEXT, recibo TEXT
+        );
+        INSERT INTO tb_fornecedores VALUES (1, 'SERVIÇOS; LIMPEZA LTDA'), (2, 'OBRAS SA');
+        INSERT INTO tb_notas_fiscais VALUES
+            (1, '01/2024', 1, 0, '11222333000181', 1, NULL, '123', '7.02', '1000', '10',
+             '2024-01-10', '2024-01-20', 2.5, 1234.5, '1', 'R1'),
+            (2, '02/2024', 0, 1, '44555666000199', 2, NULL, NULL, '7.02', '500', '11',
+             '2024-02-10', NULL, 5.0, 500.25, '1', NULL),
+            (3, '02/2024', 0, 0, '44555666000199', 2, NULL, NULL, '7.02', '0', '12',
+             NULL, NULL, NULL, NULL, NULL, NULL);
+    """)
+    yield conn
+    conn.close()
+
+
+def _ler_csv(pedacos, delimitador):
+    texto = b''.join(pedacos).decode('utf-8')
+    assert texto.startswith('\ufeff')
+    return list(csv.reader(io.StringIO(texto[1:], newline=''), delimiter=delimitador))
+
+
+def _ler_planilha(pedacos):
+    planilha = openpyxl.load_workbook(io.BytesIO(b''.join(pedacos))).active
+    return [list(linha) for linha in planilha.iter_rows(values_only=True)]
+
+
+def test_gerar_xlsx_com_valores_especiais():
+    cursor = _CursorFixo(
+        ['Texto', 'Inteiro', 'Real', 'Lógico', 'Vazio'],
+        [
+            ('Goiânia', 1, 1.5, True, None),
+            ('  espaços  ', 2, float('nan'), False, None),
+            ('<&>', 3, float('inf'), True, None),
+        ]
+    )
+
+    assert _ler_planilha(gerar_xlsx(cursor, tamanho_lote=2)) == [
+        ['Texto', 'Inteiro', 'Real', 'Lógico', 'Vazio'],
+        ['Goiânia', 1, 1.5, True, None],
+        ['  espaços  ', 2, None, False, None],
+        ['<&>', 3, None, True, None],
+    ]
+
+
+def test_gerar_xlsx_de_consulta():
+    conn = sqlite3.connect(':memory:')
+    cursor = conn.execute("SELECT 'CIDADE' AS nome, 10 AS codigo, 2.5 AS aliquota UNION ALL SELECT 'OUTRA', 11, NULL")
+
+    assert _ler_planilha(gerar_xlsx(cursor)) == [
+        ['nome', 'codigo', 'aliquota'],
+        ['CIDADE', 10, 2.5],
+        ['OUTRA', 11, None],
+    ]
+    conn.close()
+
+
+def test_gerar_parquet_em_varios_grupos():
+    conn = sqlite3.connect(':memory:')
+    conn.execute("CREATE TABLE t (id INTEGER, nome TEXT, valor REAL)")
+    conn.executemany("INSERT INTO t VALUES (?, ?, ?)",
+                     [(i, f'NOTA {i}', i * 1.5 if i % 3 else None) for i in range(1, 8)])
+    cursor = conn.execute("SELECT id, nome, valor FROM t ORDER BY id")
+
+    pedacos = list(gerar_parquet(cursor, tipos={'id': 'int64', 'valor': 'float64'},
+                                 linhas_por_grupo=3, tamanho_lote=2))
+    arquivo = pq.ParquetFile(io.BytesIO(b''.join(pedacos)))
+    tabela = pq.read_table(io.BytesIO(b''.join(pedacos)))
+
+    assert len(pedacos) > 1
+    assert arquivo.metadata.num_row_groups == 2
+    assert [str(campo.type) for campo in tabela.schema] == ['int64', 'string', 'double']
+    assert tabela.to_pylist()[:3] == [
+        {'id': 1, 'nome': 'NOTA 1', 'valor': 1.5},
+        {'id': 2, 'nome': 'NOTA 2', 'valor': 3.0},
+        {'id': 3, 'nome': 'NOTA 3', 'valor': None},
+    ]
+    assert tabela.num_rows == 7
+    conn.close()
+
+
+def test_exportacao_de_notas_em_csv_padrao_brasileiro(conn_notas):
+    linhas = _ler_csv(gerar_exportacao(conn_notas, 'csv'), ';')
+
+    assert linhas[0] == COLUNAS_NOTAS
+    assert [linha[0] for linha in linhas[1:]] == ['2', '1', '3']
+    nota = dict(zip(COLUNAS_NOTAS, linhas[2]))
+    assert nota['Fornecedor'] == 'SERVIÇOS; LIMPEZA LTDA'
+    assert nota['Alíquota'] == '2,5'
+    assert nota['Valor NF'] == '1234,5'
+    assert nota['Cadastrado em Goiânia'] == 'Sim'
+    assert dict(zip(COLUNAS_NOTAS, linhas[3]))['Valor NF'] == ''
+
+
+def test_exportacao_de_notas_em_csv_com_ponto_decimal(conn_notas):
+    cursor = conn_notas.execute(consulta_notas())
+    linhas = _ler_csv(gerar_csv(cursor, delimitador=',', decimal='.', tamanho_lote=1), ',')
+
+    assert linhas[0] == COLUNAS_NOTAS
+    assert len(linhas) == 4
+    nota = dict(zip(COLUNAS_NOTAS, linhas[1]))
+    assert nota['Valor NF'] == '500.25'
+    assert nota['Alíquota'] == '5.0'
+    assert nota['Fora do País'] == 'Sim'
+
+
+def test_exportacao_de_notas_em_parquet(conn_notas):
+    tabela = pq.read_table(io.BytesIO(b''.join(gerar_exportacao(conn_notas, 'parquet'))))
+
+    assert tabela.column_names == COLUNAS_NOTAS
+    assert str(tabela.schema.field('Identificador').type) == 'int64'
+    assert str(tabela.schema.field('Valor NF').type) == 'double'
+    assert str(tabela.schema.field('Base de Cálculo').type) == 'string'
+    assert tabela.column('Identificador').to_pylist() == [2, 1, 3]
+    assert tabela.column('Valor NF').to_pylist() == [500.25, 1234.5, None]
+    assert tabela.column('Fornecedor').to_pylist() == ['OBRAS SA', 'SERVIÇOS; LIMPEZA LTDA', 'OBRAS SA']
+
+
+def test_exportacao_de_notas_por_tomador(conn_notas):
+    conn_notas.execute("INSERT INTO tb_tomadores VALUES (7)")
+    conn_notas.execute("UPDATE tb_notas_fiscais SET tomador_id = 7 WHERE id = 1")
+
+    linhas = _ler_csv(gerar_exportacao(conn_notas, 'csv', tomador_id=7), ';')
+    assert [linha[0] for linha in linhas[1:]] == ['1']
+
+
+def _aguardar_job(web_app, job_id, timeout=10.0):
+    limite = time.time() + timeout
+    while time.time() < limite:
+        job = web_app.jobs.obter(job_id)
+        if job['estado'] in ('concluido', 'erro'):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"Tarefa {job_id} não terminou")
+
+
+def test_download_csv_com_um_unico_charset(web_app):
+    cliente = web_app.app.test_client()
+
+    resposta = cliente.post('/notas/exportar-excel', data={'formato': 'csv'})
+    assert resposta.status_code == 200
+    assert resposta.headers['Content-Type'] == 'text/csv; charset=utf-8'
+
+    resposta = cliente.post('/notas/exportar-excel', data={'formato': 'csv', 'em_segundo_plano': 'sim'})
+    assert resposta.status_code == 202
+    job = _aguardar_job(web_app, resposta.get_json()['job_id'])
+    assert job['estado'] == 'concluido', job['erro']
+
+    resposta = cliente.get(f"/api/jobs/{job['id']}/download")
+    assert resposta.status_code == 200
+    assert resposta.headers['Content-Type'] == 'text/csv; charset=utf-8'
+    resposta.close()
@@ -0,0 +1,294 @@
+"""Testes da importação de municípios (import_engine e DatabaseManager)"""
+
+import io
+import os
+import sqlite3
+import threading
+import time
+
+import pytest
+
+from import_engine import MunicipioImportEngine, abrir_arquivo_municipios
+from municipios_consulta import PlanoConsultaMunicipios
+
+
+def _remover_metadados(db):
+    """Simula um banco com os municípios já gravados, sem versão nem hash"""
+    with db.transacao_escrita() as conn:
+        conn.execute("DELETE FROM tb_metadados WHERE chave IN ('municipios_versao', 'municipios_hash')")
+    db.recarregar_indice_municipios()
+
+
+def test_sincronizacao_sem_alteracoes_registra_versao_e_etag(web_app, arquivo_municipios):
+    db = web_app.db
+    assert db.import_municipios_from_txt(arquivo_municipios) == 5
+    _remover_metadados(db)
+
+    # O arquivo é igual à tabela: nada muda, mas a versão passa a existir
+    assert db.sincronizar_municipios(arquivo_municipios, diferencial=True) == 5
+    assert db.get_metadado('municipios_versao') == '1'
+    assert db.get_versao_municipios() == '1'
+
+    cliente = web_app.app.test_client()
+    resposta = cliente.get('/api/ufs')
+    assert resposta.status_code == 200
+    assert resposta.headers['ETag'] == '"municipios-1"'
+    assert resposta.headers['Cache-Control'] == 'no-cache'
+
+    resposta = cliente.get('/api/ufs', headers={'If-None-Match': '"municipios-1"'})
+    assert resposta.status_code == 304
+
+
+def _banco_com_municipio_antigo(banco):
+    conn = sqlite3.connect(banco)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("CREATE TABLE tb_municipios (uf TEXT, cod_municipio TEXT, nome_municipio TEXT, "
+                 "PRIMARY KEY (uf, cod_municipio))")
+    conn.execute("CREATE INDEX idx_municipios_codigo ON tb_municipios (cod_municipio)")
+    conn.execute("INSERT INTO tb_municipios VALUES ('GO', '1', 'ANTIGO')")
+    conn.commit()
+    return conn
+
+
+def _objetos(conn):
+    return {nome for (nome,) in conn.execute("SELECT name FROM sqlite_master WHERE sql IS NOT NULL")}
+
+
+def test_recarga_libera_o_lock_de_escrita_entre_os_lotes(tmp_path, arquivo_municipios):
+    banco = str(tmp_path / 'recarga.db')
+    conn = _banco_com_municipio_antigo(banco)
+    lotes = []
+
+    def progresso(dados):
+        if dados['concluido']:
+            return
+        outra = sqlite3.connect(banco, timeout=0)
+        # Entre os lotes, outro escritor consegue gravar
+        outra.execute("BEGIN IMMEDIATE")
+        outra.rollback()
+        # Até a troca, os leitores veem a tabela antiga completa
+        assert outra.execute("SELECT nome_municipio FROM tb_municipios").fetchall() == [('ANTIGO',)]
+        outra.close()
+        lotes.append(dados['linhas_gravadas'])
+
+    engine = MunicipioImportEngine(batch_size=2)
+    with abrir_arquivo_municipios(arquivo_municipios) as (formato, linhas):
+        resultado = engine.importar(conn, linhas, formato, progresso=progresso)
+
+    assert lotes == [2, 4, 5]
+    assert resultado['importados'] == 5
+    assert conn.execute("SELECT COUNT(*) FROM tb_municipios").fetchone()[0] == 5
+    objetos = _objetos(conn)
+    indices = {nome for nome in objetos if nome.startswith('idx_municipios_codigo')}
+    assert objetos == {'tb_municipios', 'tb_metadados'} | indices
+    assert len(indices) == 1 and indices != {'idx_municipios_codigo'}
+
+    # Uma nova recarga troca o identificador do índice em vez de acumular sufixos
+    with abrir_arquivo_municipios(arquivo_municipios) as (formato, linhas):
+        engine.importar(conn, linhas, formato)
+    (indice,) = {nome for nome in _objetos(conn) if nome.startswith('idx_municipios_codigo')}
+    assert indice not in indices and len(indice) == len(indices.pop())
+    conn.close()
+
+
+def test_importacao_sem_limpar_nao_prende_o_lock_durante_a_leitura(tmp_path, arquivo_municipios):
+    banco = str(tmp_path / 'mesclar.db')
+    conn = _banco_com_municipio_antigo(banco)
+    conn.execute("UPDATE tb_municipios SET cod_municipio = '925000', nome_municipio = 'ANTIGO'")
+    conn.commit()
+    lotes = []
+
+    def progresso(dados):
+        if dados['concluido']:
+            return
+        outra = sqlite3.connect(banco, timeout=0)
+        outra.execute("BEGIN IMMEDIATE")
+        outra.rollback()
+        outra.close()
+        lotes.append(dados['linhas_gravadas'])
+
+    engine = MunicipioImportEngine(batch_size=2)
+    with abrir_arquivo_municipios(arquivo_municipios) as (formato, linhas):
+        resultado = engine.importar(conn, linhas, formato, limpar=False, progresso=progresso)
+
+    assert lotes == [2, 4, 5]
+    assert resultado['importados'] == 5
+    assert not conn.in_transaction
+    assert conn.execute("SELECT COUNT(*) FROM tb_municipios").fetchone()[0] == 5
+    assert conn.execute(
+        "SELECT nome_municipio FROM tb_municipios WHERE cod_municipio = '925000'"
+    ).fetchone() == ('GOIANIA',)
+    assert conn.execute("SELECT valor FROM tb_metadados WHERE chave = 'municipios_versao'").fetchone() == ('1',)
+    conn.close()
+
+
+def test_recarga_com_falha_apaga_a_tabela_nova(tmp_path, arquivo_municipios):
+    conn = _banco_com_municipio_antigo(str(tmp_path / 'falha.db'))
+
+    def progresso(dados):
+        if dados['linhas_gravadas'] >= 4:
+            raise RuntimeError("falha na leitura")
+
+    engine = MunicipioImportEngine(batch_size=2)
+    with abrir_arquivo_municipios(arquivo_municipios) as (formato, linhas):
+        with pytest.raises(RuntimeError):
+            engine.importar(conn, linhas, formato, progresso=progresso)
+
+    assert not conn.in_transaction
+    assert conn.execute("SELECT nome_municipio FROM tb_municipios").fetchall() == [('ANTIGO',)]
+    assert _objetos(conn) == {'tb_municipios', 'idx_municipios_codigo', 'tb_metadados'}
+    conn.close()
+
+
+def test_consultas_ignoram_a_tabela_em_montagem(tmp_path):
+    conn = sqlite3.connect(str(tmp_path / 'consulta.db'))
+    conn.execute("CREATE TABLE tb_municipios (uf TEXT, cod_municipio TEXT, nome_municipio TEXT)")
+    conn.execute("CREATE TABLE tb_municipios_new_0123abcd (uf TEXT, cod_municipio TEXT, nome_municipio TEXT)")
+
+    tabelas = [tabela for tabela, _ in PlanoConsultaMunicipios().consultas(conn.cursor())]
+    assert tabelas == ['tb_municipios']
+    conn.close()
+
+
+def test_leitura_paralela_fora_da_thread_principal(tmp_path, monkeypatch):
+    import import_engine
+
+    caminho = tmp_path / 'grande.txt'
+    with open(caminho, 'w', encoding='utf-8', newline='\r\n') as arquivo:
+        for i in range(3000):
+            arquivo.write(f"{i:07d};MUNICÍPIO {i:<30};GO\n" if i % 97 != 50 else f"{i};SEM UF\n")
+    # Blocos pequenos para dividir o arquivo entre os processos
+    monkeypatch.setattr(import_engine, 'TAMANHO_BLOCO_PARALELO', 8 * 1024)
+
+    def ler(processos):
+        resultado = {'total_linhas': 0, 'importados': 0, 'erros': 0}
+        with abrir_arquivo_municipios(str(caminho)) as (formato, linhas):
+            engine = MunicipioImportEngine(processos=processos)
+            registros = [registro for lote in engine.iterar_lotes(linhas, formato, resultado) for registro in lote]
+        return registros, resultado
+
+    # A importação da aplicação roda em threads de requisição e do JobManager
+    paralelo = []
+    thread = threading.Thread(target=lambda: paralelo.append(ler(2)))
+    thread.start()
+    thread.join(timeout=120)
+    assert not thread.is_alive()
+
+    registros, resultado = paralelo[0]
+    assert (registros, resultado) == ler(1)
+    assert resultado['erros'] == 31
+    assert len(registros) == 2969
+
+
+def test_uploads_com_o_mesmo_nome_nao_se_sobrescrevem(web_app, monkeypatch):
+    liberar = threading.Event()
+    lidos = {}
+
+    def importar(filepath, **kwargs):
+        with open(filepath, encoding='utf-8') as arquivo:
+            conteudo = arquivo.read()
+        if conteudo.startswith('primeiro'):
+            # A primeira importação ainda está lendo quando o segundo envio chega
+            liberar.wait(5)
+            with open(filepath, encoding='utf-8') as arquivo:
+                conteudo = arquivo.read()
+        lidos[filepath] = conteudo
+        return 0
+
+    monkeypatch.setattr(web_app.db, 'import_municipios_from_txt', importar)
+    cliente = web_app.app.test_client()
+
+    job_ids = []
+    for conteudo in ('primeiro envio', 'segundo envio'):
+        resposta = cliente.post('/api/importar-municipios', data={
+            'arquivo': (io.BytesIO(conteudo.encode('utf-8')), 'municipios.txt')
+        })
+        assert resposta.status_code == 202
+        job_ids.append(resposta.get_json()['job_id'])
+    liberar.set()
+
+    for job_id in job_ids:
+        limite = time.time() + 5
+        while web_app.jobs.obter(job_id)['estado'] not in ('concluido', 'erro'):
+            assert time.time() < limite
+            time.sleep(0.02)
+
+    assert sorted(lidos.values()) == ['primeiro envio', 'segundo envio']
+    assert all(caminho.endswith('_municipios.txt') for caminho in lidos)
+    # Os uploads são removidos ao final de cada importação
+    assert not any(os.path.exists(caminho) for caminho in lidos)
+
+
+# Linhas válidas e malformadas aceitas (ou recusadas) igualmente pelos dois parsers
+LINHAS_PARIDADE = [
+    "925000;GOIANIA                      ;GO",
+    "930200;  anápolis ;go ",
+    "",
+    "   ",
+    "123456;SEM UF",
+    "123456;DEMAIS;CAMPOS;GO",
+    "123456;;GO",
+    ";;",
+    "123456;NOME;G1",
+    "123456;NOME;GOI",
+    '"5208707";"GOIANÉSIA";GO',
+    "000100;ANANAS;TO",
+    "520870;SÃO JOÃO D'ALIANÇA;GO",
+    "710700;SAO PAULO;SP",
+    "\t000200 ;ARAGUAINA;TO\t",
+]
+
+
+def _importar_com_parser(caminho, parser, banco):
+    conn = _banco_com_municipio_antigo(banco)
+    eventos = []
+
+    def progresso(dados):
+        eventos.append({chave: valor for chave, valor in dados.items()
+                        if chave not in ('linhas_por_segundo', 'decorrido')})
+
+    engine = MunicipioImportEngine(batch_size=2, parser=parser)
+    with abrir_arquivo_municipios(caminho) as (formato, linhas):
+        resultado = engine.importar(conn, linhas, formato, limpar=False, progresso=progresso)
+    municipios = conn.execute("SELECT uf, cod_municipio, nome_municipio FROM tb_municipios ORDER BY 1, 2").fetchall()
+    conn.close()
+    return municipios, resultado, formato['encoding'], eventos
+
+
+@pytest.mark.parametrize('encoding, quebra', [
+    ('utf-8', '\n'),
+    ('utf-8-sig', '\r\n'),
+    ('cp1252', '\r\n'),
+])
+def test_parsers_linhas_e_colunar_dao_o_mesmo_resultado(tmp_path, monkeypatch, encoding, quebra):
+    import import_engine
+
+    caminho = tmp_path / 'municipios.txt'
+    caminho.write_bytes(quebra.join(LINHAS_PARIDADE + ['']).encode(encoding))
+
+    municipios, resultado, encoding_lido, eventos = _importar_com_parser(
+        str(caminho), 'linhas', str(tmp_path / 'linhas.db'))
+    colunar = _importar_com_parser(str(caminho), 'colunar', str(tmp_path / 'colunar.db'))
+
+    assert colunar[0] == municipios
+    contadores = {'total_linhas': 13, 'importados': 7, 'erros': 6}
+    for lido in (resultado, colunar[1]):
+        assert {chave: lido[chave] for chave in contadores} == contadores
+    # Sem UTF-8 válido, o encoding alternativo é usado pelos dois parsers
+    assert colunar[2] == encoding_lido and (encoding_lido == 'utf-8') == encoding.startswith('utf-8')
+    assert ('GO', '520870', "SÃO JOÃO D'ALIANÇA") in municipios
+    assert ('GO', '930200', 'ANÁPOLIS') in municipios
+    assert ('GO', '"5208707"', '"GOIANÉSIA"') in municipios
+
+    # Progresso: mesmos lotes gravados e mesmo evento final
+    assert [evento['linhas_gravadas'] for evento in colunar[3]] == [evento['linhas_gravadas'] for evento in eventos]
+    assert colunar[3][-1] == eventos[-1]
+    assert eventos[-1] == {'linhas_lidas': 13, 'linhas_gravadas': 7, 'erros': 6, 'concluido': True}
+    for lidos in ([evento['linhas_lidas'] for evento in eventos], [evento['linhas_lidas'] for evento in colunar[3]]):
+        assert lidos == sorted(lidos)
+
+    # Blocos do read_csv menores que o arquivo: as linhas malformadas caem em blocos diferentes
+    monkeypatch.setattr(import_engine, 'TAMANHO_BLOCO_COLUNAR', 4)
+    em_blocos = _importar_com_parser(str(caminho), 'colunar', str(tmp_path / 'blocos.db'))
+    assert em_blocos[0] == municipios
+    assert em_blocos[3][-1] == eventos[-1]
@@ -0,0 +1,167 @@
+"""Testes do gerenciador de tarefas em segundo plano (jobs.py)"""
+
+import json
+import sqlite3
+import threading
+import time
+
+import pytest
+
+import jobs
+from jobs import CONCLUIDO, ERRO, EXECUTANDO, PENDENTE, JobManager
+
+# tb_jobs como era criada antes das colunas dono e batimento
+SQL_TABELA_JOBS_ANTIGA = '''
+    CREATE TABLE tb_jobs (
+        id TEXT PRIMARY KEY, tipo TEXT NOT NULL, estado TEXT NOT NULL, resultado TEXT,
+        erro TEXT, arquivo TEXT, nome_arquivo TEXT, mimetype TEXT,
+        criado_em REAL NOT NULL, atualizado_em REAL NOT NULL
+    )
+'''
+
+
+@pytest.fixture
+def db_file(tmp_path):
+    return str(tmp_path / 'jobs.db')
+
+
+def _estados(db_file):
+    conn = sqlite3.connect(db_file)
+    try:
+        return dict(conn.execute("SELECT id, estado FROM tb_jobs"))
+    finally:
+        conn.close()
+
+
+def _aguardar_estado(gerenciador, job_id, estados, timeout=5.0):
+    limite = time.time() + timeout
+    while time.time() < limite:
+        job = gerenciador.obter(job_id)
+        if job['estado'] in estados:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"Tarefa {job_id} não chegou a {estados}")
+
+
+def _aguardar(condicao, timeout=5.0):
+    limite = time.time() + timeout
+    while not condicao():
+        assert time.time() < limite, "condição não atendida no prazo"
+        time.sleep(0.02)
+
+
+def test_inicio_interrompe_apenas_tarefas_abandonadas(db_file, tmp_path, monkeypatch):
+    monkeypatch.setattr(JobManager, 'dono', property(lambda self: 'este-host:100'))
+    agora = time.time()
+    conn = sqlite3.connect(db_file)
+    conn.execute(SQL_TABELA_JOBS_ANTIGA)
+    conn.execute("INSERT INTO tb_jobs VALUES ('antiga', 'x', ?, NULL, NULL, NULL, NULL, NULL, ?, ?)",
+                 (EXECUTANDO, agora, agora))
+    conn.execute("ALTER TABLE tb_jobs ADD COLUMN dono TEXT")
+    conn.execute("ALTER TABLE tb_jobs ADD COLUMN batimento REAL")
+    conn.executemany(
+        "INSERT INTO tb_jobs (id, tipo, estado, criado_em, atualizado_em, dono, batimento) VALUES (?, 'x', ?, ?, ?, ?, ?)",
+        [
+            ('outro_worker', EXECUTANDO, agora, agora, 'este-host:200', agora),
+            ('outro_host_pendente', PENDENTE, agora, agora, 'outro-host:100', agora),
+            ('batimento_antigo', EXECUTANDO, agora - 3600, agora - 3600, 'outro-host:300', agora - 3600),
+            ('execucao_anterior', EXECUTANDO, agora, agora, 'este-host:100', agora),
+            ('concluida', CONCLUIDO, agora, agora, 'outro-host:300', agora - 3600),
+        ]
+    )
+    conn.commit()
+    conn.close()
+
+    gerenciador = JobManager(db_file, str(tmp_path / 'resultados'))
+    gerenciador.encerrar()
+
+    assert _estados(db_file) == {
+        'antiga': ERRO,
+        'outro_worker': EXECUTANDO,
+        'outro_host_pendente': PENDENTE,
+        'batimento_antigo': ERRO,
+        'execucao_anterior': ERRO,
+        'concluida': CONCLUIDO,
+    }
+
+
+def test_batimento_mantem_a_tarefa_de_um_processo_ativo(db_file, tmp_path, monkeypatch):
+    liberar = threading.Event()
+    ativo = JobManager(db_file, str(tmp_path / 'a'), intervalo_batimento=0.05)
+    job_id = ativo.enfileirar('teste', lambda contexto: liberar.wait(10) and {'ok': True})
+    _aguardar_estado(ativo, job_id, (EXECUTANDO,))
+
+    # Mais que BATIMENTOS_PERDIDOS intervalos depois, outro worker inicia
+    time.sleep(0.8)
+    monkeypatch.setattr(JobManager, 'dono', property(lambda self: 'outro-host:1'))
+    outro = JobManager(db_file, str(tmp_path / 'b'), intervalo_batimento=0.05)
+    outro.encerrar()
+    assert _estados(db_file)[job_id] == EXECUTANDO
+
+    liberar.set()
+    assert _aguardar_estado(ativo, job_id, (CONCLUIDO, ERRO))['estado'] == CONCLUIDO
+    ativo.encerrar()
+
+
+def test_progresso_visivel_em_outro_processo(db_file, tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, 'INTERVALO_PROGRESSO', 0.05)
+    etapa = threading.Event()
+    liberar = threading.Event()
+
+    def tarefa(contexto):
+        contexto.atualizar_progresso(linhas_lidas=10)
+        etapa.wait(5)
+        contexto.atualizar_progresso(linhas_lidas=20)
+        liberar.wait(5)
+        return {'ok': True}
+
+    executor = JobManager(db_file, str(tmp_path / 'a'))
+    job_id = executor.enfileirar('teste', tarefa)
+    monkeypatch.setattr(JobManager, 'dono', property(lambda self: 'outro-host:1'))
+    outro = JobManager(db_file, str(tmp_path / 'b'))
+
+    _aguardar(lambda: outro.obter(job_id)['progresso'] == {'linhas_lidas': 10})
+    versao = outro.aguardar_mudanca(job_id, -1, timeout=1)
+
+    etapa.set()
+    assert outro.aguardar_mudanca(job_id, versao, timeout=2) != versao
+    _aguardar(lambda: outro.obter(job_id)['progresso'] == {'linhas_lidas': 20})
+
+    liberar.set()
+    _aguardar(lambda: outro.obter(job_id)['estado'] == CONCLUIDO)
+    assert outro.obter(job_id)['progresso'] == {'linhas_lidas': 20}
+    executor.encerrar()
+    outro.encerrar()
+
+
+def test_eventos_de_tarefa_de_outro_worker(web_app, tmp_path, monkeypatch):
+    monkeypatch.setattr(jobs, 'INTERVALO_PROGRESSO', 0.05)
+    monkeypatch.setattr(JobManager, 'dono', property(lambda self: 'outro-worker:1'))
+    liberar = threading.Event()
+
+    def tarefa(contexto):
+        contexto.atualizar_progresso(linhas_lidas=5)
+        liberar.wait(5)
+        return {'ok': True}
+
+    outro_worker = JobManager(web_app.db.db_file, str(tmp_path / 'outro'))
+    job_id = outro_worker.enfileirar('teste', tarefa)
+
+    resposta = web_app.app.test_client().get(f'/api/jobs/{job_id}/eventos')
+    eventos = []
+    limite = time.time() + 10
+    for pedaco in resposta.response:
+        assert time.time() < limite, "eventos da tarefa não chegaram"
+        texto = pedaco.decode('utf-8') if isinstance(pedaco, bytes) else pedaco
+        if not texto.startswith('data: '):
+            continue
+        evento = json.loads(texto[len('data: '):])
+        eventos.append(evento)
+        if evento['progresso'].get('linhas_lidas') == 5:
+            liberar.set()
+    resposta.close()
+    outro_worker.encerrar()
+
+    assert {'linhas_lidas': 5} in [evento['progresso'] for evento in eventos]
+    assert eventos[-1]['estado'] == CONCLUIDO
+    assert eventos[-1]['resultado'] == {'ok': True}
@@ -0,0 +1,92 @@
+"""Testes dos comandos SQL por dialeto (sql_dialetos.py)"""
+
+import sqlite3
+
+import pytest
+
+from sql_dialetos import (MAX_LINHAS_POR_INSERT, comandos_insert, criar_tabela, inicio_transacao,
+                          validar_dialeto, validar_linhas_por_insert)
+
+COLUNAS = ['uf', 'cod_municipio', 'nome_municipio']
+LINHAS = [('GO', '925000', 'GOIANIA'), ('SP', '710700', "SANTA BARBARA D'OESTE")]
+
+
+@pytest.mark.parametrize('valor, esperado', [
+    (None, 1), ('', 1), (0, 1), ('-5', 1), (1, 1), ('500', 500), (1000, 1000), ('1001', 1000), (10**6, 1000),
+])
+def test_linhas_por_insert_limitadas_entre_1_e_1000(valor, esperado):
+    assert validar_linhas_por_insert(valor) == esperado
+    assert MAX_LINHAS_POR_INSERT == 1000
+
+
+def test_linhas_por_insert_e_dialeto_invalidos():
+    with pytest.raises(ValueError):
+        validar_linhas_por_insert('abc')
+    with pytest.raises(ValueError):
+        validar_dialeto('oracle')
+    assert validar_dialeto(' PG ') == 'postgresql'
+    assert validar_dialeto(None) == 'sqlite'
+
+
+@pytest.mark.parametrize('dialeto, esperado', [
+    ('sqlite', (
+        "INSERT OR REPLACE INTO tb_municipios (uf, cod_municipio, nome_municipio) VALUES\n"
+        "    ('GO', '925000', 'GOIANIA'),\n"
+        "    ('SP', '710700', 'SANTA BARBARA D''OESTE');\n"
+    )),
+    ('postgresql', (
+        "INSERT INTO tb_municipios (uf, cod_municipio, nome_municipio) VALUES\n"
+        "    ('GO', '925000', 'GOIANIA'),\n"
+        "    ('SP', '710700', 'SANTA BARBARA D''OESTE')\n"
+        "ON CONFLICT (uf, cod_municipio) DO UPDATE SET nome_municipio = EXCLUDED.nome_municipio;\n"
+    )),
+    ('mysql', (
+        "INSERT INTO tb_municipios (uf, cod_municipio, nome_municipio) VALUES\n"
+        "    ('GO', '925000', 'GOIANIA'),\n"
+        "    ('SP', '710700', 'SANTA BARBARA D''OESTE')\n"
+        "ON DUPLICATE KEY UPDATE nome_municipio = VALUES(nome_municipio);\n"
+    )),
+])
+def test_upsert_com_varias_linhas_por_dialeto(dialeto, esperado):
+    assert list(comandos_insert(dialeto, COLUNAS, LINHAS, 2)) == [esperado]
+
+
+def test_upsert_sem_colunas_a_atualizar_e_escape_do_mysql():
+    colunas = ['uf', 'cod_municipio']
+    assert list(comandos_insert('postgresql', colunas, [('GO', '925000')])) == [
+        "INSERT INTO tb_municipios (uf, cod_municipio) VALUES ('GO', '925000')\nON CONFLICT DO NOTHING;\n"
+    ]
+    assert list(comandos_insert('mysql', colunas, [('GO', '925000')])) == [
+        "INSERT IGNORE INTO tb_municipios (uf, cod_municipio) VALUES ('GO', '925000');\n"
+    ]
+    # No MySQL a barra invertida também é escapada
+    (comando,) = comandos_insert('mysql', ['nome_municipio'], [('A\\B',)])
+    assert "('A\\\\B')" in comando
+
+
+def test_comandos_agrupados_no_limite_de_linhas():
+    linhas = [('GO', f"{i:06d}", f"MUNICIPIO {i}") for i in range(2500)]
+    comandos = list(comandos_insert('postgresql', COLUNAS, linhas, validar_linhas_por_insert(5000)))
+    assert [comando.count("('GO'") for comando in comandos] == [1000, 1000, 500]
+    assert all(comando.endswith('EXCLUDED.nome_municipio;\n') for comando in comandos)
+
+
+@pytest.mark.parametrize('linhas_por_insert', [1, 2, 1000])
+def test_script_sqlite_executado_com_executescript(linhas_por_insert):
+    conn = sqlite3.connect(':memory:')
+    script = criar_tabela('sqlite') + inicio_transacao('sqlite')
+    script += ''.join(comandos_insert('sqlite', COLUNAS, LINHAS + [('TO', '000100', 'ANANAS')], linhas_por_insert))
+    conn.executescript(script + "COMMIT;\n")
+
+    # Executar de novo com um nome alterado: o upsert substitui a linha
+    alterado = [('GO', '925000', 'GOIÂNIA')]
+    conn.executescript(inicio_transacao('sqlite') + ''.join(
+        comandos_insert('sqlite', COLUNAS, alterado, linhas_por_insert)
+    ) + "COMMIT;\n")
+
+    assert conn.execute("SELECT uf, cod_municipio, nome_municipio FROM tb_municipios ORDER BY uf").fetchall() == [
+        ('GO', '925000', 'GOIÂNIA'),
+        ('SP', '710700', "SANTA BARBARA D'OESTE"),
+        ('TO', '000100', 'ANANAS'),
+    ]
+    conn.close()
@@ -0,0 +1,86 @@
+"""Testes do gerador de scripts SQL de municípios (sql.generator.py)"""
+
+import importlib.util
+import os
+
+import pytest
+from flask import Flask
+
+RAIZ = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+@pytest.fixture
+def modulo_sql():
+    """Módulo sql.generator.py (o nome do arquivo não é importável diretamente)"""
+    spec = importlib.util.spec_from_file_location('sql_generator', os.path.join(RAIZ, 'sql.generator.py'))
+    modulo = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(modulo)
+    return modulo
+
+
+@pytest.fixture
+def cliente_sql(modulo_sql, web_app, arquivo_municipios):
+    """Cliente de uma aplicação com as rotas do gerador SQL"""
+    web_app.db.import_municipios_from_txt(arquivo_municipios)
+    app = Flask(__name__)
+    modulo_sql.setup_sql_generator(app, web_app.db)
+    return app.test_client()
+
+
+def test_script_em_cache_usa_parametros_normalizados_e_avisa_no_cabecalho(cliente_sql):
+    primeira = cliente_sql.post('/api/generate-sql', json={'ufs': ['GO', 'TO', 'GO'], 'limit': '3'}).get_json()
+    assert primeira['params']['limit'] == 3
+    assert primeira['params']['ufs'] == ['GO', 'TO']
+    assert primeira['sql'].count('INSERT OR REPLACE') == 3
+    assert 'Reaproveitado do cache' not in primeira['sql']
+
+    # Mesmos parâmetros escritos de outra forma: o script vem do cache
+    segunda = cliente_sql.post('/api/generate-sql', json={'ufs': ['TO', 'GO'], 'limit': 3}).get_json()
+    assert 'Reaproveitado do cache' in segunda['sql']
+    assert segunda['sql'].split('\n', 2)[2] == primeira['sql'].split('\n', 1)[1]
+
+    # Limite inválido é tratado como "sem limite", na chave e na geração
+    sem_limite = cliente_sql.post('/api/generate-sql', json={'limit': 'abc'}).get_json()
+    assert sem_limite['params']['limit'] == 0
+    assert sem_limite['sql'].count('INSERT OR REPLACE') == 5
+
+
+def test_nova_importacao_invalida_o_cache(cliente_sql, web_app, tmp_path):
+    cliente_sql.post('/api/generate-sql', json={'ufs': ['GO']})
+
+    outro = tmp_path / 'outros.txt'
+    outro.write_text("925000;GOIANIA;GO\n", encoding='utf-8')
+    web_app.db.import_municipios_from_txt(str(outro))
+
+    script = cliente_sql.post('/api/generate-sql', json={'ufs': ['GO']}).get_json()['sql']
+    assert 'Reaproveitado do cache' not in script
+    assert script.count('INSERT OR REPLACE') == 1
+
+
+def test_script_com_erro_depois_do_cabecalho_nao_vai_para_o_cache(cliente_sql, modulo_sql, monkeypatch):
+    def falhar(*args, **kwargs):
+        raise RuntimeError("falha nos INSERTs")
+
+    # O erro acontece depois do cabeçalho: o script não começa com "-- Erro"
+    monkeypatch.setattr(modulo_sql, 'comandos_insert', falhar)
+    script = cliente_sql.post('/api/generate-sql', json={'ufs': ['GO']}).get_json()['sql']
+    assert script.startswith('-- Script SQL')
+    assert '-- Erro ao gerar comandos SQL: falha nos INSERTs' in script
+
+    monkeypatch.undo()
+    script = cliente_sql.post('/api/generate-sql', json={'ufs': ['GO']}).get_json()['sql']
+    assert 'Reaproveitado do cache' not in script
+    assert '-- Erro' not in script
+    assert script.count('INSERT OR REPLACE') == 2
+
+
+def test_geracao_registra_os_erros_na_lista(modulo_sql, web_app, arquivo_municipios):
+    web_app.db.import_municipios_from_txt(arquivo_municipios)
+
+    erros = []
+    script = modulo_sql.generate_sql_commands(web_app.db.db_file, selected_columns=['inexistente'], erros=erros)
+    assert script.startswith('-- Erro') and len(erros) == 1
+
+    erros = []
+    modulo_sql.generate_sql_commands(web_app.db.db_file, ufs=['GO'], erros=erros)
+    assert erros == []
@@ -1,13 +1,19 @@
 from datetime import datetime
+import functools
+import json
 import os
 import sqlite3
 import tempfile
-from flask import Flask, render_template, request, redirect, send_file, url_for, flash, jsonify
+from flask import Flask, Response, make_response, render_template, request, redirect, send_file, stream_with_context, url_for, flash, jsonify
 from flask_wtf import FlaskForm
 from wtforms import FileField, SelectField, SubmitField
 from wtforms.validators import DataRequired
 from werkzeug.utils import secure_filename
 from database import DatabaseManager
+from exportacao import FORMATOS_EXPORTACAO
+from jobs import CONCLUIDO, ESTADOS_FINAIS, JobManager
+from sql_dialetos import (LINHAS_POR_INSERT, comandos_insert, criar_tabela, inicio_transacao,
+                          validar_dialeto, validar_linhas_por_insert)
 import logging
 
 from form import NotaFiscalForm, TomadorForm
@@ -23,17 +29,42 @@ app.secret_key = 'kbl-accounting-rest-goiania'
 app.config['UPLOAD_FOLDER'] = 'uploads'
 os.makedirs(app.config['UPLOAD_FOLDER'], exist_ok=True)
 
+# Importação de municípios na inicialização:
+#   'alterado'   - reimporta apenas se o conteúdo de municipios.txt mudou (padrão)
+#   'sempre'     - reimporta a cada inicialização
+#   'desativado' - não importa; use /importar-municipios
+app.config['MUNICIPIOS_ARQUIVO'] = os.environ.get('MUNICIPIOS_ARQUIVO', 'municipios.txt')
+app.config['MUNICIPIOS_IMPORTACAO_INICIAL'] = os.environ.get('MUNICIPIOS_IMPORTACAO_INICIAL', 'alterado')
+# Parser dos arquivos enviados: 'linhas' (linha a linha) ou 'colunar' (pandas, em blocos)
+app.config['MUNICIPIOS_PARSER'] = os.environ.get('MUNICIPIOS_PARSER', 'linhas')
+# Processos usados na conversão de arquivos grandes enviados (1 = sem paralelismo)
+app.config['MUNICIPIOS_PROCESSOS'] = int(os.environ.get('MUNICIPIOS_PROCESSOS', '1'))
+# Importação diferencial: aplica apenas inclusões, alterações e exclusões, sem
+# esvaziar tb_municipios durante a carga ('0' volta a apagar e regravar tudo)
+app.config['MUNICIPIOS_DIFERENCIAL'] = os.environ.get('MUNICIPIOS_DIFERENCIAL', '1') == '1'
+
+# Arquivos gerados por tarefas em segundo plano (exportações)
+app.config['JOBS_FOLDER'] = os.environ.get('JOBS_FOLDER', 'resultados')
+
+# Segundos em que o navegador pode reutilizar as listas de UFs/municípios sem
+# revalidar (0 = revalida sempre, recebendo 304 sem corpo se nada mudou)
+app.config['MUNICIPIOS_CACHE_MAX_AGE'] = int(os.environ.get('MUNICIPIOS_CACHE_MAX_AGE', '0'))
+
 # Inicializar o gerenciador de banco de dados
 db = DatabaseManager()
-# Isso precisa estar ligado dinamicamente
-
-count = db.import_municipios_from_txt('municipios.txt')
-print(f"{count} municípios importados")
+jobs = JobManager(db.db_file, app.config['JOBS_FOLDER'])
 
-# Consultar municípios de uma UF
-municipios_go = db.get_municipios_by_uf('GO')
-for nome, codigo in municipios_go:
-    print(f"{nome}: {codigo}")
+if app.config['MUNICIPIOS_IMPORTACAO_INICIAL'] == 'sempre':
+    count = db.import_municipios_from_txt(
+        app.config['MUNICIPIOS_ARQUIVO'], diferencial=app.config['MUNICIPIOS_DIFERENCIAL']
+    )
+    logger.info(f"{count} municípios importados")
+elif app.config['MUNICIPIOS_IMPORTACAO_INICIAL'] == 'alterado':
+    count = db.sincronizar_municipios(
+        app.config['MUNICIPIOS_ARQUIVO'], diferencial=app.config['MUNICIPIOS_DIFERENCIAL']
+    )
+    if count:
+        logger.info(f"{count} municípios importados")
 
 
 @app.context_processor
@@ -46,6 +77,33 @@ def index():
     logger.info("Acessando a página inicial")
     return render_template('index.html')
 
+def _salvar_upload(arquivo):
+    """
+    Salva um arquivo enviado com nome único na pasta de uploads
+
+    O nome original (secure_filename) fica no fim do nome gerado, mas dois
+    envios com o mesmo nome não se sobrescrevem, mesmo enquanto o primeiro
+    ainda é lido por uma importação em segundo plano.
+
+    :param arquivo: Arquivo recebido na requisição (FileStorage)
+    :return: Caminho do arquivo salvo
+    """
+    descritor, caminho = tempfile.mkstemp(
+        dir=app.config['UPLOAD_FOLDER'], suffix=f"_{secure_filename(arquivo.filename)}"
+    )
+    with os.fdopen(descritor, 'wb') as destino:
+        arquivo.save(destino)
+    return caminho
+
+
+def _remover_upload(caminho):
+    """Remove um arquivo enviado que já foi processado"""
+    try:
+        os.remove(caminho)
+    except OSError as e:
+        logger.warning(f"Não foi possível remover o upload {caminho}: {e}")
+
+
 class ImportarMunicipiosForm(FlaskForm):
     arquivo = FileField('Arquivo TXT', validators=[DataRequired()])
     submit = SubmitField('Importar Municípios')
@@ -59,8 +117,7 @@ def importar_municipios():
         # Save the uploaded file
         f = form.arquivo.data
         filename = secure_filename(f.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        f.save(filepath)
+        filepath = _salvar_upload(f)
         
         # Log file details
         logger.info(f"Arquivo recebido: {filename}")
@@ -91,10 +148,144 @@ def importar_municipios():
                 'status': 'error',
                 'message': error_msg
             }
+        finally:
+            _remover_upload(filepath)
     logger.info("Renderizando a página de importação de municípios")
     logger.info(f"Resultado da importação: {resultado}")        
     return render_template('importar_municipios.html', form=form, resultado=resultado)
 
+def _job_importar_municipios(contexto, filepath):
+    """Tarefa de importação de municípios (executada em segundo plano; remove o upload ao final)"""
+    ultimo_progresso = {}
+
+    def progresso(dados):
+        ultimo_progresso.update(dados)
+        contexto.atualizar_progresso(**dados)
+
+    try:
+        count = db.import_municipios_from_txt(
+            filepath, progresso=progresso, parser=app.config['MUNICIPIOS_PARSER'],
+            diferencial=app.config['MUNICIPIOS_DIFERENCIAL'], processos=app.config['MUNICIPIOS_PROCESSOS']
+        )
+    finally:
+        _remover_upload(filepath)
+    if count > 0:
+        logger.info(f"{count} municípios importados com sucesso!")
+        resultado = {
+            'status': 'success',
+            'message': f'{count} municípios importados com sucesso!',
+            'count': count
+        }
+        # Alterações aplicadas pela importação diferencial
+        for chave in ('inseridos', 'atualizados', 'removidos'):
+            if chave in ultimo_progresso:
+                resultado[chave] = ultimo_progresso[chave]
+        return resultado
+    logger.warning('Nenhum município foi importado. Verifique o formato do arquivo.')
+    return {
+        'status': 'warning',
+        'message': 'Nenhum município foi importado. Verifique o formato do arquivo.'
+    }
+
+
+def _job_exportar_notas(contexto, formato, limpar):
+    """Tarefa de exportação de notas fiscais (executada em segundo plano)"""
+    mimetype, extensao = FORMATOS_EXPORTACAO[formato]
+    caminho = contexto.caminho_resultado(extensao)
+    if not db.export_to_excel(caminho, formato=formato):
+        raise RuntimeError("Não foi possível exportar os dados")
+
+    nome_arquivo = f'notas_fiscais_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{extensao}'
+    contexto.definir_arquivo(caminho, nome_arquivo, mimetype)
+
+    if limpar and db.limpar_notas_fiscais():
+        logger.info("Tabela de notas fiscais foi limpa após exportação.")
+    return {'status': 'success', 'message': 'Exportação concluída', 'limpou': limpar}
+
+
+def _resposta_job_enfileirado(job_id):
+    """Resposta 202 padrão para tarefas enfileiradas"""
+    return jsonify({
+        'status': 'queued',
+        'job_id': job_id,
+        'status_url': url_for('api_job_status', job_id=job_id)
+    }), 202
+
+
+def _estado_job(job):
+    """Representação pública de uma tarefa (sem o caminho do arquivo no servidor)"""
+    resposta = {
+        'job_id': job['id'],
+        'tipo': job['tipo'],
+        'estado': job['estado'],
+        'progresso': job['progresso'],
+        'resultado': job['resultado'],
+        'erro': job['erro'],
+        'criado_em': job['criado_em'],
+        'atualizado_em': job['atualizado_em'],
+    }
+    if job['estado'] == CONCLUIDO and job['arquivo']:
+        resposta['download_url'] = url_for('api_job_download', job_id=job['id'])
+    return resposta
+
+
+@app.route('/api/jobs/<job_id>')
+def api_job_status(job_id):
+    """API para consultar o estado e o progresso de uma tarefa em segundo plano"""
+    job = jobs.obter(job_id)
+    if job is None:
+        return jsonify({'status': 'error', 'message': 'Tarefa não encontrada'}), 404
+    return jsonify(_estado_job(job))
+
+
+@app.route('/api/jobs/<job_id>/eventos')
+def api_job_eventos(job_id):
+    """
+    Server-sent events com o estado da tarefa a cada mudança de progresso
+
+    Cada evento traz o mesmo JSON de /api/jobs/<id>; o fluxo termina quando a
+    tarefa é concluída ou falha.
+    """
+    if jobs.obter(job_id) is None:
+        return jsonify({'status': 'error', 'message': 'Tarefa não encontrada'}), 404
+
+    def eventos():
+        versao = -1
+        while True:
+            nova_versao = jobs.aguardar_mudanca(job_id, versao)
+            if nova_versao == versao:
+                # Comentário SSE para manter a conexão aberta em proxies
+                yield ': aguardando\n\n'
+                continue
+            versao = nova_versao
+
+            job = jobs.obter(job_id)
+            yield f"data: {json.dumps(_estado_job(job), ensure_ascii=False)}\n\n"
+            if job['estado'] in ESTADOS_FINAIS:
+                break
+
+    return Response(
+        stream_with_context(eventos()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
+
+
+@app.route('/api/jobs/<job_id>/download')
+def api_job_download(job_id):
+    """Download do arquivo gerado por uma tarefa concluída"""
+    job = jobs.obter(job_id)
+    if job is None or job['estado'] != CONCLUIDO or not job['arquivo'] or not os.path.exists(job['arquivo']):
+        return jsonify({'status': 'error', 'message': 'Arquivo não disponível'}), 404
+
+    return send_file(
+        os.path.abspath(job['arquivo']),
+        as_attachment=True,
+        download_name=job['nome_arquivo'],
+        mimetype=job['mimetype']
+    )
+
+
 # API endpoint for AJAX import
 @app.route('/api/importar-municipios', methods=['POST'])
 def api_importar_municipios():
@@ -107,48 +298,62 @@ def api_importar_municipios():
         logger.error
         return jsonify({'status': 'error', 'message': 'Nenhum arquivo selecionado'})
         
+    filepath = None
     try:
-        filename = secure_filename(file.filename)
-        filepath = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-        file.save(filepath)
+        filepath = _salvar_upload(file)
         logger.info(f"Arquivo salvo em: {filepath}")
-        # Import municipalities
-        count = db.import_municipios_from_txt(filepath)
-        
-        if count > 0:
-            logger.info(f"{count} municípios importados com sucesso!")
-            return jsonify({
-                'status': 'success',
-                'message': f'{count} municípios importados com sucesso!',
-                'count': count
-            })
-        else:
-            logger.warning('Nenhum município foi importado. Verifique o formato do arquivo.')
-            return jsonify({
-                'status': 'warning',
-                'message': 'Nenhum município foi importado. Verifique o formato do arquivo.'
-            })
+        # Importar em segundo plano; o cliente acompanha por /api/jobs/<id>
+        # (a tarefa remove o arquivo ao terminar)
+        job_id = jobs.enfileirar('importacao_municipios', _job_importar_municipios, filepath)
+        return _resposta_job_enfileirado(job_id)
             
     except Exception as e:
+        if filepath:
+            _remover_upload(filepath)
         error_msg = f"Erro durante a importação: {str(e)}"
         logger.error(error_msg)
         return jsonify({
             'status': 'error',
             'message': error_msg
         })
+def cache_municipios(view):
+    """
+    Validação de cache HTTP para APIs que dependem apenas dos municípios
+
+    A ETag é a versão dos dados de municípios (incrementada a cada
+    importação). Se o navegador já tem essa versão (If-None-Match), a rota
+    nem é executada e a resposta é 304 sem corpo.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        versao = db.get_versao_municipios()
+        if versao is None:
+            return view(*args, **kwargs)
+
+        etag = f"municipios-{versao}"
+        if request.if_none_match.contains(etag):
+            resposta = Response(status=304)
+        else:
+            resposta = make_response(view(*args, **kwargs))
+            # Erros não são armazenados pelo navegador
+            if resposta.status_code != 200:
+                return resposta
+
+        resposta.set_etag(etag)
+        max_age = app.config['MUNICIPIOS_CACHE_MAX_AGE']
+        resposta.headers['Cache-Control'] = f"public, max-age={max_age}" if max_age > 0 else 'no-cache'
+        return resposta
+    return wrapper
+
+
 @app.route('/api/ufs', methods=['GET'])
+@cache_municipios
 def api_ufs():
     """API para listar todas as UFs disponíveis"""
     try:
-        # Conexão direta ao banco
-        conn = sqlite3.connect(db.db_file)
-        cursor = conn.cursor()
-        
-        # Buscar UFs
-        cursor.execute("SELECT DISTINCT uf FROM tb_municipios ORDER BY uf")
-        ufs = [row[0] for row in cursor.fetchall()]
+        # Buscar UFs (índice de municípios em memória)
+        ufs = db.get_all_ufs()
         
-        conn.close()
         logger.info(f"API UFs: retornando {len(ufs)} UFs")
         
         return jsonify({
@@ -163,6 +368,7 @@ def api_ufs():
         }), 500
 
 @app.route('/api/municipios/<uf>', methods=['GET'])
+@cache_municipios
 def api_municipios(uf):
     """API para listar municípios de uma UF específica"""
     try:
@@ -174,19 +380,8 @@ def api_municipios(uf):
                 'message': 'UF inválida'
             }), 400
             
-        # Conexão direta ao banco
-        conn = sqlite3.connect(db.db_file)
-        cursor = conn.cursor()
-        
-        # Buscar municípios
-        cursor.execute("""
-            SELECT nome_municipio, cod_municipio 
-            FROM tb_municipios 
-            WHERE uf = ? 
-            ORDER BY nome_municipio
-        """, (uf.upper(),))
-        
-        municipios_data = cursor.fetchall()
+        # Buscar municípios (índice de municípios em memória)
+        municipios_data = db.get_municipios_by_uf(uf.upper())
         
         # Formatar como JSON
         municipios = []
@@ -196,7 +391,6 @@ def api_municipios(uf):
                 'codigo': codigo
             })
         
-        conn.close()
         logger.info(f"API Municípios: retornando {len(municipios)} municípios para UF {uf}")
         
         return jsonify({
@@ -212,7 +406,7 @@ def api_municipios(uf):
 def verificar_municipios_db():
     """Verifica o estado dos municípios no banco de dados"""
     try:
-        conn = sqlite3.connect(db.db_file)
+        conn = db.create_connection()
         cursor = conn.cursor()
         
         # Verificar tabela
@@ -221,6 +415,7 @@ def verificar_municipios_db():
         
         if not tabela_existe:
             print("Tabela tb_municipios não existe!")
+            conn.close()
             return False
         
         # Contar registros
@@ -254,19 +449,8 @@ def api_municipio_por_codigo(codigo):
                 'message': 'Código inválido'
             }), 400
             
-        # Conexão direta ao banco
-        conn = sqlite3.connect(db.db_file)
-        cursor = conn.cursor()
-        
-        # Buscar município
-        cursor.execute("""
-            SELECT nome_municipio, uf, cod_municipio 
-            FROM tb_municipios 
-            WHERE cod_municipio = ?
-        """, (codigo_numerico,))
-        
-        municipio = cursor.fetchone()
-        conn.close()
+        # Buscar município (índice de municípios em memória)
+        municipio = db.get_municipio_by_codigo(codigo_numerico)
         
         if not municipio:
             logger.warning(f"Município com código {codigo} não encontrado")
@@ -380,8 +564,18 @@ def contar_municipios(self, uf=None):
                 conn.close()
     return 0
 
-def exportar_municipios_sql(self, uf=None, limit=0):
-    """Exporta municípios como script SQL"""
+def exportar_municipios_sql(self, uf=None, limit=0, dialeto='sqlite', linhas_por_insert=LINHAS_POR_INSERT):
+    """
+    Exporta municípios como script SQL
+
+    :param uf: UF para filtrar (None = todas)
+    :param limit: Número máximo de registros (0 = sem limite)
+    :param dialeto: Banco de destino do script (sqlite, postgresql ou mysql)
+    :param linhas_por_insert: Quantidade de municípios por comando INSERT
+    :return: String com o script SQL
+    """
+    dialeto = validar_dialeto(dialeto)
+    linhas_por_insert = validar_linhas_por_insert(linhas_por_insert)
     conn = self.create_connection()
     if conn is not None:
         try:
@@ -411,24 +605,19 @@ def exportar_municipios_sql(self, uf=None, limit=0):
             # Gerar SQL
             sql = "-- Script SQL para importação de municípios\n"
             sql += f"-- Gerado em: {datetime.now().strftime('%d/%m/%Y %H:%M:%S')}\n"
-            sql += f"-- Total de municípios: {len(municipios)}\n\n"
+            sql += f"-- Total de municípios: {len(municipios)}\n"
+            sql += f"-- Dialeto: {dialeto}\n\n"
             
             # CREATE TABLE
-            sql += "CREATE TABLE IF NOT EXISTS tb_municipios (\n"
-            sql += "    uf TEXT,\n"
-            sql += "    cod_municipio TEXT,\n"
-            sql += "    nome_municipio TEXT,\n"
-            sql += "    PRIMARY KEY (uf, cod_municipio)\n"
-            sql += ");\n\n"
+            sql += criar_tabela(dialeto) + "\n"
             
             # BEGIN TRANSACTION
-            sql += "BEGIN TRANSACTION;\n\n"
+            sql += inicio_transacao(dialeto) + "\n"
             
-            # INSERT OR REPLACE
-            for uf, cod, nome in municipios:
-                # Escapar aspas simples
-                nome_escaped = nome.replace("'", "''") if nome else ""
-                sql += f"INSERT OR REPLACE INTO tb_municipios (uf, cod_municipio, nome_municipio) VALUES ('{uf}', '{cod}', '{nome_escaped}');\n"
+            # INSERT com upsert, agrupando linhas_por_insert municípios por comando
+            sql += ''.join(comandos_insert(
+                dialeto, ('uf', 'cod_municipio', 'nome_municipio'), municipios, linhas_por_insert
+            ))
             
             # COMMIT
             sql += "\nCOMMIT;\n"
@@ -446,8 +635,20 @@ def exportar_municipios_sql(self, uf=None, limit=0):
 def listar_notas():
     search = request.args.get('search', '')
     page = request.args.get('page', 1, type=int)
-    result = db.get_notas_fiscais_paginadas(page=page, search=search)
-    return render_template('notas/index.html', notas=result['rows'], )
+    after = request.args.get('after')
+    try:
+        result = db.get_notas_fiscais_paginadas(page=page, search=search, after=after)
+    except ValueError as e:
+        logger.warning(f"Listagem de notas com cursor inválido: {e}")
+        return "Cursor de paginação inválido", 400
+    return render_template(
+        'notas/index.html',
+        notas=result['rows'],
+        search=search,
+        total=result['total'],
+        total_exato=result['total_exato'],
+        next_after=result['next'],
+    )
 
 
 @app.route('/notas/novo', methods=['GET', 'POST'])
@@ -601,70 +802,47 @@ def excluir_nota(id):
 
 @app.route('/notas/exportar-excel', methods=['GET', 'POST'])
 def exportar_excel():
-    """Rota para exportar todas as notas fiscais para Excel"""
+    """Rota para exportar todas as notas fiscais para Excel (ou formato=csv/parquet)"""
     if request.method == 'POST':
-        # Criar arquivo temporário
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.xlsx') as temp:
-            temp_path = temp.name
-            logger.info(f"Arquivo temporário criado: {temp_path}")
+        formato = request.form.get('formato', 'xlsx')
+        if formato not in FORMATOS_EXPORTACAO:
+            flash(f"Formato de exportação não suportado: {formato}", "danger")
+            return redirect(url_for('exportar_excel'))
+
+        limpar = request.form.get('limpar_apos_exportar') == 'sim'
+
+        if request.form.get('em_segundo_plano') == 'sim':
+            job_id = jobs.enfileirar('exportacao_notas', _job_exportar_notas, formato, limpar)
+            return _resposta_job_enfileirado(job_id)
+
+        def limpar_apos_exportar():
+            # Só depois do último pedaço: a leitura usa a tabela até o fim
+            logger.info("Limpando tabela de notas fiscais após exportação")
+            if db.limpar_notas_fiscais():
+                logger.info("Tabela de notas fiscais foi limpa após exportação.")
 
         try:
-            # Exportar todas as notas fiscais para Excel
-            if db.export_to_excel(temp_path):
-                # Se solicitado, limpar a tabela após exportação
-                if request.form.get('limpar_apos_exportar') == 'sim':
-                    if db.limpar_notas_fiscais():
-                        logger.info("Tabela de notas fiscais foi limpa após exportação.")   
-                        flash("Tabela de notas fiscais foi limpa após exportação.", "info")
-
-                # Enviar o arquivo para download
-                logger.info(f"Enviando arquivo para download: {temp_path}")
-                return send_file(
-                    temp_path,
-                    as_attachment=True,
-                    download_name=f'notas_fiscais_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-                )
-            else:
-                logger.error("Erro ao exportar dados para Excel")   
-                flash("Não foi possível exportar os dados", "danger")
-        except Exception as e:
-            logger.error(f"Erro ao exportar dados: {str(e)}")
-            flash(f"Erro ao exportar dados: {str(e)}", "danger")
-        finally:
-            # Limpar arquivo temporário
-            try:
-                logger.info(f"Removendo arquivo temporário: {temp_path}")
-                os.unlink(temp_path)
-            except:
-                logger.error(f"Erro ao remover arquivo temporário: {temp_path}")
-                pass
-
-                # Para GET, mostrar tela de exportação
-                logger.info("Renderizando a página de exportação de notas fiscais") 
-                return render_template('notas/exportar.html')
-        try:
-            # Exportar para Excel
-            if db.export_to_excel(temp_path):
-                # Se solicitado, limpar a tabela após exportação
-                if request.form.get('limpar_apos_exportar') == 'sim':
-                    logger.info("Limpando tabela de notas fiscais após exportação")
-                    if db.limpar_notas_fiscais():
-                        logger.info("Tabela de notas fiscais foi limpa após exportação.")   
-                        flash("Tabela de notas fiscais foi limpa após exportação.", "info")
-
-                # Enviar o arquivo para download
-                logger.info(f"Enviando arquivo para download: {temp_path}")
-                return send_file(
-                    temp_path,
-                    as_attachment=True,
-                    download_name=f'notas_fiscais_{datetime.now().strftime("%Y%m%d_%H%M%S")}.xlsx'
-                )
-            else:
-                logger.error("Erro ao exportar dados para Excel")
-                flash("Não foi possível exportar os dados", "danger")
+            pedacos = db.gerar_exportacao_notas(
+                formato, ao_concluir=limpar_apos_exportar if limpar else None
+            )
         except Exception as e:
             logger.error(f"Erro ao exportar dados: {str(e)}")
             flash(f"Erro ao exportar dados: {str(e)}", "danger")
+            return redirect(url_for('exportar_excel'))
+
+        # Enviar o arquivo à medida que é gerado (CSV e Parquet); o XLSX só
+        # começa a sair depois de gravado por inteiro (ver exportacao.gerar_xlsx)
+        mimetype, extensao = FORMATOS_EXPORTACAO[formato]
+        nome_arquivo = f'notas_fiscais_{datetime.now().strftime("%Y%m%d_%H%M%S")}.{extensao}'
+        logger.info(f"Enviando exportação para download: {nome_arquivo}")
+        return Response(
+            pedacos,
+            mimetype=mimetype,
+            headers={
+                'Content-Disposition': f'attachment; filename="{nome_arquivo}"',
+                'X-Accel-Buffering': 'no',
+            }
+        )
 
     # Para GET, mostrar tela de seleção do tomador
     tomadores = db.get_all_tomadores()
@@ -1022,6 +1200,7 @@ def api_fornecedor_por_cnpj(cnpj):
         }), 500
 
 @app.route('/api/ufs', methods=['GET'])
+@cache_municipios
 def api_get_ufs():
     """API para obter todas as UFs disponíveis"""
     try:
@@ -1043,6 +1222,7 @@ def api_get_ufs():
         }), 500
 
 @app.route('/api/municipios/<uf>', methods=['GET'])
+@cache_municipios
 def api_get_municipios(uf):
     """API para obter municípios de uma UF específica"""
     try: